@@ -1 +1,9 @@
-# API模块初始化文件 
\ No newline at end of file
+# API模块初始化文件
+import os
+from dotenv import load_dotenv
+
+# 加载环境变量：各模块在导入时读取配置，.env只需在包初始化时加载一次
+load_dotenv()
+
+# 服务自己维护的数据库和数据文件（任务库、共享存储、增量数据源等）的默认目录
+DATA_DIR = os.getenv("DATA_DIR", "data")
@@ -0,0 +1,119 @@
+import os
+import json
+import uuid
+import shutil
+import zipfile
+from typing import List, Dict, Any, Tuple
+from .logger import script_logger
+
+# 批量转换配置
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 1000))  # 单个批次最多文件数
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", 2 * 1024 * 1024 * 1024))  # 单个批次解压后的总大小上限
+
+
+def create_batch_dir(base_dir: str) -> str:
+    """为批次创建独立的工作目录"""
+    batch_dir = os.path.join(base_dir, f"batch_{uuid.uuid4().hex}")
+    os.makedirs(batch_dir, exist_ok=True)
+    return batch_dir
+
+
+def _unique_name(name: str, used: set) -> str:
+    """同名文件追加序号，避免互相覆盖"""
+    candidate = name
+    stem, ext = os.path.splitext(name)
+    index = 1
+    while candidate in used:
+        candidate = f"{stem}_{index}{ext}"
+        index += 1
+    used.add(candidate)
+    return candidate
+
+
+def save_batch_files(uploads: List[Tuple[str, Any]], batch_dir: str) -> List[Tuple[str, str]]:
+    """
+    将上传的文件分块保存到批次目录
+
+    参数:
+        uploads: (原始文件名, 文件对象) 列表
+
+    返回:
+        List[Tuple[str, str]]: (批次内文件名, 文件路径) 列表
+    """
+    used = set()
+    saved = []
+    for filename, fileobj in uploads:
+        name = _unique_name(os.path.basename(filename or "") or "file.txt", used)
+        path = os.path.join(batch_dir, name)
+        fileobj.seek(0)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(fileobj, f, 1024 * 1024)
+        saved.append((name, path))
+    return saved
+
+
+def extract_archive(archive_path: str, batch_dir: str) -> List[Tuple[str, str]]:
+    """
+    解压zip压缩包中的文件到批次目录
+
+    只保留文件名（忽略压缩包内的目录结构），跳过目录和隐藏文件，并检查文件数和解压后总大小
+
+    返回:
+        List[Tuple[str, str]]: (批次内文件名, 文件路径) 列表
+    """
+    used = set()
+    saved = []
+    total_size = 0
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            base = os.path.basename(info.filename)
+            if info.is_dir() or not base or base.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+            total_size += info.file_size
+            if len(saved) >= BATCH_MAX_FILES or total_size > BATCH_MAX_BYTES:
+                raise ValueError(f"压缩包超出批量限制（最多 {BATCH_MAX_FILES} 个文件、{BATCH_MAX_BYTES} 字节）")
+            name = _unique_name(base, used)
+            path = os.path.join(batch_dir, name)
+            with archive.open(info) as src, open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            saved.append((name, path))
+    script_logger.debug(f"解压压缩包: {archive_path}, 文件数: {len(saved)}")
+    return saved
+
+
+def pick_representative(files: List[Tuple[str, str]]) -> str:
+    """选择用于生成脚本的代表性文件：取最大的文件，其内容结构通常最完整"""
+    return max(files, key=lambda item: os.path.getsize(item[1]))[1]
+
+
+def formatted_name(name: str) -> str:
+    """转换结果在压缩包中的文件名"""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}_formatted{ext}"
+
+
+def build_result_archive(results: List[Dict[str, Any]], archive_path: str, script_content: str):
+    """
+    将各文件的转换结果和清单打包为zip
+
+    清单manifest.json记录每个文件的转换状态、输出大小或错误信息
+    """
+    manifest = []
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            entry = {"file": result["file"], "status": result["status"]}
+            if result["status"] == "success":
+                entry["output"] = formatted_name(result["file"])
+                entry["output_size"] = os.path.getsize(result["output_file"])
+                archive.write(result["output_file"], entry["output"])
+            else:
+                entry["error"] = result["error"]
+            manifest.append(entry)
+        archive.writestr("manifest.json", json.dumps({
+            "total": len(results),
+            "succeeded": sum(1 for r in results if r["status"] == "success"),
+            "failed": sum(1 for r in results if r["status"] != "success"),
+            "files": manifest
+        }, ensure_ascii=False, indent=2))
+        archive.writestr("format_script.py", script_content)
+    script_logger.info(f"批量转换结果已打包: {archive_path}, 文件数: {len(results)}")
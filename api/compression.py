@@ -0,0 +1,275 @@
+import os
+import gzip
+import zlib
+import shutil
+import struct
+from typing import Iterator, Optional, Tuple
+from fastapi import HTTPException
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 传输压缩配置
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))  # 小于该大小的响应不压缩（字节）
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", 6))  # gzip响应压缩级别
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", 3))  # zstd响应压缩级别（需安装zstandard）
+COMPRESSION_MAX_BYTES = int(os.getenv("COMPRESSION_MAX_BYTES", 4 * 1024 ** 3))  # 压缩上传解压后的大小上限（字节）
+
+# 值得压缩的响应类型
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/x-ndjson", "application/xml",
+    "application/javascript", "application/csv", "image/svg+xml"
+)
+
+GZIP_MAGIC = b"\x1f\x8b"
+GZIP_SUFFIX = ".gz"
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def _parse_accept(accept_encoding: str) -> dict:
+    """解析Accept-Encoding为 {编码: q值}"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """客户端是否接受指定的编码"""
+    accepted = _parse_accept(accept_encoding)
+    return accepted.get(encoding, accepted.get("*", 0)) > 0
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """根据Accept-Encoding选择响应编码：都可接受时优先zstd，不接受压缩时返回None"""
+    for encoding in supported_encodings():
+        if accepts_encoding(accept_encoding, encoding):
+            return encoding
+    return None
+
+
+def _compressor(encoding: str, level: int):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+class StreamDecoder:
+    """流式解压gzip（支持多个成员首尾相接）或zstd数据，并限制解压后的总大小"""
+
+    def __init__(self, encoding: str, max_bytes: int = COMPRESSION_MAX_BYTES):
+        self.encoding = encoding
+        self.max_bytes = max_bytes
+        self.total = 0
+        self._decoder = self._new()
+
+    def _new(self):
+        if self.encoding == "zstd":
+            return zstandard.ZstdDecompressor().decompressobj()
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def _count(self, data: bytes) -> bytes:
+        self.total += len(data)
+        if self.max_bytes and self.total > self.max_bytes:
+            raise ValueError(f"解压后的内容超过 {self.max_bytes} 字节")
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        out = []
+        while data:
+            out.append(self._decoder.decompress(data))
+            if self.encoding == "gzip" and self._decoder.eof:
+                data = self._decoder.unused_data
+                self._decoder = self._new()
+            else:
+                data = b""
+        return self._count(b"".join(out))
+
+    def flush(self) -> bytes:
+        if self.encoding == "gzip":
+            return self._count(self._decoder.flush())
+        return b""
+
+
+def is_gzip_path(path: str) -> bool:
+    """结果存储等位置以.gz后缀表示文件压缩保存"""
+    return path.endswith(GZIP_SUFFIX)
+
+
+def gzip_plain_size(path: str) -> int:
+    """从gzip尾部读取解压后的大小（对4GB以内的单成员文件准确）"""
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack("<I", f.read(4))[0]
+
+
+def plain_size(path: str) -> int:
+    return gzip_plain_size(path) if is_gzip_path(path) else os.path.getsize(path)
+
+
+def open_plain(path: str, mode: str = "rb", **kwargs):
+    """打开文件，压缩保存的文件透明解压"""
+    if is_gzip_path(path):
+        return gzip.open(path, mode if "b" in mode else mode + "t", **kwargs)
+    return open(path, mode, **kwargs)
+
+
+def iter_plain_chunks(path: str, chunk_size: int, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """分块读取文件解压后的内容，start/end为闭区间字节范围"""
+    with open_plain(path, "rb") as f:
+        if start:
+            f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def compress_file(src: str, dst: str, level: int):
+    """把文件以gzip格式压缩保存"""
+    with open(src, "rb") as fin, gzip.open(dst, "wb", compresslevel=level) as fout:
+        shutil.copyfileobj(fin, fout, 1024 * 1024)
+
+
+def is_gzip_stream(fileobj) -> bool:
+    """检查可定位的文件对象是否以gzip魔数开头，不改变读取位置"""
+    position = fileobj.tell()
+    head = fileobj.read(2)
+    fileobj.seek(position)
+    return head == GZIP_MAGIC
+
+
+class CompressionMiddleware:
+    """
+    传输压缩中间件
+
+    请求体带Content-Encoding: gzip（或安装zstandard时的zstd）时流式解压后交给应用；
+    响应按Accept-Encoding压缩，已编码的响应、Range响应、304以及非文本类型和过小的响应不压缩。
+    压缩后的响应ETag改为弱校验形式
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, level: int = COMPRESSION_LEVEL):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            return await self.app(scope, receive, send)
+
+        headers = Headers(scope=scope)
+        request_encoding = headers.get("content-encoding", "").strip().lower()
+        if request_encoding in ("gzip", "x-gzip") or (request_encoding == "zstd" and zstandard is not None):
+            scope, receive = self._decompress_request(scope, receive, "zstd" if request_encoding == "zstd" else "gzip")
+
+        encoding = negotiate(headers.get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        # 压缩时不能使用直接发送文件的扩展
+        extensions = {k: v for k, v in scope.get("extensions", {}).items() if k != "http.response.pathsend"}
+        scope = {**scope, "extensions": extensions}
+        await _CompressingResponder(self.app, encoding, self.minimum_size, self.level)(scope, receive, send)
+
+    @staticmethod
+    def _decompress_request(scope, receive, encoding: str):
+        headers = [(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")]
+        decoder = StreamDecoder(encoding)
+
+        async def receive_plain():
+            message = await receive()
+            if message["type"] == "http.request":
+                try:
+                    body = decoder.decompress(message.get("body", b""))
+                    if not message.get("more_body", False):
+                        body += decoder.flush()
+                except ValueError as e:
+                    raise HTTPException(status_code=413, detail=str(e))
+                except Exception as e:
+                    raise HTTPException(status_code=400, detail=f"请求体解压失败: {str(e)}")
+                message = {**message, "body": body}
+            return message
+
+        return {**scope, "headers": headers}, receive_plain
+
+
+class _CompressingResponder:
+    """对单个响应按需压缩"""
+
+    def __init__(self, app, encoding: str, minimum_size: int, level: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.level = level
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self._send)
+
+    def _compressible(self, headers: MutableHeaders) -> bool:
+        status = self.start_message["status"]
+        if status < 200 or status in (204, 206, 304):
+            return False
+        if "content-encoding" in headers or "content-range" in headers:
+            return False
+        content_type = headers.get("content-type", "").lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    async def _send(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            self.start_message = message
+            return
+        if message_type != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            if not self._compressible(headers) or (not more_body and len(body) < self.minimum_size):
+                self.passthrough = True
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+            self.compressor = _compressor(self.encoding, self.level)
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if "content-length" in headers:
+                del headers["content-length"]
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            await self.send(self.start_message)
+
+        data = self.compressor.compress(body)
+        if not more_body:
+            data += self.compressor.flush()
+        if data or not more_body:
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -0,0 +1,330 @@
+import os
+import re
+import csv
+import json
+import hashlib
+import inspect
+import threading
+from typing import Callable, Dict, Any, Optional, List, Tuple, Pattern
+from .logger import script_logger
+from .script_cache import normalize_instruction
+from .lifecycle import shard_path
+from .metrics import register_collector, snapshot_counter
+
+# 内置转换器配置
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+
+# 分隔符名称
+DELIMITERS = {
+    "空格": " ",
+    "制表符": "\t",
+    "tab": "\t",
+    "逗号": ",",
+    "分号": ";",
+    "竖线": "|"
+}
+_DELIMITER_NAMES = "|".join(DELIMITERS)
+
+# URL匹配规则：遇到空白、引号、尖括号和中文标点时结束
+URL_PATTERN = r"https?://[^\s<>\"'，。；、）】]+"
+
+
+class Converter:
+    """内置转换器：匹配格式转换要求的正则表达式，以及执行转换的函数"""
+
+    def __init__(self, name: str, description: str, patterns: List[str], func: Callable, params: Callable):
+        self.name = name
+        self.description = description
+        self.patterns: List[Pattern] = [re.compile(p) for p in patterns]
+        self.func = func
+        self.params = params
+
+    def match(self, instruction: str) -> Optional[Dict[str, Any]]:
+        """完整匹配规范化后的格式要求，匹配成功时返回转换参数"""
+        for pattern in self.patterns:
+            match = pattern.fullmatch(instruction)
+            if match:
+                return self.params(match)
+        return None
+
+
+# 内置转换器注册表，按注册顺序匹配
+CONVERTERS: Dict[str, Converter] = {}
+
+
+def register_converter(name: str, description: str, patterns: List[str], params: Callable = lambda m: {}):
+    """
+    注册内置转换器
+
+    patterns必须完整匹配去除空白后的规范化格式要求，只有不带任何附加要求的常见指令才会命中，
+    其余指令仍交给大模型生成脚本
+    """
+    def decorator(func: Callable) -> Callable:
+        CONVERTERS[name] = Converter(name, description, patterns, func, params)
+        return func
+    return decorator
+
+
+@register_converter(
+    "csv_to_json",
+    "CSV转JSON数组，第一行作为键名",
+    [r"(请)?(将|把)?(输入的?)?csv(格式|文件|数据|文本)?(转换|转)(为|成)json(格式|数组)?"
+     r"([,，]?(以|将|把)?第一行(作为|为|是)(键名|键|字段名|key))?"]
+)
+def csv_to_json(input_file: str, output_file: str):
+    with open(input_file, "r", encoding="utf-8", newline="") as src:
+        rows = list(csv.DictReader(src))
+    with open(output_file, "w", encoding="utf-8") as dst:
+        json.dump(rows, dst, ensure_ascii=False, indent=2)
+
+
+@register_converter(
+    "json_to_csv",
+    "JSON对象数组转CSV，键名作为表头",
+    [r"(请)?(将|把)?(输入的?)?json(格式|文件|数据|数组|文本)?(转换|转)(为|成)csv(格式|文件)?"]
+)
+def json_to_csv(input_file: str, output_file: str):
+    with open(input_file, "r", encoding="utf-8") as src:
+        text = src.read().strip()
+    # 同时支持JSON数组和每行一个JSON对象
+    if text.startswith("["):
+        rows = json.loads(text)
+    else:
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+    fieldnames: List[str] = []
+    for row in rows:
+        for key in row:
+            if key not in fieldnames:
+                fieldnames.append(key)
+    with open(output_file, "w", encoding="utf-8", newline="") as dst:
+        writer = csv.DictWriter(dst, fieldnames=fieldnames, lineterminator="\n")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v
+                             for k, v in row.items()})
+
+
+@register_converter(
+    "swap_delimiter",
+    "替换字段分隔符，如空格分隔转逗号分隔",
+    [rf"(请)?(将|把)?(?P<src>{_DELIMITER_NAMES})分隔的?(文本|数据|内容|文件)?(转换|转|改)(为|成)"
+     rf"(?P<dst>{_DELIMITER_NAMES})分隔的?(csv|文本|数据|格式|文件)?(格式)?"],
+    lambda m: {"src": DELIMITERS[m.group("src")], "dst": DELIMITERS[m.group("dst")]}
+)
+def swap_delimiter(input_file: str, output_file: str, src: str, dst: str):
+    with open(input_file, "r", encoding="utf-8", newline="") as fin, \
+            open(output_file, "w", encoding="utf-8", newline="") as fout:
+        writer = csv.writer(fout, delimiter=dst, lineterminator="\n")
+        if src == " ":
+            # 空格分隔时连续空白视为一个分隔符
+            rows = (line.split() for line in fin)
+        else:
+            # 按CSV规则解析，引号内的分隔符和换行保留在字段中
+            rows = csv.reader(fin, delimiter=src)
+        for row in rows:
+            writer.writerow(row)
+
+
+@register_converter(
+    "truncate_lines",
+    "只保留前N行",
+    [r"(请)?(只)?(保留|截取|取|输出)(文件|文本|内容)?的?前(?P<n>\d+)行(内容|数据)?"],
+    lambda m: {"n": int(m.group("n"))}
+)
+def truncate_lines(input_file: str, output_file: str, n: int):
+    with open(input_file, "r", encoding="utf-8", newline="") as fin, \
+            open(output_file, "w", encoding="utf-8", newline="") as fout:
+        for index, line in enumerate(fin):
+            if index >= n:
+                break
+            fout.write(line)
+
+
+@register_converter(
+    "extract_urls",
+    "提取所有URL链接，每行一个",
+    [r"(请)?(提取|抽取|找出|列出)(文本|文件|内容)?中?的?(所有)?的?(url|链接|网址)(链接|地址)?"]
+)
+def extract_urls(input_file: str, output_file: str):
+    pattern = re.compile(URL_PATTERN)
+    with open(input_file, "r", encoding="utf-8") as fin, \
+            open(output_file, "w", encoding="utf-8") as fout:
+        for line in fin:
+            for url in pattern.findall(line):
+                # 去掉句末紧跟的英文标点
+                fout.write(url.rstrip(".,;:!?") + "\n")
+
+
+_DATE_FORMAT = r"(yyyy|mm|dd)[/\-.](yyyy|mm|dd)[/\-.](yyyy|mm|dd)"
+_DATE_FIELDS = ["dd", "mm", "yyyy"]
+
+
+def _date_formats(m) -> Optional[Dict[str, Any]]:
+    """源格式和目标格式都必须恰好包含yyyy、mm、dd各一次，否则不匹配"""
+    src, dst = m.group("src"), m.group("dst")
+    for fmt in (src, dst):
+        if sorted(re.findall(r"yyyy|mm|dd", fmt)) != _DATE_FIELDS:
+            return None
+    return {"src": src, "dst": dst}
+
+
+@register_converter(
+    "reformat_dates",
+    "转换日期格式，如MM/DD/YYYY转YYYY-MM-DD",
+    [rf"(请)?(将|把)?(文本|文件|内容)?中?的?(所有)?的?日期(格式)?(从|由)?(?P<src>{_DATE_FORMAT})(格式)?"
+     rf"(转换|转|改)(为|成)(?P<dst>{_DATE_FORMAT})(格式)?"],
+    _date_formats
+)
+def reformat_dates(input_file: str, output_file: str, src: str, dst: str):
+    # 根据源格式构造正则表达式，例如mm/dd/yyyy -> (\d{1,2})/(\d{1,2})/(\d{4})
+    fields = re.findall(r"yyyy|mm|dd", src)
+    separators = re.findall(r"[/\-.]", src)
+    widths = {"yyyy": r"(\d{4})", "mm": r"(\d{1,2})", "dd": r"(\d{1,2})"}
+    regex = widths[fields[0]] + re.escape(separators[0]) + widths[fields[1]] + \
+        re.escape(separators[1]) + widths[fields[2]]
+    pattern = re.compile(rf"(?<!\d){regex}(?!\d)")
+
+    def replace(match):
+        values = dict(zip(fields, match.groups()))
+        if not (1 <= int(values["mm"]) <= 12 and 1 <= int(values["dd"]) <= 31):
+            return match.group(0)
+        result = dst
+        result = result.replace("yyyy", values["yyyy"])
+        result = result.replace("mm", values["mm"].zfill(2))
+        result = result.replace("dd", values["dd"].zfill(2))
+        return result
+
+    with open(input_file, "r", encoding="utf-8", newline="") as fin, \
+            open(output_file, "w", encoding="utf-8", newline="") as fout:
+        for line in fin:
+            fout.write(pattern.sub(replace, line))
+
+
+class FastPathStats:
+    """内置转换器命中统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.matched = 0
+        self.missed = 0
+        self.by_converter: Dict[str, int] = {name: 0 for name in CONVERTERS}
+
+    def record(self, name: Optional[str]):
+        with self._lock:
+            if name is None:
+                self.missed += 1
+            else:
+                self.matched += 1
+                self.by_converter[name] = self.by_converter.get(name, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.matched + self.missed
+            return {
+                "enabled": FAST_PATH_ENABLED,
+                "matched": self.matched,
+                "missed": self.missed,
+                "hit_rate": round(self.matched / total, 4) if total else 0.0,
+                "by_converter": dict(self.by_converter)
+            }
+
+
+fast_path_stats = FastPathStats()
+
+# 已渲染的内置脚本路径 -> (转换器, 参数)
+_builtin_scripts: Dict[str, Tuple[Converter, Dict[str, Any]]] = {}
+
+
+def _collect_metrics():
+    """内置转换器快速路径的命中统计"""
+    stats = fast_path_stats.snapshot()
+    return [
+        snapshot_counter("fast_path_lookups_total", "内置转换器匹配次数",
+                         {("hit",): stats["matched"], ("miss",): stats["missed"]}, ["result"]),
+        snapshot_counter("fast_path_hits_total", "各内置转换器命中次数",
+                         {(name,): count for name, count in stats["by_converter"].items()}, ["converter"])
+    ]
+
+
+register_collector(_collect_metrics)
+
+
+def match_converter(format_instruction: str) -> Optional[Tuple[Converter, Dict[str, Any]]]:
+    """为格式转换要求匹配内置转换器，并记录命中统计"""
+    if not FAST_PATH_ENABLED:
+        return None
+    instruction = re.sub(r"\s+", "", normalize_instruction(format_instruction))
+    for converter in CONVERTERS.values():
+        params = converter.match(instruction)
+        if params is not None:
+            fast_path_stats.record(converter.name)
+            return converter, params
+    fast_path_stats.record(None)
+    return None
+
+
+def render_script(converter: Converter, params: Dict[str, Any]) -> str:
+    """将内置转换器渲染为与大模型生成脚本约定一致的独立脚本"""
+    source = inspect.getsource(converter.func)
+    # 去掉注册装饰器，只保留函数定义
+    source = source[re.search(r"^def ", source, re.M).start():]
+    constants = ""
+    if converter.name == "extract_urls":
+        constants = f"URL_PATTERN = {URL_PATTERN!r}\n\n\n"
+    call_args = "".join(f", {k}={v!r}" for k, v in params.items())
+    return (
+        f"# 内置转换器: {converter.name}（{converter.description}）\n"
+        "import re\nimport csv\nimport json\n\n\n"
+        f"{constants}{source}\n\n\n"
+        "def convert_text(input_file: str, output_file: str):\n"
+        f"    {converter.func.__name__}(input_file, output_file{call_args})\n\n\n"
+        'if __name__ == "__main__":\n'
+        "    import sys\n"
+        "    if len(sys.argv) != 3:\n"
+        '        print("Usage: python script.py input_file output_file")\n'
+        "        sys.exit(1)\n"
+        "    convert_text(sys.argv[1], sys.argv[2])\n"
+    )
+
+
+def save_builtin_script(converter: Converter, params: Dict[str, Any], scripts_dir: str) -> Tuple[str, str]:
+    """
+    保存内置转换器对应的脚本，同一转换器和参数只保存一份
+
+    返回:
+        Tuple[str, str]: (脚本路径, 脚本内容)
+    """
+    script_content = render_script(converter, params)
+    digest = hashlib.sha256(script_content.encode("utf-8")).hexdigest()[:12]
+    # 与生成的脚本一样放在哈希前缀子目录中，由磁盘清理按配额管理
+    script_path = shard_path(scripts_dir, f"builtin_{converter.name}_{digest}.py")
+    if not os.path.exists(script_path):
+        with open(script_path, "w", encoding="utf-8") as f:
+            f.write(script_content)
+        script_logger.info(f"内置转换器脚本已保存到: {script_path}")
+    _builtin_scripts[script_path] = (converter, params)
+    return script_path, script_content
+
+
+def resolve_builtin(script_path: str) -> Optional[Tuple[Converter, Dict[str, Any]]]:
+    """判断脚本是否为内置转换器脚本，是则返回对应的转换器和参数"""
+    return _builtin_scripts.get(script_path)
+
+
+def run_builtin(script_path: str, input_file: str, output_file: str) -> bool:
+    """
+    在服务进程内直接执行内置转换器
+
+    返回:
+        bool: 脚本是否为内置转换器脚本
+    """
+    builtin = resolve_builtin(script_path)
+    if builtin is None:
+        return False
+    converter, params = builtin
+    converter.func(input_file, output_file, **params)
+    return True
+
+
+def list_converters() -> List[Dict[str, str]]:
+    return [{"name": c.name, "description": c.description} for c in CONVERTERS.values()]
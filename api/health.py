@@ -0,0 +1,78 @@
+import os
+import time
+from typing import Any, Callable, Dict, List, Tuple
+from .logger import app_logger
+from .metrics import register_collector, snapshot_gauge
+
+
+class HealthState:
+    """
+    进程的存活和就绪状态
+
+    存活：进程能处理请求即可；就绪：启动完成、没有在排空，且各组件的检查都通过。
+    收到SIGTERM后先标记为排空，就绪检查返回503，负载均衡摘除该进程后再停止接收连接。
+    """
+
+    def __init__(self):
+        # 启动计时的起点：单进程时为导入时间，启动器派生工作进程后重置为派生时间
+        self.boot_time = time.perf_counter()
+        self.started_at = time.time()
+        self.ready = False
+        self.draining = False
+        self.startup_seconds = 0.0
+        self._checks: List[Tuple[str, Callable[[], bool]]] = []
+
+    def reset(self):
+        """在派生出的工作进程中重新开始计时，已注册的检查保留"""
+        self.boot_time = time.perf_counter()
+        self.started_at = time.time()
+        self.ready = False
+        self.draining = False
+        self.startup_seconds = 0.0
+
+    def add_check(self, name: str, check: Callable[[], bool]):
+        """注册就绪检查，返回False或抛出异常时视为未就绪"""
+        self._checks.append((name, check))
+
+    def mark_ready(self):
+        self.ready = True
+        self.startup_seconds = time.perf_counter() - self.boot_time
+        app_logger.info(f"进程已就绪，pid: {os.getpid()}, 启动耗时: {self.startup_seconds * 1000:.1f}ms")
+
+    def mark_draining(self):
+        if not self.draining:
+            self.draining = True
+            app_logger.info(f"进程开始排空，pid: {os.getpid()}")
+
+    def liveness(self) -> Dict[str, Any]:
+        return {"status": "ok", "pid": os.getpid(), "uptime": round(time.time() - self.started_at, 3)}
+
+    def readiness(self) -> Tuple[bool, Dict[str, Any]]:
+        """返回是否就绪以及各项检查结果"""
+        checks = {"started": self.ready, "draining": self.draining}
+        ok = self.ready and not self.draining
+        for name, check in self._checks:
+            try:
+                passed = bool(check())
+            except Exception:
+                passed = False
+            checks[name] = passed
+            ok = ok and passed
+        return ok, checks
+
+
+# 全局健康状态
+health = HealthState()
+
+
+def _collect_metrics():
+    """进程就绪状态和启动耗时"""
+    ready, _ = health.readiness()
+    return [
+        snapshot_gauge("process_ready", "进程是否就绪（1为就绪）", {(): int(ready)}),
+        snapshot_gauge("process_startup_seconds", "从启动（或派生）到就绪的耗时（秒）",
+                       {(): round(health.startup_seconds, 6)})
+    ]
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,438 @@
+import os
+import time
+import uuid
+import fcntl
+import shutil
+import sqlite3
+import hashlib
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
+from . import DATA_DIR
+from .logger import script_logger
+from .metrics import register_collector, snapshot_counter, span
+from .sandbox import SANDBOX_ENABLED
+from .sandbox_worker import MODE_FILE
+from .sharding import check_shard_safety, read_declarations, detect_header
+from .utils import execute_python_script
+from .lifecycle import lifecycle
+from .mapped_io import mapped, file_encoding, last_line_end
+
+# 增量转换配置
+SOURCES_DB = os.getenv("SOURCES_DB", os.path.join(DATA_DIR, "sources.db"))
+SOURCES_DIR = os.getenv("SOURCES_DIR", os.path.join(DATA_DIR, "sources"))  # 已注册数据源的脚本和累积输出，不受磁盘清理管理
+
+# 运行方式
+RUN_INCREMENTAL = "incremental"  # 只转换新追加的记录并追加到输出
+RUN_FULL = "full"  # 整体重新转换
+RUN_UNCHANGED = "unchanged"  # 没有新的完整记录
+
+# 读写文件的缓冲区大小
+_COPY_BUFFER = 1024 * 1024
+
+
+class SourceNotFound(Exception):
+    """数据源不存在"""
+
+
+class PrefixHasher:
+    """
+    只对内容的前limit个字节计算哈希
+
+    作为save_upload_stream的hasher在上传落盘的同时校验已转换的前缀，不需要再读一遍文件；
+    前缀之后的新内容在复制时继续计算，得到新前缀的哈希
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    def update(self, chunk: bytes):
+        if self.size < self.limit:
+            self._hash.update(chunk[:self.limit - self.size])
+        self.size += len(chunk)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def copy(self):
+        return self._hash.copy()
+
+
+def hash_prefix(file_path: str, length: int):
+    """从头读取文件计算前length个字节的哈希，返回hashlib对象"""
+    hasher = PrefixHasher(length)
+    with open(file_path, "rb") as f:
+        while hasher.size < length:
+            chunk = f.read(min(_COPY_BUFFER, length - hasher.size))
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.copy()
+
+
+def record_boundary(file_path: str, start: int, end: int) -> int:
+    """
+    返回[start, end)中最后一个换行符之后的位置，即对齐到记录边界的转换终点
+
+    末尾没有换行的一行可能还在写入，留到下次提交；没有完整的新记录时返回start。
+    在内存映射上从末尾向前查找，只读入最后一个换行所在的页
+    """
+    with mapped(file_path) as buf:
+        return last_line_end(buf, start, min(end, len(buf)))
+
+
+def copy_range(file_path: str, start: int, end: int, dest: str, prefix: bytes = b"", hasher=None):
+    """把[start, end)的内容复制到dest（前面加上prefix），同时把复制的内容计入hasher"""
+    with open(file_path, "rb") as src, open(dest, "wb") as dst:
+        dst.write(prefix)
+        src.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = src.read(min(_COPY_BUFFER, remaining))
+            if not chunk:
+                break
+            if hasher is not None:
+                hasher.update(chunk)
+            dst.write(chunk)
+            remaining -= len(chunk)
+
+
+def _first_line(file_path: str) -> bytes:
+    with open(file_path, "rb") as f:
+        return f.readline()
+
+
+class SourceStore:
+    """
+    基于SQLite的数据源存储
+
+    每个数据源记录格式要求、脚本内容、已转换到的偏移（记录边界）、该前缀的哈希和累积输出文件。
+    多个工作进程共用同一个数据库，同一数据源的更新由文件锁串行化。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sources (
+                    id TEXT PRIMARY KEY,
+                    format_instruction TEXT NOT NULL,
+                    model_name TEXT NOT NULL,
+                    script_content TEXT NOT NULL,
+                    append_safe INTEGER NOT NULL,
+                    header INTEGER NOT NULL,
+                    offset INTEGER NOT NULL DEFAULT 0,
+                    prefix_hash TEXT NOT NULL,
+                    output_file TEXT,
+                    output_size INTEGER NOT NULL DEFAULT 0,
+                    output_first_line TEXT NOT NULL DEFAULT '',
+                    last_run TEXT,
+                    incremental_runs INTEGER NOT NULL DEFAULT 0,
+                    full_runs INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """数据库连接；关闭后（例如启动器派生工作进程之前）在下次使用时重新打开"""
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+        return self._db
+
+    def create(self, record: Dict[str, Any]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO sources ({', '.join(record)}) VALUES ({', '.join('?' for _ in record)})",
+                list(record.values())
+            )
+
+    def get(self, source_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM sources WHERE id = ?", (source_id,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, source_id: str, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE sources SET {assignments} WHERE id = ?", [*fields.values(), source_id])
+
+    def delete(self, source_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sources WHERE id = ?", (source_id,))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class IncrementalConverter:
+    """
+    追加写入的数据源的增量转换
+
+    注册时保存格式要求和脚本，并判断脚本能否分段执行（与分片执行相同的安全性校验，
+    包括表头处理）。之后每次提交完整的当前文件：已转换前缀的哈希不变时，只把上次偏移之后、
+    对齐到记录边界的新内容交给脚本转换并追加到累积输出，耗时与新数据量成正比；
+    前缀被修改（文件被截断、轮转或改写）或脚本不能分段执行时整体重新转换。
+    """
+
+    def __init__(self, store: SourceStore, directory: str):
+        self.store = store
+        self.directory = directory
+        self.counters = {RUN_INCREMENTAL: 0, RUN_FULL: 0, RUN_UNCHANGED: 0}
+        self.converted_bytes = {RUN_INCREMENTAL: 0, RUN_FULL: 0}
+        self._counters_lock = threading.Lock()
+
+    def _path(self, source_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{source_id}{suffix}")
+
+    @contextmanager
+    def _locked(self, source_id: str):
+        """同一数据源的更新在所有线程和工作进程之间串行执行"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(source_id, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _count(self, run: str, converted: int = 0):
+        with self._counters_lock:
+            self.counters[run] += 1
+            if run in self.converted_bytes:
+                self.converted_bytes[run] += converted
+
+    def _script(self, record: Dict[str, Any]) -> str:
+        """数据源的脚本文件，不在脚本目录中，不会被磁盘清理删除；缺失时按保存的内容重新写出"""
+        script_path = self._path(record["id"], ".py")
+        if not os.path.exists(script_path):
+            with open(script_path, "w", encoding="utf-8") as f:
+                f.write(record["script_content"])
+        return script_path
+
+    def _append_safety(self, script_path: str, input_file: str) -> Tuple[bool, bool]:
+        """脚本能否分段执行以及输入是否有表头；未启用沙箱时只使用脚本的声明"""
+        if SANDBOX_ENABLED:
+            return check_shard_safety(script_path, input_file, MODE_FILE, self.directory)
+        declarations = read_declarations(script_path)
+        if "SHARD_HEADER" in declarations:
+            header = bool(declarations["SHARD_HEADER"])
+        else:
+            encoding, _ = file_encoding(input_file)
+            with open(input_file, "rb") as f:
+                head = [line.decode(encoding, errors="ignore") for _, line in zip(range(50), f)]
+            header = detect_header(head)
+        return bool(declarations.get("SHARD_SAFE", False)), header
+
+    def register(self, format_instruction: str, model_name: str, script_content: str,
+                 input_file: str) -> Dict[str, Any]:
+        """注册数据源并转换当前内容，返回数据源记录和本次运行信息"""
+        os.makedirs(self.directory, exist_ok=True)
+        source_id = uuid.uuid4().hex
+        now = time.time()
+        record = {
+            "id": source_id,
+            "format_instruction": format_instruction,
+            "model_name": model_name,
+            "script_content": script_content,
+            "append_safe": 0,
+            "header": 0,
+            "offset": 0,
+            "prefix_hash": hashlib.sha256().hexdigest(),
+            "created_at": now,
+            "updated_at": now
+        }
+        script_path = self._script(record)
+        append_safe, header = self._append_safety(script_path, input_file)
+        record["append_safe"], record["header"] = int(append_safe), int(header)
+        self.store.create(record)
+        script_logger.info(f"数据源已注册: {source_id}, 可增量转换: {append_safe}, 表头: {header}")
+        return self.update(source_id, input_file, PrefixHasher(0))
+
+    def update(self, source_id: str, input_file: str, hasher: PrefixHasher) -> Dict[str, Any]:
+        """
+        按数据源的当前完整内容更新累积输出
+
+        参数:
+            hasher: 上传时计算的PrefixHasher，limit应为提交时数据源的偏移
+
+        返回:
+            Dict[str, Any]: 更新后的数据源记录，另含本次的运行方式run和转换的字节数converted_bytes
+        """
+        with self._locked(source_id):
+            record = self.store.get(source_id)
+            if record is None:
+                raise SourceNotFound(f"数据源不存在: {source_id}")
+            size = os.path.getsize(input_file)
+            offset = record["offset"]
+            if hasher.limit != offset:
+                # 上传期间其他请求已推进了偏移，按新的偏移重新计算前缀哈希
+                prefix = hash_prefix(input_file, min(offset, size))
+            else:
+                prefix = hasher.copy()
+            prefix_intact = size >= offset and prefix.hexdigest() == record["prefix_hash"]
+
+            if prefix_intact:
+                end = record_boundary(input_file, offset, size)
+                if end == offset:
+                    self._count(RUN_UNCHANGED)
+                    return {**record, "run": RUN_UNCHANGED, "converted_bytes": 0}
+                if record["append_safe"] and record["output_file"]:
+                    return self._append(record, input_file, prefix, end)
+            else:
+                script_logger.info(f"数据源前缀已变化，整体重新转换: {source_id}")
+            return self._recompute(record, input_file, size)
+
+    def _append(self, record: Dict[str, Any], input_file: str, prefix, end: int) -> Dict[str, Any]:
+        """只转换[offset, end)的新记录并追加到累积输出"""
+        source_id, offset = record["id"], record["offset"]
+        header_line = _first_line(input_file) if record["header"] else b""
+        chunk_input = self._path(source_id, f".{uuid.uuid4().hex}.in")
+        chunk_output = None
+        try:
+            with span("incremental"):
+                copy_range(input_file, offset, end, chunk_input, header_line, prefix)
+            chunk_output = execute_python_script(self._script(record), chunk_input)
+            with span("incremental"):
+                output_size = self._append_output(record, chunk_output)
+        finally:
+            lifecycle.release(chunk_output)
+            for path in (chunk_input, chunk_output):
+                if path and os.path.exists(path):
+                    os.remove(path)
+        fields = {
+            "offset": end,
+            "prefix_hash": prefix.hexdigest(),
+            "output_size": output_size,
+            "last_run": RUN_INCREMENTAL,
+            "incremental_runs": record["incremental_runs"] + 1,
+            "updated_at": time.time()
+        }
+        self.store.update(source_id, **fields)
+        self._count(RUN_INCREMENTAL, end - offset)
+        script_logger.info(f"数据源增量转换完成: {source_id}, 新增字节: {end - offset}, 偏移: {end}")
+        return {**record, **fields, "run": RUN_INCREMENTAL, "converted_bytes": end - offset}
+
+    def _append_output(self, record: Dict[str, Any], chunk_output: str) -> int:
+        """
+        把新记录的输出追加到累积输出，返回累积输出的大小
+
+        先截断到记录中的大小，上次追加后未能更新记录时不会重复追加；与分片合并的规则相同，
+        有表头时跳过与累积输出首行相同的输出表头，累积输出不以换行结尾时先补一个换行
+        """
+        first_line = bytes.fromhex(record["output_first_line"])
+        with open(record["output_file"], "r+b") as dst:
+            dst.truncate(record["output_size"])
+            need_separator = False
+            if record["output_size"] > 0:
+                dst.seek(record["output_size"] - 1)
+                need_separator = dst.read(1) != b"\n"
+            dst.seek(record["output_size"])
+            if os.path.exists(chunk_output):
+                with open(chunk_output, "rb") as src:
+                    line = src.readline()
+                    if record["header"] and line == first_line:
+                        line = b""
+                    for chunk in itertools.chain([line], iter(lambda: src.read(_COPY_BUFFER), b"")):
+                        if not chunk:
+                            continue
+                        if need_separator:
+                            dst.write(b"\n")
+                            need_separator = False
+                        dst.write(chunk)
+            return dst.tell()
+
+    def _recompute(self, record: Dict[str, Any], input_file: str, size: int) -> Dict[str, Any]:
+        """整体转换到最后一个记录边界，写入新的输出文件后再切换，之后删除旧的输出"""
+        source_id = record["id"]
+        end = record_boundary(input_file, 0, size)
+        prefix = hashlib.sha256()
+        prefix_input = self._path(source_id, f".{uuid.uuid4().hex}.in")
+        output_file = self._path(source_id, f".{uuid.uuid4().hex[:8]}.out")
+        converted_output = None
+        try:
+            with span("incremental"):
+                copy_range(input_file, 0, end, prefix_input, hasher=prefix)
+            if end > 0:
+                converted_output = execute_python_script(self._script(record), prefix_input)
+            if converted_output and os.path.exists(converted_output):
+                shutil.move(converted_output, output_file)
+            else:
+                open(output_file, "wb").close()
+        finally:
+            lifecycle.release(converted_output)
+            for path in (prefix_input, converted_output):
+                if path and os.path.exists(path):
+                    os.remove(path)
+        fields = {
+            "offset": end,
+            "prefix_hash": prefix.hexdigest(),
+            "output_file": output_file,
+            "output_size": os.path.getsize(output_file),
+            "output_first_line": _first_line(output_file).hex(),
+            "last_run": RUN_FULL,
+            "full_runs": record["full_runs"] + 1,
+            "updated_at": time.time()
+        }
+        self.store.update(source_id, **fields)
+        if record["output_file"] and record["output_file"] != output_file:
+            try:
+                os.remove(record["output_file"])
+            except OSError:
+                pass
+        self._count(RUN_FULL, end)
+        script_logger.info(f"数据源整体转换完成: {source_id}, 转换字节: {end}")
+        return {**record, **fields, "run": RUN_FULL, "converted_bytes": end}
+
+    def delete(self, source_id: str):
+        """删除数据源及其脚本和累积输出"""
+        with self._locked(source_id):
+            record = self.store.get(source_id)
+            if record is None:
+                raise SourceNotFound(f"数据源不存在: {source_id}")
+            self.store.delete(source_id)
+            for path in (record["output_file"], self._path(source_id, ".py")):
+                if path and os.path.exists(path):
+                    os.remove(path)
+        try:
+            os.remove(self._path(source_id, ".lock"))
+        except OSError:
+            pass
+        script_logger.info(f"数据源已删除: {source_id}")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._counters_lock:
+            return {"runs": dict(self.counters), "converted_bytes": dict(self.converted_bytes)}
+
+
+# 全局数据源存储和增量转换器
+source_store = SourceStore(SOURCES_DB)
+incremental = IncrementalConverter(source_store, SOURCES_DIR)
+
+
+def _collect_metrics():
+    """增量转换的运行次数和转换的字节数"""
+    stats = incremental.stats()
+    return [
+        snapshot_counter("incremental_runs_total", "数据源更新次数（按运行方式）",
+                         {(run,): count for run, count in stats["runs"].items()}, ["run"]),
+        snapshot_counter("incremental_converted_bytes_total", "数据源更新时交给脚本转换的输入字节数",
+                         {(run,): count for run, count in stats["converted_bytes"].items()}, ["run"])
+    ]
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,479 @@
+import os
+import json
+import time
+import uuid
+import heapq
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Any, Optional, List, Set
+from . import DATA_DIR
+from .logger import api_logger
+from .models import APIConfig
+from .pipeline import run_io, run_exec
+from .metrics import register_collector, snapshot_gauge
+from .lifecycle import lifecycle
+from .utils import generate_python_script_async, execute_python_script, read_sample
+
+# 异步任务配置
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(DATA_DIR, "jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 8))  # 同时执行的任务数
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", 10000))  # 排队任务数上限
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", 24 * 3600))  # 已结束任务及结果的保留时间（秒）
+JOB_CLEANUP_INTERVAL = int(os.getenv("JOB_CLEANUP_INTERVAL", 600))  # 过期任务清理间隔（秒）
+JOB_RECLAIM_INTERVAL = int(os.getenv("JOB_RECLAIM_INTERVAL", 60))  # 接管已退出进程遗留任务的间隔（秒）
+# 任务库是否由多个工作进程共用（serve.py启动多个工作进程时设置）：
+# 共用时工作进程启动只重新排队已退出进程遗留的执行中任务，不影响其他工作进程正在执行的任务
+JOB_STORE_SHARED = os.getenv("JOB_STORE_SHARED", "false").lower() == "true"
+
+# 任务状态
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+# 任务阶段及对应进度
+STAGE_PROGRESS = {
+    "queued": 0.0,
+    "generating": 0.2,
+    "executing": 0.6,
+    "done": 1.0
+}
+
+
+class JobQueueFull(Exception):
+    """排队任务数已达上限"""
+
+
+def tenant_of(api_key: str) -> str:
+    """按API密钥划分租户，只保存密钥的哈希"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class JobStore:
+    """
+    基于SQLite的任务存储
+
+    任务及其状态持久化在本地数据库中，服务重启后可以恢复排队和执行中的任务。
+    为了在重启后继续执行，排队中的任务会保存API配置，任务结束后立即清除。
+    多个工作进程共用同一个任务库时，任务通过条件更新认领，每个任务只会被一个进程执行。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    tenant TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    filename TEXT,
+                    input_file TEXT NOT NULL,
+                    format_instruction TEXT NOT NULL,
+                    api_config TEXT,
+                    script_path TEXT,
+                    output_file TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    worker INTEGER
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+            # 旧版本的任务库没有执行进程一列
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "worker" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN worker INTEGER")
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """数据库连接；关闭后（例如启动器派生工作进程之前）在下次使用时重新打开"""
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+        return self._db
+
+    def create(self, input_file: str, format_instruction: str, api_config: APIConfig,
+               priority: int = 0, filename: Optional[str] = None) -> Dict[str, Any]:
+        job = {
+            "id": uuid.uuid4().hex,
+            "tenant": tenant_of(api_config.api_key),
+            "priority": priority,
+            "status": STATUS_QUEUED,
+            "stage": "queued",
+            "progress": 0.0,
+            "filename": filename,
+            "input_file": input_file,
+            "format_instruction": format_instruction,
+            "api_config": json.dumps(api_config.model_dump() if hasattr(api_config, "model_dump") else api_config.dict()),
+            "created_at": time.time()
+        }
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO jobs ({', '.join(job)}) VALUES ({', '.join('?' for _ in job)})",
+                list(job.values())
+            )
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id: str, **fields):
+        if not fields:
+            return
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中的任务，返回是否取消成功"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, api_config = NULL, finished_at = ? WHERE id = ? AND status = ?",
+                (STATUS_CANCELLED, time.time(), job_id, STATUS_QUEUED)
+            )
+        return cursor.rowcount > 0
+
+    def claim(self, job_id: str) -> bool:
+        """把排队中的任务标记为由本进程执行，返回是否认领成功（已取消或已被其他进程认领时失败）"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, worker = ? WHERE id = ? AND status = ?",
+                (STATUS_RUNNING, time.time(), os.getpid(), job_id, STATUS_QUEUED)
+            )
+        return cursor.rowcount > 0
+
+    def recover(self, shared: bool = False, stale_before: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        将执行进程已经退出的执行中任务重新排队，返回需要由本进程排队的任务
+
+        服务启动时（stale_before为None）返回所有排队中的任务；shared为False时任务库只有本进程使用，
+        所有执行中的任务都已中断。运行中定期调用时只重新排队其他已退出进程的任务，并返回这些任务
+        和创建时间早于stale_before的排队任务（提交它们的进程可能已经退出，排在其内存队列中的任务不会再被执行）
+        """
+        startup = stale_before is None
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, worker FROM jobs WHERE status = ?", (STATUS_RUNNING,)
+            ).fetchall()
+            orphaned = [row["id"] for row in rows if _orphaned(row["worker"], shared, startup)]
+            self._conn.executemany(
+                "UPDATE jobs SET status = ?, stage = 'queued', progress = 0, worker = NULL WHERE id = ? AND status = ?",
+                [(STATUS_QUEUED, job_id, STATUS_RUNNING) for job_id in orphaned]
+            )
+            rows = self._conn.execute(
+                "SELECT id, tenant, priority, input_file, created_at FROM jobs WHERE status = ? ORDER BY created_at",
+                (STATUS_QUEUED,)
+            ).fetchall()
+        requeued = set(orphaned)
+        return [dict(row) for row in rows if startup or row["id"] in requeued or row["created_at"] < stale_before]
+
+    def adopt_outputs(self, shared: bool = False, startup: bool = True) -> List[str]:
+        """
+        接管持有进程已经退出的成功任务的输出文件，返回接管的路径，由本进程持有到任务过期
+
+        每个任务的输出只由worker列记录的一个进程持有，通过条件更新接管，不会被多个进程重复持有
+        """
+        adopted = []
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, worker, output_file FROM jobs WHERE status = ? AND output_file IS NOT NULL",
+                (STATUS_SUCCEEDED,)
+            ).fetchall()
+            for row in rows:
+                if not _orphaned(row["worker"], shared, startup):
+                    continue
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET worker = ? WHERE id = ? AND worker IS ?",
+                    (os.getpid(), row["id"], row["worker"])
+                )
+                if cursor.rowcount:
+                    adopted.append(row["output_file"])
+        return adopted
+
+    def expired(self, before: float) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs WHERE status IN ({', '.join('?' for _ in FINISHED_STATUSES)}) AND finished_at < ?",
+                (*FINISHED_STATUSES, before)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete(self, job_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    """本机上的进程是否仍在运行"""
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _orphaned(worker: Optional[int], shared: bool, startup: bool) -> bool:
+    """
+    执行任务（或持有其结果）的进程是否已经退出
+
+    启动时任务库不共用则所有进程都已退出，共用时与本进程同号的记录来自之前被复用pid的进程；
+    运行中本进程自己的记录不算
+    """
+    if startup:
+        return not shared or not _process_alive(worker)
+    return worker != os.getpid() and not _process_alive(worker)
+
+
+class JobScheduler:
+    """
+    有界的任务调度器
+
+    每个租户（API密钥）有自己的优先级队列。调度时先比较各租户队首任务的优先级，
+    优先级相同时选择最久未被服务的租户，既保证高优先级任务先执行，又避免单个租户
+    提交大量任务时占满所有执行名额。
+    """
+
+    def __init__(self, store: JobStore, workers: int, queue_limit: int):
+        self.store = store
+        self.workers = max(1, workers)
+        self.queue_limit = queue_limit
+        self._queues: Dict[str, list] = {}
+        self._last_served: Dict[str, int] = {}
+        self._serve_counter = 0
+        self._seq = 0
+        self._queued = 0
+        self._pending: Set[str] = set()
+        self._condition: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _push(self, job_id: str, tenant: str, priority: int):
+        self._seq += 1
+        heapq.heappush(self._queues.setdefault(tenant, []), (-priority, self._seq, job_id))
+        self._pending.add(job_id)
+        self._queued += 1
+
+    def _pop(self) -> Optional[str]:
+        candidates = [(tenant, queue[0]) for tenant, queue in self._queues.items() if queue]
+        if not candidates:
+            return None
+        tenant, _ = min(candidates, key=lambda c: (c[1][0], self._last_served.get(c[0], 0), c[1][1]))
+        _, _, job_id = heapq.heappop(self._queues[tenant])
+        if not self._queues[tenant]:
+            del self._queues[tenant]
+        self._serve_counter += 1
+        self._last_served[tenant] = self._serve_counter
+        self._pending.discard(job_id)
+        self._queued -= 1
+        return job_id
+
+    async def start(self):
+        """恢复持久化的排队任务并启动工作协程"""
+        self._condition = asyncio.Condition()
+        recovered = await run_io(self.store.recover, JOB_STORE_SHARED)
+        for job in recovered:
+            # 排队中的任务持有输入文件，避免被磁盘清理删除
+            lifecycle.acquire(job["input_file"])
+            self._push(job["id"], job["tenant"], job["priority"])
+        if recovered:
+            api_logger.info(f"恢复排队任务数: {len(recovered)}")
+        # 未过期任务的结果持有到任务过期，避免被磁盘清理删除
+        outputs = await run_io(self.store.adopt_outputs, JOB_STORE_SHARED)
+        lifecycle.acquire(*outputs)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._cleanup_loop()))
+        self._tasks.append(asyncio.create_task(self._reclaim_loop()))
+        api_logger.info(f"任务调度器已启动，工作协程数: {self.workers}")
+
+    async def stop(self):
+        """停止工作协程；执行中的任务会在下次启动时重新排队"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        api_logger.info("任务调度器已停止")
+
+    async def submit(self, input_file: str, format_instruction: str, api_config: APIConfig,
+                     priority: int = 0, filename: Optional[str] = None) -> Dict[str, Any]:
+        """提交任务，立即返回任务信息；提交成功后输入文件的引用由任务持有，任务结束时释放"""
+        if self._queued >= self.queue_limit:
+            raise JobQueueFull(f"排队任务数已达上限 {self.queue_limit}")
+        job = await run_io(self.store.create, input_file, format_instruction, api_config, priority, filename)
+        async with self._condition:
+            self._push(job["id"], job["tenant"], priority)
+            self._condition.notify()
+        api_logger.info(f"任务已提交: {job['id']}, 优先级: {priority}")
+        return job
+
+    async def _worker(self, index: int):
+        while True:
+            async with self._condition:
+                job_id = self._pop()
+                while job_id is None:
+                    await self._condition.wait()
+                    job_id = self._pop()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                api_logger.error(f"任务调度异常: {job_id}, 错误: {str(e)}", exc_info=True)
+
+    async def _set_stage(self, job_id: str, stage: str, **fields):
+        await run_io(self.store.update, job_id, stage=stage, progress=STAGE_PROGRESS[stage], **fields)
+
+    async def _run(self, job_id: str):
+        job = await run_io(self.store.get, job_id)
+        if job is None:
+            return
+        if job["status"] != STATUS_QUEUED or not await run_io(self.store.claim, job_id):
+            # 已取消或已由其他工作进程执行的任务
+            lifecycle.release(job["input_file"])
+            return
+        api_config = APIConfig(**json.loads(job["api_config"]))
+        api_logger.info(f"开始执行任务: {job_id}")
+        try:
+            await self._set_stage(job_id, "generating")
+            sample_data = await run_io(read_sample, job["input_file"])
+            script_path, _ = await generate_python_script_async(
+                sample_data,
+                job["format_instruction"],
+                api_config,
+                input_file=job["input_file"]
+            )
+            await self._set_stage(job_id, "executing", script_path=script_path)
+            # 结果由本进程持有到任务过期（见cleanup），任务记录的worker列即持有进程
+            output_file = await run_exec(execute_python_script, script_path, job["input_file"])
+            await self._set_stage(
+                job_id, "done",
+                status=STATUS_SUCCEEDED,
+                output_file=output_file,
+                api_config=None,
+                finished_at=time.time()
+            )
+            api_logger.info(f"任务执行成功: {job_id}, 输出文件: {output_file}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await run_io(
+                self.store.update, job_id,
+                status=STATUS_FAILED,
+                error=str(e),
+                api_config=None,
+                finished_at=time.time()
+            )
+            api_logger.error(f"任务执行失败: {job_id}, 错误: {str(e)}")
+        finally:
+            lifecycle.release(job["input_file"])
+
+    async def _cleanup_loop(self):
+        """定期删除超过保留时间的已结束任务及其输入输出文件"""
+        while True:
+            await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+            try:
+                removed = await run_io(self.cleanup)
+                if removed:
+                    api_logger.info(f"清理过期任务数: {removed}")
+            except Exception as e:
+                api_logger.error(f"清理过期任务失败: {str(e)}", exc_info=True)
+
+    def cleanup(self) -> int:
+        removed = 0
+        for job in self.store.expired(time.time() - JOB_RETENTION):
+            # 只有持有结果的进程释放它；其他进程持有的结果不会被删除，任务由持有进程清理
+            owned = job["output_file"] and job["worker"] == os.getpid()
+            if owned:
+                lifecycle.release(job["output_file"])
+            # 结果仍在下载等被引用的文件不删除，任务留到下次清理
+            if lifecycle.remove(job["input_file"], job["output_file"]):
+                self.store.delete(job["id"])
+                removed += 1
+            elif owned:
+                lifecycle.acquire(job["output_file"])
+        return removed
+
+    async def _reclaim_loop(self):
+        """定期接管已退出的工作进程遗留的排队、执行中任务和任务结果"""
+        while True:
+            await asyncio.sleep(JOB_RECLAIM_INTERVAL)
+            try:
+                await self.reclaim()
+            except Exception as e:
+                api_logger.error(f"接管遗留任务失败: {str(e)}", exc_info=True)
+
+    async def reclaim(self) -> int:
+        """
+        接管其他已退出进程遗留的任务，返回重新排队的任务数
+
+        排队超过JOB_RECLAIM_INTERVAL的任务也加入本进程的队列：提交它的进程可能已经退出，
+        仍在运行时由先取到的进程认领执行，另一个进程取到后发现已被认领直接跳过
+        """
+        jobs = await run_io(self.store.recover, True, time.time() - JOB_RECLAIM_INTERVAL)
+        outputs = await run_io(self.store.adopt_outputs, True, False)
+        lifecycle.acquire(*outputs)
+        requeued = 0
+        async with self._condition:
+            for job in jobs:
+                if job["id"] in self._pending:
+                    continue
+                lifecycle.acquire(job["input_file"])
+                self._push(job["id"], job["tenant"], job["priority"])
+                self._condition.notify()
+                requeued += 1
+        if requeued or outputs:
+            api_logger.info(f"接管遗留任务数: {requeued}，任务结果数: {len(outputs)}")
+        return requeued
+
+    @property
+    def running(self) -> bool:
+        """工作协程是否都在运行"""
+        return bool(self._tasks) and not any(task.done() for task in self._tasks)
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self._queued, "tenants": len(self._queues), "workers": self.workers}
+
+
+# 全局任务存储和调度器
+job_store = JobStore(JOBS_DB)
+job_scheduler = JobScheduler(job_store, JOB_WORKERS, JOB_QUEUE_LIMIT)
+
+
+def _collect_metrics():
+    """异步任务队列深度"""
+    stats = job_scheduler.stats()
+    return [
+        snapshot_gauge("jobs_queued", "排队中的异步任务数", {(): stats["queued"]}),
+        snapshot_gauge("jobs_tenants", "有排队任务的租户数", {(): stats["tenants"]})
+    ]
+
+
+register_collector(_collect_metrics)
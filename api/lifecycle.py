@@ -0,0 +1,448 @@
+import os
+import re
+import time
+import fcntl
+import queue
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from . import DATA_DIR
+from .logger import app_logger
+from .pipeline import run_io
+from .metrics import register_collector, snapshot_gauge, snapshot_counter
+
+# 磁盘生命周期配置
+LIFECYCLE_ENABLED = os.getenv("LIFECYCLE_ENABLED", "true").lower() == "true"
+LIFECYCLE_SWEEP_INTERVAL = int(os.getenv("LIFECYCLE_SWEEP_INTERVAL", 300))  # 清理间隔（秒）
+LIFECYCLE_MIN_AGE = int(os.getenv("LIFECYCLE_MIN_AGE", 600))  # 最近该时间内使用过的文件不会被清理（秒）
+LIFECYCLE_SHARD_WIDTH = int(os.getenv("LIFECYCLE_SHARD_WIDTH", 2))  # 哈希前缀子目录名长度，0表示不分子目录
+# 目录是否由多个工作进程共用（serve.py启动多个工作进程时设置）：共用时引用计数同时记录在
+# LIFECYCLE_HOLDS_DB中，清理前检查所有进程持有的路径，并通过文件锁保证同一时刻只有一个进程清理
+LIFECYCLE_SHARED = os.getenv("LIFECYCLE_SHARED", "false").lower() == "true"
+LIFECYCLE_HOLDS_DB = os.getenv("LIFECYCLE_HOLDS_DB", os.path.join(DATA_DIR, "lifecycle.db"))
+
+
+class DirQuota:
+    """
+    单个目录的配额，0表示不限制
+
+    suffix不为空时只管理该后缀的文件（例如脚本目录中的缓存索引不参与清理）；
+    shards_only为True时只管理哈希前缀子目录中的文件，目录顶层的文件（例如随代码库提交的脚本）不参与清理
+    """
+
+    def __init__(self, max_bytes: int = 0, max_age: int = 0, max_files: int = 0, suffix: str = "",
+                 shards_only: bool = False):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_files = max_files
+        self.suffix = suffix
+        self.shards_only = shards_only
+
+
+def quota_from_env(prefix: str, max_bytes: int, max_age: int, max_files: int, suffix: str = "",
+                   shards_only: bool = False) -> DirQuota:
+    """从 <prefix>_MAX_BYTES / <prefix>_MAX_AGE / <prefix>_MAX_FILES 环境变量读取目录配额"""
+    return DirQuota(
+        max_bytes=int(os.getenv(f"{prefix}_MAX_BYTES", max_bytes)),
+        max_age=int(os.getenv(f"{prefix}_MAX_AGE", max_age)),
+        max_files=int(os.getenv(f"{prefix}_MAX_FILES", max_files)),
+        suffix=suffix,
+        shards_only=shards_only
+    )
+
+
+def shard_path(base_dir: str, filename: str) -> str:
+    """
+    返回文件在哈希前缀子目录中的路径（例如 uploads/3f/<filename>），并确保子目录存在
+
+    文件分散到最多 16^LIFECYCLE_SHARD_WIDTH 个子目录中，单个目录的文件数保持在较小规模
+    """
+    if LIFECYCLE_SHARD_WIDTH <= 0:
+        return os.path.join(base_dir, filename)
+    prefix = hashlib.md5(filename.encode("utf-8")).hexdigest()[:LIFECYCLE_SHARD_WIDTH]
+    directory = os.path.join(base_dir, prefix)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+def _process_alive(pid: int) -> bool:
+    """本机上的进程是否仍在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedHolds:
+    """
+    多个工作进程共用的引用记录（SQLite）
+
+    每个进程只在路径的本地引用计数从0变为1、从1变为0时写入或删除一行（路径, 进程号），
+    已退出进程遗留的记录在读取时清除。acquire/release在事件循环中调用，写入只放入队列，
+    由本进程的写入线程按顺序执行，不会因为其他进程占用数据库而阻塞事件循环；
+    读取前先等待本进程排队的写入完成
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid = 0
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """数据库连接；关闭后（例如启动器派生工作进程之前）在下次使用时重新打开"""
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS holds (path TEXT NOT NULL, pid INTEGER NOT NULL, "
+                             "PRIMARY KEY (path, pid))")
+        return self._db
+
+    def _submit(self, sql: str, paths: List[str]):
+        pid = os.getpid()
+        if self._writer_pid != pid:
+            # 派生出的工作进程中没有父进程的写入线程，重新创建队列和线程
+            self._queue = queue.Queue()
+            self._writer = threading.Thread(target=self._write_loop, args=(self._queue,),
+                                            name="lifecycle-holds", daemon=True)
+            self._writer_pid = pid
+            self._writer.start()
+        self._queue.put((sql, [(path, pid) for path in paths]))
+
+    def _write_loop(self, pending: "queue.Queue[Optional[tuple]]"):
+        while True:
+            item = pending.get()
+            try:
+                if item is None:
+                    return
+                sql, rows = item
+                with self._db_lock:
+                    self._conn.executemany(sql, rows)
+            except Exception as e:
+                app_logger.warning(f"更新共享引用记录失败: {str(e)}")
+            finally:
+                pending.task_done()
+
+    def add(self, paths: List[str]):
+        self._submit("INSERT OR IGNORE INTO holds (path, pid) VALUES (?, ?)", paths)
+
+    def remove(self, paths: List[str]):
+        self._submit("DELETE FROM holds WHERE path = ? AND pid = ?", paths)
+
+    def held(self) -> Set[str]:
+        """所有仍在运行的进程持有的路径（在后台线程中调用）"""
+        if self._writer_pid == os.getpid():
+            self._queue.join()
+        with self._db_lock:
+            rows = self._conn.execute("SELECT path, pid FROM holds").fetchall()
+            dead = {pid for pid in {pid for _, pid in rows} if pid != os.getpid() and not _process_alive(pid)}
+            if dead:
+                self._conn.executemany("DELETE FROM holds WHERE pid = ?", [(pid,) for pid in dead])
+        return {path for path, pid in rows if pid not in dead}
+
+    @contextmanager
+    def sweeping(self):
+        """尝试取得清理锁，其他进程正在清理时返回False"""
+        with open(self.db_path + ".lock", "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def close(self):
+        """写完排队的记录后停止写入线程并关闭连接"""
+        if self._writer is not None and self._writer_pid == os.getpid():
+            self._queue.put(None)
+            self._writer.join()
+        self._writer = None
+        self._writer_pid = 0
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_SHARD_DIR = re.compile(rf"[0-9a-f]{{{max(LIFECYCLE_SHARD_WIDTH, 1)}}}")
+
+
+class LifecycleManager:
+    """
+    uploads/outputs/scripts 等目录的磁盘生命周期管理
+
+    后台定期扫描各目录：先删除超过最长保留时间的文件，再按最近使用时间从旧到新删除文件，
+    直到文件数和总大小都不超过配额。正在被请求或任务使用的文件通过引用计数保护，
+    受保护的路径（例如固定的缓存脚本）由保护函数提供，最近使用过的文件也不会被删除。
+    传入shared时引用同时记录在多个进程共用的SharedHolds中，任一进程清理时都不会删除其他进程正在使用的文件。
+    """
+
+    def __init__(self, shared: Optional[SharedHolds] = None):
+        self._dirs: Dict[str, DirQuota] = {}
+        self._refs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._shared = shared
+        self._protectors: List[Callable[[], Iterable[str]]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.usage: Dict[str, Dict[str, int]] = {}
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+
+    def manage(self, directory: str, quota: DirQuota):
+        """登记需要管理的目录及其配额"""
+        self._dirs[os.path.abspath(directory)] = quota
+        self.usage[os.path.abspath(directory)] = {"files": 0, "bytes": 0}
+
+    def add_protector(self, protector: Callable[[], Iterable[str]]):
+        """登记保护函数，每次清理前调用，返回的路径不会被删除"""
+        self._protectors.append(protector)
+
+    def acquire(self, *paths: Optional[str]):
+        """增加路径的引用计数；目录被引用时其中的所有文件都受保护"""
+        with self._lock:
+            added = []
+            for path in paths:
+                if path:
+                    key = os.path.abspath(path)
+                    count = self._refs.get(key, 0) + 1
+                    self._refs[key] = count
+                    if count == 1:
+                        added.append(key)
+            if self._shared is not None and added:
+                self._shared.add(added)
+
+    def release(self, *paths: Optional[str]):
+        """减少路径的引用计数"""
+        with self._lock:
+            removed = []
+            for path in paths:
+                if not path:
+                    continue
+                key = os.path.abspath(path)
+                count = self._refs.get(key, 0) - 1
+                if count > 0:
+                    self._refs[key] = count
+                elif self._refs.pop(key, None) is not None:
+                    removed.append(key)
+            if self._shared is not None and removed:
+                self._shared.remove(removed)
+
+    @contextmanager
+    def hold(self, *paths: Optional[str]):
+        """在with块内保护路径"""
+        self.acquire(*paths)
+        try:
+            yield
+        finally:
+            self.release(*paths)
+
+    def touch(self, path: str):
+        """更新文件的最近使用时间，使其在LRU清理中排在后面"""
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def remove(self, *paths: Optional[str]) -> bool:
+        """
+        删除不再使用的文件（例如过期任务的输入输出）
+
+        任一路径（或其所在目录）仍被本进程或其他工作进程引用时都不删除，返回False，由调用方稍后重试
+        """
+        keys = [os.path.abspath(path) for path in paths if path]
+        held = self._held()
+        root = os.path.abspath(os.sep)
+        if any(self._is_held(key, root, held) for key in keys):
+            return False
+        for key in keys:
+            try:
+                os.remove(key)
+            except FileNotFoundError:
+                continue
+        return True
+
+    def _held(self) -> Set[str]:
+        """当前被引用的路径，包括其他工作进程持有的路径"""
+        if self._shared is not None:
+            # 不持有self._lock，等待写入和读取数据库期间事件循环中的acquire/release不受影响
+            return self._shared.held()
+        with self._lock:
+            return set(self._refs)
+
+    @staticmethod
+    def _is_held(path: str, base: str, held: Set[str]) -> bool:
+        while True:
+            if path in held:
+                return True
+            if path == base:
+                return False
+            parent = os.path.dirname(path)
+            if parent == path:
+                return False
+            path = parent
+
+    def _scan(self, base: str, quota: DirQuota) -> List[tuple]:
+        """递归列出目录中受管理的文件：(最近使用时间, 大小, 路径)"""
+        files = []
+        stack = [base]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    top_level = quota.shards_only and directory == base
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if not top_level or _SHARD_DIR.fullmatch(entry.name):
+                                    stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False) and not top_level:
+                                if quota.suffix and not entry.name.endswith(quota.suffix):
+                                    continue
+                                st = entry.stat(follow_symlinks=False)
+                                files.append((max(st.st_atime, st.st_mtime), st.st_size, entry.path))
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return files
+
+    def _remove_empty_dirs(self, base: str, held: Set[str], now: float):
+        """删除空的工作子目录（例如批量转换目录），哈希前缀子目录保留"""
+        try:
+            entries = list(os.scandir(base))
+        except OSError:
+            return
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False) or _SHARD_DIR.fullmatch(entry.name):
+                continue
+            try:
+                if now - entry.stat().st_mtime > LIFECYCLE_MIN_AGE and not self._is_held(entry.path, base, held):
+                    os.rmdir(entry.path)
+            except OSError:
+                continue
+
+    def sweep_dir(self, base: str, quota: DirQuota, protected: Set[str], held: Set[str], now: float) -> int:
+        """按配额清理单个目录，返回删除的文件数"""
+        files = sorted(self._scan(base, quota))
+        total_bytes = sum(size for _, size, _ in files)
+        total_files = len(files)
+        removed = 0
+        for used_at, size, path in files:
+            age = now - used_at
+            over_age = quota.max_age and age > quota.max_age
+            over_quota = (quota.max_files and total_files > quota.max_files) or \
+                (quota.max_bytes and total_bytes > quota.max_bytes)
+            if not over_age and not over_quota:
+                continue
+            if path in protected or age < LIFECYCLE_MIN_AGE or self._is_held(path, base, held):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed += 1
+            total_files -= 1
+            total_bytes -= size
+            self.evicted_files += 1
+            self.evicted_bytes += size
+        self._remove_empty_dirs(base, held, now)
+        self.usage[base] = {"files": total_files, "bytes": total_bytes}
+        return removed
+
+    def sweep(self) -> int:
+        """清理所有受管理的目录，返回删除的文件数；多个进程共用目录时只有取得清理锁的进程执行"""
+        if self._shared is None:
+            return self._sweep()
+        with self._shared.sweeping() as acquired:
+            return self._sweep() if acquired else 0
+
+    def _sweep(self) -> int:
+        protected: Set[str] = set()
+        for protector in self._protectors:
+            try:
+                protected.update(os.path.abspath(path) for path in protector())
+            except Exception as e:
+                app_logger.warning(f"获取受保护文件失败: {str(e)}")
+        # 先读取引用再扫描目录：扫描期间新创建的文件都在LIFECYCLE_MIN_AGE之内，不会被删除
+        held = self._held()
+        now = time.time()
+        removed = 0
+        for base, quota in self._dirs.items():
+            if os.path.isdir(base):
+                removed += self.sweep_dir(base, quota, protected, held, now)
+        return removed
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                removed = await run_io(self.sweep)
+                if removed:
+                    app_logger.info(f"磁盘清理完成，删除文件数: {removed}")
+            except Exception as e:
+                app_logger.error(f"磁盘清理失败: {str(e)}", exc_info=True)
+            await asyncio.sleep(LIFECYCLE_SWEEP_INTERVAL)
+
+    async def start(self):
+        """启动后台清理任务"""
+        if LIFECYCLE_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._sweep_loop())
+            app_logger.info(f"磁盘生命周期管理已启动，清理间隔: {LIFECYCLE_SWEEP_INTERVAL} 秒")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def close(self):
+        """关闭共享引用库的连接（启动器派生工作进程之前调用）"""
+        if self._shared is not None:
+            self._shared.close()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            held = len(self._refs)
+        return {
+            "held": held,
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes,
+            "usage": {base: dict(usage) for base, usage in self.usage.items()}
+        }
+
+
+# 全局生命周期管理器
+lifecycle = LifecycleManager(SharedHolds(LIFECYCLE_HOLDS_DB) if LIFECYCLE_SHARED else None)
+
+
+def _collect_metrics():
+    """各目录的文件数、大小和清理统计"""
+    stats = lifecycle.stats()
+    usage = stats["usage"]
+    return [
+        snapshot_gauge("dir_files", "受管理目录中的文件数（上次清理时）",
+                       {(os.path.basename(base),): u["files"] for base, u in usage.items()}, ["dir"]),
+        snapshot_gauge("dir_bytes", "受管理目录中的文件总大小（上次清理时）",
+                       {(os.path.basename(base),): u["bytes"] for base, u in usage.items()}, ["dir"]),
+        snapshot_gauge("files_held", "正在使用中的受保护路径数", {(): stats["held"]}),
+        snapshot_counter("evicted_files_total", "清理删除的文件数", {(): stats["evicted_files"]}),
+        snapshot_counter("evicted_bytes_total", "清理删除的字节数", {(): stats["evicted_bytes"]})
+    ]
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,450 @@
+import os
+import json
+import time
+import random
+import asyncio
+import functools
+import threading
+from collections import deque
+from typing import Callable, Dict, Any, Optional
+from urllib.parse import urlsplit
+import httpx
+from .logger import script_logger
+from .models import APIConfig
+from .pipeline import llm_stage
+from .metrics import span, LLM_REQUESTS, record_llm_usage, register_collector, snapshot_gauge, snapshot_counter
+
+# 大模型API连接配置
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))  # 读取超时（秒）
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 10))  # 连接超时（秒）
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))  # 每个服务地址的连接池大小
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", 20))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60))
+# 流式请求是否附带stream_options.include_usage以获取token用量，部分兼容服务不认识该字段会返回400
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "true").lower() == "true"
+
+# 重试配置：连接失败、超时、429和5xx响应按带随机抖动的指数退避重试
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))  # 第一次重试的最长等待时间（秒）
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 8))  # 单次重试的最长等待时间（秒）
+
+# 备用服务：主服务失败时切换到备用服务；启用对冲请求时，主服务耗时超过其p95仍未返回则同时请求备用服务
+LLM_SECONDARY_URL = os.getenv("LLM_SECONDARY_URL", "")
+LLM_SECONDARY_API_KEY = os.getenv("LLM_SECONDARY_API_KEY", "")
+LLM_SECONDARY_MODEL = os.getenv("LLM_SECONDARY_MODEL", "")  # 为空时使用请求中的模型名称
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", 20))  # 样本不足时发起对冲请求的等待时间（秒）
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))  # 使用p95作为等待时间所需的最少样本数
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", 200))  # 计算延迟分位数的最近请求数
+
+# 可以重试的HTTP状态码
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """可以重试的大模型请求错误"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class StreamInterrupted(Exception):
+    """流式响应在收到部分内容后中断，已交给调用方的内容无法撤回，不再重试"""
+
+
+# 流式响应中每收到一段内容调用一次，返回True时提前结束读取
+DeltaCallback = Callable[[str], Optional[bool]]
+
+
+class Endpoint:
+    """
+    一个大模型服务地址及其统计信息
+
+    记录最近LLM_LATENCY_WINDOW次请求的耗时，用于计算对冲请求的等待时间。
+    被对冲请求取消的请求记录取消时已经过的时间（实际耗时的下限），避免慢服务的延迟被低估
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        parts = urlsplit(url)
+        self.origin = f"{parts.scheme}://{parts.netloc}"
+        self.latencies = deque(maxlen=LLM_LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        # 该服务拒绝过stream_options后不再附带
+        self.stream_usage = LLM_STREAM_USAGE
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    def hedge_delay(self) -> float:
+        """发起对冲请求前的等待时间：样本足够时取p95"""
+        with self._lock:
+            enough = len(self.latencies) >= LLM_HEDGE_MIN_SAMPLES
+        return self.percentile(0.95) if enough else LLM_HEDGE_DELAY
+
+
+_endpoints: Dict[str, Endpoint] = {}
+_clients: Dict[str, httpx.AsyncClient] = {}
+hedged_requests = 0
+hedge_wins = 0
+failovers = 0
+
+
+def get_endpoint(url: str) -> Endpoint:
+    endpoint = _endpoints.get(url)
+    if endpoint is None:
+        endpoint = _endpoints.setdefault(url, Endpoint(url))
+    return endpoint
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+    )
+
+
+def get_client(endpoint: Endpoint) -> httpx.AsyncClient:
+    """获取服务地址对应的异步HTTP客户端，每个地址一个连接池，慢服务不会占满其他服务的连接"""
+    client = _clients.get(endpoint.origin)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(timeout=_timeout(), limits=_limits())
+        _clients[endpoint.origin] = client
+        script_logger.debug(f"创建大模型API连接池: {endpoint.origin}")
+    return client
+
+
+def _secondary(primary: Endpoint) -> Optional[Endpoint]:
+    if not LLM_SECONDARY_URL or LLM_SECONDARY_URL == primary.url:
+        return None
+    return get_endpoint(LLM_SECONDARY_URL)
+
+
+def _secondary_request(api_key: str, payload: Dict[str, Any]):
+    """备用服务使用自己的密钥，配置了模型名称时替换请求中的模型"""
+    if LLM_SECONDARY_MODEL:
+        payload = {**payload, "model": LLM_SECONDARY_MODEL}
+    return LLM_SECONDARY_API_KEY or api_key, payload
+
+
+def _headers(api_key: str) -> Dict[str, str]:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+
+
+def _check_response(response: httpx.Response) -> Dict[str, Any]:
+    if response.status_code in RETRY_STATUS:
+        retry_after = response.headers.get("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            retry_after = None
+        raise RetryableError(f"大模型服务返回 {response.status_code}", retry_after)
+    response.raise_for_status()
+    return response.json()
+
+
+def _backoff(attempt: int, error: RetryableError) -> float:
+    """第attempt次重试前的等待时间：全抖动指数退避，服务给出Retry-After时不短于该值"""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+    if error.retry_after:
+        delay = max(delay, min(error.retry_after, LLM_BACKOFF_MAX))
+    return delay
+
+
+async def _post_once(endpoint: Endpoint, api_key: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    endpoint.requests += 1
+    start_time = time.monotonic()
+    try:
+        response = await get_client(endpoint).post(endpoint.url, headers=_headers(api_key), json=payload)
+        response_data = _check_response(response)
+    except asyncio.CancelledError:
+        endpoint.observe(time.monotonic() - start_time)
+        raise
+    except (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError) as e:
+        endpoint.errors += 1
+        raise RetryableError(f"{type(e).__name__}: {str(e)}")
+    except Exception:
+        endpoint.errors += 1
+        raise
+    endpoint.observe(time.monotonic() - start_time)
+    return response_data
+
+
+async def _stream_once(endpoint: Endpoint, api_key: str, payload: Dict[str, Any],
+                       on_delta: DeltaCallback) -> Dict[str, Any]:
+    """
+    读取流式响应（Server-Sent Events），把各段内容交给on_delta，返回与非流式接口相同结构的响应
+
+    on_delta返回True时不再读取剩余内容，直接关闭连接
+    """
+    endpoint.requests += 1
+    start_time = time.monotonic()
+    parts = []
+    usage = None
+    finish_reason = None
+    try:
+        async with get_client(endpoint).stream(
+            "POST", endpoint.url, headers=_headers(api_key), json=payload
+        ) as response:
+            if response.status_code >= 400 or not response.headers.get("content-type", "").startswith("text/event-stream"):
+                # 不支持流式输出的服务直接返回完整响应
+                await response.aread()
+                response_data = _check_response(response)
+                on_delta(response_data["choices"][0]["message"]["content"])
+                endpoint.observe(time.monotonic() - start_time)
+                return response_data
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or usage
+                stop = False
+                for choice in chunk.get("choices") or []:
+                    finish_reason = choice.get("finish_reason") or finish_reason
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        parts.append(delta)
+                        stop = bool(on_delta(delta)) or stop
+                if stop:
+                    finish_reason = finish_reason or "stop"
+                    break
+    except asyncio.CancelledError:
+        endpoint.observe(time.monotonic() - start_time)
+        raise
+    except (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError) as e:
+        endpoint.errors += 1
+        if parts:
+            raise StreamInterrupted(f"大模型流式响应中断: {type(e).__name__}: {str(e)}")
+        raise RetryableError(f"{type(e).__name__}: {str(e)}")
+    except Exception:
+        endpoint.errors += 1
+        raise
+    endpoint.observe(time.monotonic() - start_time)
+    response_data = {
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(parts)},
+            "finish_reason": finish_reason
+        }]
+    }
+    if usage:
+        response_data["usage"] = usage
+    return response_data
+
+
+async def _post_with_retries(endpoint: Endpoint, api_key: str, payload: Dict[str, Any],
+                             on_delta: Optional[DeltaCallback] = None) -> Dict[str, Any]:
+    """发送请求，失败时按退避策略重试；提供on_delta时以流式方式读取响应"""
+    once = _post_once if on_delta is None else functools.partial(_stream_once, on_delta=on_delta)
+    attempt = 0
+    while True:
+        try:
+            return await once(endpoint, api_key, payload)
+        except RetryableError as e:
+            if attempt >= LLM_MAX_RETRIES:
+                raise
+            delay = _backoff(attempt, e)
+            attempt += 1
+            endpoint.retries += 1
+            script_logger.warning(f"大模型请求失败（{endpoint.origin}）: {str(e)}，{delay:.2f} 秒后第 {attempt} 次重试")
+            await asyncio.sleep(delay)
+
+
+async def _stream_with_retries(endpoint: Endpoint, api_key: str, payload: Dict[str, Any],
+                               on_delta: DeltaCallback) -> Dict[str, Any]:
+    """
+    流式请求，服务支持时附带stream_options获取token用量
+
+    服务对带stream_options的请求返回400时去掉该字段重试一次，并记住该服务不支持
+    """
+    if not endpoint.stream_usage:
+        return await _post_with_retries(endpoint, api_key, payload, on_delta)
+    try:
+        return await _post_with_retries(endpoint, api_key, {**payload, "stream_options": {"include_usage": True}},
+                                        on_delta)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 400:
+            raise
+        endpoint.stream_usage = False
+        script_logger.warning(f"大模型服务 {endpoint.origin} 拒绝了stream_options，去掉该字段重试")
+        return await _post_with_retries(endpoint, api_key, payload, on_delta)
+
+
+async def _hedged(primary: Endpoint, secondary: Endpoint, api_key: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    对冲请求：主服务在其p95耗时内没有返回时同时请求备用服务，取先成功的结果并取消另一个；
+    主服务在此之前失败时直接切换到备用服务
+    """
+    global hedged_requests, hedge_wins, failovers
+    secondary_key, secondary_payload = _secondary_request(api_key, payload)
+    first = asyncio.ensure_future(_post_with_retries(primary, api_key, payload))
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=primary.hedge_delay())
+        if done:
+            try:
+                return first.result()
+            except Exception as e:
+                failovers += 1
+                script_logger.warning(f"大模型主服务请求失败: {str(e)}，切换到备用服务 {secondary.origin}")
+                return await _post_with_retries(secondary, secondary_key, secondary_payload)
+
+        hedged_requests += 1
+        script_logger.info(f"大模型主服务超过 {primary.hedge_delay():.2f} 秒未返回，向备用服务 {secondary.origin} 发起对冲请求")
+        second = asyncio.ensure_future(_post_with_retries(secondary, secondary_key, secondary_payload))
+        tasks.add(second)
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def _complete(api_config: APIConfig, payload: Dict[str, Any]) -> Dict[str, Any]:
+    global failovers
+    primary = get_endpoint(api_config.api_url)
+    secondary = _secondary(primary)
+    if secondary is None:
+        return await _post_with_retries(primary, api_config.api_key, payload)
+    if LLM_HEDGE_ENABLED:
+        return await _hedged(primary, secondary, api_config.api_key, payload)
+    try:
+        return await _post_with_retries(primary, api_config.api_key, payload)
+    except Exception as e:
+        failovers += 1
+        script_logger.warning(f"大模型主服务请求失败: {str(e)}，切换到备用服务 {secondary.origin}")
+        return await _post_with_retries(secondary, *_secondary_request(api_config.api_key, payload))
+
+
+async def post_chat_completion(api_config: APIConfig, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    异步调用兼容OpenAI的chat completions接口
+
+    失败时按退避策略重试，配置了备用服务时支持对冲请求和故障切换
+
+    参数:
+        api_config: API配置
+        payload: 请求体
+
+    返回:
+        Dict[str, Any]: 响应JSON
+    """
+    async with llm_stage.slot():
+        with span("llm"):
+            try:
+                response_data = await _complete(api_config, payload)
+            except Exception:
+                LLM_REQUESTS.inc(status="error")
+                raise
+    LLM_REQUESTS.inc(status="ok")
+    record_llm_usage(response_data)
+    return response_data
+
+
+async def stream_chat_completion(api_config: APIConfig, payload: Dict[str, Any],
+                                 on_delta: DeltaCallback) -> Dict[str, Any]:
+    """
+    以流式方式（stream: true）调用chat completions接口，每收到一段内容调用on_delta
+
+    收到第一段内容之前失败时按退避策略重试，并可切换到备用服务；收到内容之后不再重试或切换，
+    因此不发起对冲请求。on_delta返回True时提前结束读取
+
+    返回:
+        Dict[str, Any]: 与非流式接口结构相同的响应，content为收到的全部内容
+    """
+    global failovers
+    payload = {**payload, "stream": True}
+    primary = get_endpoint(api_config.api_url)
+    secondary = _secondary(primary)
+    async with llm_stage.slot():
+        with span("llm"):
+            try:
+                try:
+                    response_data = await _stream_with_retries(primary, api_config.api_key, payload, on_delta)
+                except StreamInterrupted:
+                    raise
+                except Exception as e:
+                    if secondary is None:
+                        raise
+                    failovers += 1
+                    script_logger.warning(f"大模型主服务请求失败: {str(e)}，切换到备用服务 {secondary.origin}")
+                    secondary_key, secondary_payload = _secondary_request(api_config.api_key, payload)
+                    response_data = await _stream_with_retries(secondary, secondary_key, secondary_payload, on_delta)
+            except Exception:
+                LLM_REQUESTS.inc(status="error")
+                raise
+    LLM_REQUESTS.inc(status="ok")
+    record_llm_usage(response_data)
+    return response_data
+
+
+async def close_client():
+    """关闭所有连接池"""
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
+    script_logger.debug("大模型API连接池已关闭")
+
+
+def _collect_metrics():
+    """各服务地址的请求数、错误数、重试数和延迟分位数，以及对冲和故障切换次数"""
+    endpoints = {}
+    for endpoint in list(_endpoints.values()):
+        # 同一服务的不同路径合并统计
+        stats = endpoints.setdefault(endpoint.origin, [0, 0, 0, None, None])
+        stats[0] += endpoint.requests
+        stats[1] += endpoint.errors
+        stats[2] += endpoint.retries
+        stats[3] = endpoint.percentile(0.5)
+        stats[4] = endpoint.percentile(0.95)
+    return [
+        snapshot_counter("llm_endpoint_requests_total", "发往各大模型服务的请求数（含重试）",
+                         {(origin,): s[0] for origin, s in endpoints.items()}, ["endpoint"]),
+        snapshot_counter("llm_endpoint_errors_total", "各大模型服务的请求失败数",
+                         {(origin,): s[1] for origin, s in endpoints.items()}, ["endpoint"]),
+        snapshot_counter("llm_retries_total", "各大模型服务的重试次数",
+                         {(origin,): s[2] for origin, s in endpoints.items()}, ["endpoint"]),
+        snapshot_gauge("llm_latency_seconds", "各大模型服务最近请求的耗时分位数",
+                       {**{(origin, "0.5"): s[3] for origin, s in endpoints.items() if s[3] is not None},
+                        **{(origin, "0.95"): s[4] for origin, s in endpoints.items() if s[4] is not None}},
+                       ["endpoint", "quantile"]),
+        snapshot_counter("llm_hedged_requests_total", "发起的对冲请求数", {(): hedged_requests}),
+        snapshot_counter("llm_hedge_wins_total", "备用服务先返回的对冲请求数", {(): hedge_wins}),
+        snapshot_counter("llm_failovers_total", "主服务失败后切换到备用服务的次数", {(): failovers})
+    ]
+
+
+register_collector(_collect_metrics)
@@ -1,11 +1,12 @@
 import os
+import json
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+import threading
+from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler, QueueHandler
 import time
-from dotenv import load_dotenv
-
-# 加载环境变量
-load_dotenv()
+from .metrics import HTTP_REQUESTS, HTTP_DURATION, register_collector, snapshot_gauge, snapshot_counter
 
 # 日志目录
 LOG_DIR = os.getenv("LOG_DIR", "logs")
@@ -41,6 +42,177 @@ CONSOLE_OUTPUT = os.getenv("CONSOLE_OUTPUT", "true").lower() == "true"
 TIME_ROTATING = os.getenv("TIME_ROTATING", "false").lower() == "true"
 ROTATE_WHEN = os.getenv("ROTATE_WHEN", "midnight")  # 默认每天午夜轮转
 
+# 是否使用队列异步写日志：调用方只把日志记录放入队列，由后台线程批量写入文件和控制台
+LOG_QUEUE_ENABLED = os.getenv("LOG_QUEUE_ENABLED", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # 队列容量
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "block").lower()  # 队列满时的策略：block等待，drop丢弃
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 256))  # 后台线程每批最多写入的记录数
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 0.5))  # 空闲时的最长刷新间隔（秒）
+
+# 是否输出结构化的JSON行日志
+LOG_JSON = os.getenv("LOG_JSON", "false").lower() == "true"
+
+
+class JsonLineFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，只包含固定的几个字段，序列化开销低"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _DeferredFlushMixin:
+    """
+    批量模式下推迟刷新：每条记录只写入缓冲区，由后台线程在一批记录写完后统一刷新
+    """
+
+    deferred = False
+
+    def flush(self):
+        if not self.deferred:
+            super().flush()
+
+    def flush_batch(self):
+        super().flush()
+
+
+class BatchedRotatingFileHandler(_DeferredFlushMixin, RotatingFileHandler):
+    pass
+
+
+class BatchedTimedRotatingFileHandler(_DeferredFlushMixin, TimedRotatingFileHandler):
+    pass
+
+
+class BatchedStreamHandler(_DeferredFlushMixin, logging.StreamHandler):
+    pass
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    把日志记录放入有界队列，并附带该记录器的目标处理器
+
+    队列满时按策略阻塞等待或丢弃记录，丢弃的数量会被统计
+    """
+
+    def __init__(self, log_queue: queue.Queue, targets, policy: str):
+        super().__init__(log_queue)
+        self.targets = tuple(targets)
+        self.policy = policy
+        self.dropped = 0
+
+    def enqueue(self, record):
+        # 后台线程在第一条日志写入时才启动，导入模块和派生工作进程时都不创建线程
+        _listener.start()
+        item = (self.targets, record)
+        if self.policy == "drop":
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+        else:
+            self.queue.put(item)
+
+
+class BatchingListener:
+    """
+    日志队列的后台消费线程
+
+    每次取出最多LOG_BATCH_SIZE条记录交给各自的处理器写入缓冲区，整批写完后才刷新，
+    文件轮转也在该线程中进行，不会占用请求处理线程和事件循环
+    """
+
+    _STOP = object()
+
+    def __init__(self, log_queue: queue.Queue, batch_size: int, flush_interval: float):
+        self.queue = log_queue
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name="log-listener", daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def _handle(self, item, touched: set):
+        targets, record = item
+        for handler in targets:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+                touched.add(handler)
+
+    def _flush(self, handlers):
+        for handler in handlers:
+            try:
+                handler.flush_batch()
+            except Exception:
+                pass
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if item is self._STOP:
+                break
+            touched = set()
+            self._handle(item, touched)
+            stopping = False
+            for _ in range(self.batch_size - 1):
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                self._handle(item, touched)
+            self._flush(touched)
+            if stopping:
+                break
+
+    def stop(self):
+        """写完队列中剩余的记录后停止线程"""
+        if self._thread is None:
+            return
+        self.queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+        # 停止前后仍可能有少量记录进入队列，直接写出
+        touched = set()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                self._handle(item, touched)
+        self._flush(touched)
+
+
+# 所有记录器共享一个日志队列和后台线程
+_log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_listener = BatchingListener(_log_queue, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL)
+_queue_handlers = []
+
 
 def get_logger(name, log_file=None):
     """
@@ -69,36 +241,99 @@ def get_logger(name, log_file=None):
         log_file = os.path.join(LOG_DIR, log_file)
     
     # 创建格式化器
-    formatter = logging.Formatter(LOG_FORMAT)
+    formatter = JsonLineFormatter() if LOG_JSON else logging.Formatter(LOG_FORMAT)
+    handlers = []
     
-    # 添加文件处理器
+    # 添加文件处理器（第一条日志写入时才打开文件）
     if TIME_ROTATING:
         # 使用按时间轮转的文件处理器
-        file_handler = TimedRotatingFileHandler(
+        file_handler = BatchedTimedRotatingFileHandler(
             log_file, 
             when=ROTATE_WHEN,
-            backupCount=BACKUP_COUNT
+            backupCount=BACKUP_COUNT,
+            delay=True
         )
     else:
         # 使用按大小轮转的文件处理器
-        file_handler = RotatingFileHandler(
+        file_handler = BatchedRotatingFileHandler(
             log_file, 
             maxBytes=MAX_LOG_SIZE, 
-            backupCount=BACKUP_COUNT
+            backupCount=BACKUP_COUNT,
+            delay=True
         )
     
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    handlers.append(file_handler)
     
     # 如果配置要求，添加控制台处理器
     if CONSOLE_OUTPUT:
-        console_handler = logging.StreamHandler()
+        console_handler = BatchedStreamHandler()
         console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        handlers.append(console_handler)
+    
+    if LOG_QUEUE_ENABLED:
+        # 记录器上只挂队列处理器，实际写入由后台线程完成
+        for handler in handlers:
+            handler.deferred = True
+        queue_handler = BoundedQueueHandler(_log_queue, handlers, LOG_QUEUE_POLICY)
+        _queue_handlers.append(queue_handler)
+        logger.addHandler(queue_handler)
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
     
     return logger
 
 
+def shutdown_logging():
+    """停止后台写日志线程并写完队列中剩余的日志，在服务关闭时调用"""
+    if not _queue_handlers:
+        return
+    # 之后的日志改为由记录器直接写入，避免关闭过程中的日志丢失
+    for logger in list(logging.Logger.manager.loggerDict.values()):
+        if not isinstance(logger, logging.Logger):
+            continue
+        for handler in [h for h in logger.handlers if h in _queue_handlers]:
+            logger.removeHandler(handler)
+            for target in handler.targets:
+                logger.addHandler(target)
+    _listener.stop()
+    for handler in _queue_handlers:
+        for target in handler.targets:
+            target.deferred = False
+            target.flush()
+    _queue_handlers.clear()
+
+
+def _collect_metrics():
+    """日志队列深度和丢弃的记录数"""
+    return [
+        snapshot_gauge("log_queue_size", "日志队列中等待写入的记录数", {(): _log_queue.qsize()}),
+        snapshot_counter("log_dropped_total", "日志队列已满时丢弃的记录数",
+                         {(): sum(handler.dropped for handler in _queue_handlers)})
+    ]
+
+
+def _reinit_after_fork():
+    """
+    派生出的子进程中没有父进程的后台线程，队列的内部锁也可能处于被持有的状态：
+    换用新的队列，后台线程在子进程写第一条日志时重新启动
+    """
+    global _log_queue
+    _log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _listener.queue = _log_queue
+    _listener._thread = None
+    _listener._start_lock = threading.Lock()
+    for handler in _queue_handlers:
+        handler.queue = _log_queue
+        handler.dropped = 0
+
+
+register_collector(_collect_metrics)
+atexit.register(shutdown_logging)
+os.register_at_fork(after_in_child=_reinit_after_fork)
+
+
 # 应用日志记录器
 app_logger = get_logger("app", "application.log")
 
@@ -140,6 +375,11 @@ class LoggerMiddleware:
                 access_logger.info(
                     f"{client} - {method} {path} {status_code} - {process_time:.4f}s"
                 )
+                # 按路由模板而不是实际路径统计，避免任务ID等路径参数产生大量标签
+                route = scope.get("route")
+                route_path = getattr(route, "path", "unmatched")
+                HTTP_REQUESTS.inc(method=method, route=route_path, status=status_code)
+                HTTP_DURATION.observe(process_time, route=route_path)
             
             await send(message)
         
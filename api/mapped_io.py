@@ -0,0 +1,173 @@
+"""
+基于内存映射（mmap）的文件读取和编码检测
+
+示例数据采样、记录边界查找和转换结果回传直接在映射的缓冲区上进行，只有实际访问的页被读入内存，
+峰值内存与读取的片段大小成正比，而不是与文件大小成正比。文件编码按开头的少量字节检测
+（BOM、候选编码），不再假定为UTF-8。
+
+本模块只依赖标准库，沙箱工作进程也会使用
+"""
+import io
+import os
+import mmap
+import codecs
+from contextlib import contextmanager
+from typing import Iterator, Tuple, Union
+
+# 编码检测配置
+ENCODING_DETECT_BYTES = int(os.getenv("ENCODING_DETECT_BYTES", 64 * 1024))  # 检测编码时读取的开头字节数
+ENCODING_CANDIDATES = [  # 没有BOM时按顺序尝试的编码，都无法解码时按UTF-8处理（错误字符替换）
+    name.strip() for name in os.getenv("ENCODING_CANDIDATES", "utf-8,gb18030").split(",") if name.strip()
+]
+
+# BOM及对应的编码，UTF-32 LE的BOM以UTF-16 LE的BOM开头，需要先检查
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+# 映射的缓冲区：mmap对象，空文件为bytes，两者都支持切片、find和rfind
+Buffer = Union[mmap.mmap, bytes]
+
+
+def detect_encoding(prefix: bytes) -> Tuple[str, int]:
+    """
+    按内容开头检测编码
+
+    返回:
+        Tuple[str, int]: (编码, BOM的字节数)；含NUL字节的二进制内容不做猜测，按UTF-8处理
+    """
+    for bom, encoding in _BOMS:
+        if prefix.startswith(bom):
+            return encoding, len(bom)
+    if b"\x00" in prefix:
+        return "utf-8", 0
+    for encoding in ENCODING_CANDIDATES:
+        try:
+            # 前缀末尾可能截断了一个多字节字符，不视为错误
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)
+        except (UnicodeDecodeError, LookupError):
+            continue
+        return encoding, 0
+    return "utf-8", 0
+
+
+def file_encoding(path: str) -> Tuple[str, int]:
+    """检测文件的编码，只读取开头ENCODING_DETECT_BYTES字节"""
+    with open(path, "rb") as f:
+        return detect_encoding(f.read(ENCODING_DETECT_BYTES))
+
+
+def code_unit(encoding: str) -> int:
+    """编码的最小单位字节数，按字节偏移切分时需要对齐"""
+    if encoding.startswith("utf-32"):
+        return 4
+    if encoding.startswith("utf-16"):
+        return 2
+    return 1
+
+
+def newline_bytes(encoding: str) -> bytes:
+    return "\n".encode(encoding)
+
+
+@contextmanager
+def mapped(path: str, sequential: bool = False) -> Iterator[Buffer]:
+    """
+    以只读方式映射整个文件
+
+    sequential为True时提示内核顺序预读，否则按随机访问处理（采样只访问少数几个窗口）。
+    使用方持有的memoryview切片在退出时仍未释放的，映射交由垃圾回收关闭
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mm, "madvise"):
+        mm.madvise(mmap.MADV_SEQUENTIAL if sequential else mmap.MADV_RANDOM)
+    try:
+        yield mm
+    finally:
+        try:
+            mm.close()
+        except BufferError:
+            pass
+
+
+def decode_window(buf: Buffer, start: int, end: int, encoding: str) -> str:
+    """解码[start, end)的片段，起止位置按编码单位对齐，只复制这一片段"""
+    unit = code_unit(encoding)
+    start -= start % unit
+    end -= (end - start) % unit
+    return codecs.decode(buf[start:end], encoding, "replace")
+
+
+def next_line_start(buf: Buffer, position: int, encoding: str = "utf-8") -> int:
+    """position处或之后第一个换行符之后的位置，没有换行时返回缓冲区长度"""
+    newline = newline_bytes(encoding)
+    index = buf.find(newline, position)
+    return len(buf) if index < 0 else index + len(newline)
+
+
+def last_line_end(buf: Buffer, start: int, end: int, encoding: str = "utf-8") -> int:
+    """[start, end)中最后一个换行符之后的位置，即对齐到记录边界的终点；没有换行时返回start"""
+    newline = newline_bytes(encoding)
+    index = buf.rfind(newline, start, end)
+    return start if index < 0 else index + len(newline)
+
+
+def open_text(path: str, errors: str = "replace", newline: str = ""):
+    """按检测到的编码以文本方式打开文件（跳过BOM），逐块解码，不整体读入内存"""
+    encoding, bom = file_encoding(path)
+    raw = open(path, "rb")
+    raw.seek(bom)
+    return io.TextIOWrapper(raw, encoding=encoding, errors=errors, newline=newline)
+
+
+def iter_text_chunks(path: str, chunk_size: int) -> Iterator[str]:
+    """按检测到的编码分块解码文件内容，每次只读取一个块"""
+    encoding, bom = file_encoding(path)
+    decoder = codecs.getincrementaldecoder(encoding)("replace")
+    with mapped(path, sequential=True) as buf:
+        view = memoryview(buf)
+        try:
+            for start in range(bom, len(buf), chunk_size):
+                text = decoder.decode(view[start:start + chunk_size])
+                if text:
+                    yield text
+        finally:
+            view.release()
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def transcode_to_utf8(chunks: Iterator[bytes]) -> Tuple[str, Iterator[bytes]]:
+    """
+    按第一个数据块检测编码，不是UTF-8时把数据流逐块转为UTF-8（去掉BOM）
+
+    返回:
+        Tuple[str, Iterator[bytes]]: (检测到的编码, 转换后的数据块)
+    """
+    first = next(chunks, b"")
+    encoding, bom = detect_encoding(first[:ENCODING_DETECT_BYTES])
+    if encoding == "utf-8":
+        return encoding, _chain(first, chunks)
+
+    def convert():
+        decoder = codecs.getincrementaldecoder(encoding)("replace")
+        yield decoder.decode(first[bom:]).encode("utf-8")
+        for chunk in chunks:
+            yield decoder.decode(chunk).encode("utf-8")
+        yield decoder.decode(b"", final=True).encode("utf-8")
+    return encoding, convert()
+
+
+def _chain(first: bytes, rest: Iterator[bytes]) -> Iterator[bytes]:
+    if first:
+        yield first
+    yield from rest
@@ -0,0 +1,118 @@
+import os
+import uuid
+import threading
+from typing import Dict, Optional
+from .logger import script_logger
+from .metrics import register_collector, snapshot_gauge, snapshot_counter
+
+# 内存I/O配置：小的文本转换请求把输入输出文件放在tmpfs（内存文件系统）中，不落盘
+MEMORY_IO_ENABLED = os.getenv("MEMORY_IO_ENABLED", "true").lower() == "true"
+MEMORY_IO_DIR = os.getenv("MEMORY_IO_DIR", "/dev/shm")  # tmpfs挂载目录
+MEMORY_IO_MAX_BYTES = int(os.getenv("MEMORY_IO_MAX_BYTES", 1024 * 1024))  # 超过该大小的内容仍写入磁盘
+MEMORY_IO_OUTPUT_MAX_BYTES = int(os.getenv("MEMORY_IO_OUTPUT_MAX_BYTES", 4 * 1024 * 1024))  # 每个请求在内存中的输出大小上限
+MEMORY_IO_BUDGET = int(os.getenv("MEMORY_IO_BUDGET", 256 * 1024 * 1024))  # 同时放在内存中的输入和输出额度总和上限
+
+
+class MemoryIO:
+    """
+    基于tmpfs的临时文件
+
+    生成的脚本仍然按文件路径读写（与沙箱工作进程之间只传递路径），但文件位于内存文件系统中。
+    每个请求按输入大小加上输出上限output_max_bytes申请额度，超过单个请求阈值、总额度不足或
+    tmpfs不可用时退回磁盘。沙箱通过RLIMIT_FSIZE限制输出不超过output_max_bytes，超出时改为
+    输出到磁盘重新执行（spill）。
+    """
+
+    def __init__(self, base_dir: str, max_bytes: int, budget: int, output_max_bytes: int):
+        self.max_bytes = max_bytes
+        self.budget = budget
+        self.output_max_bytes = output_max_bytes
+        self.directory = self._prepare(base_dir) if MEMORY_IO_ENABLED else None
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.memory_requests = 0
+        self.disk_fallbacks = 0
+        self.spills = 0
+
+    @staticmethod
+    def _prepare(base_dir: str) -> Optional[str]:
+        directory = os.path.join(base_dir, "text_formatter")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if not os.access(directory, os.W_OK):
+                return None
+        except OSError:
+            return None
+        return directory
+
+    @property
+    def available(self) -> bool:
+        return self.directory is not None
+
+    def reserve(self, size: int) -> bool:
+        """为一个请求申请内存额度（输入大小加上输出上限），返回是否使用内存I/O"""
+        with self._lock:
+            amount = size + self.output_max_bytes
+            if self.available and size <= self.max_bytes and self.in_use + amount <= self.budget:
+                self.in_use += amount
+                self.memory_requests += 1
+                return True
+            self.disk_fallbacks += 1
+            return False
+
+    def release(self, size: int):
+        """释放reserve(size)申请的额度"""
+        with self._lock:
+            self.in_use = max(0, self.in_use - size - self.output_max_bytes)
+
+    def record_spill(self):
+        with self._lock:
+            self.spills += 1
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def new_path(self, suffix: str = ".txt") -> str:
+        return self.path(f"{uuid.uuid4().hex}{suffix}")
+
+    def is_memory_path(self, path: Optional[str]) -> bool:
+        return bool(path) and self.available and os.path.dirname(os.path.abspath(path)) == self.directory
+
+    def discard(self, *paths: Optional[str]):
+        """删除内存中的临时文件，释放tmpfs空间；磁盘上的文件不受影响"""
+        for path in paths:
+            if self.is_memory_path(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "available": self.available,
+                "in_use": self.in_use,
+                "memory_requests": self.memory_requests,
+                "disk_fallbacks": self.disk_fallbacks,
+                "spills": self.spills
+            }
+
+
+# 全局内存I/O实例
+memory_io = MemoryIO(MEMORY_IO_DIR, MEMORY_IO_MAX_BYTES, MEMORY_IO_BUDGET, MEMORY_IO_OUTPUT_MAX_BYTES)
+if MEMORY_IO_ENABLED and not memory_io.available:
+    script_logger.warning(f"内存文件系统不可用: {MEMORY_IO_DIR}，文本转换将使用磁盘文件")
+
+
+def _collect_metrics():
+    """内存I/O的使用情况"""
+    stats = memory_io.stats()
+    return [
+        snapshot_gauge("memory_io_bytes", "内存I/O已申请的额度（输入大小加输出上限）", {(): stats["in_use"]}),
+        snapshot_counter("memory_io_requests_total", "文本转换请求使用的I/O方式",
+                         {("memory",): stats["memory_requests"], ("disk",): stats["disk_fallbacks"]}, ["io"]),
+        snapshot_counter("memory_io_spills_total", "输出超出内存上限、改为输出到磁盘重新执行的次数", {(): stats["spills"]})
+    ]
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,237 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# 所有指标名称的前缀
+METRIC_PREFIX = "formatter_"
+
+# 耗时直方图的默认分桶（秒），覆盖从内置转换器的微秒级到大模型调用的分钟级
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# 多进程部署时附加在每个样本上的worker标签，见set_worker
+_worker_label = ""
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if _worker_label:
+        pairs.append(_worker_label)
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """指标基类：按标签值分组保存数据"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """只增不减的计数器"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """可增可减的瞬时值"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """分桶直方图"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# 已注册的指标和抓取时才计算的采集函数
+_metrics: List[Metric] = []
+_collectors: List[Callable[[], List[Metric]]] = []
+
+
+def _register(metric: Metric) -> Metric:
+    _metrics.append(metric)
+    return metric
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return _register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return _register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def register_collector(collector: Callable[[], List[Metric]]):
+    """
+    注册采集函数，每次抓取时调用，返回临时构造的指标
+
+    用于缓存统计、队列深度等已经由各模块自行维护的状态，避免在热路径上重复计数
+    """
+    _collectors.append(collector)
+
+
+def set_worker(worker: str):
+    """
+    为本进程输出的所有样本附加worker标签
+
+    指标保存在各进程的内存中，serve.py的每个工作进程只输出自己的数据，
+    带上工作进程序号后，Prometheus抓取到的不同进程的数据不会被当作同一序列
+    """
+    global _worker_label
+    _worker_label = f'worker="{_escape(worker)}"'
+
+
+def render_metrics() -> str:
+    """
+    以Prometheus文本格式输出所有指标
+
+    采集函数可能读取磁盘或加锁，应在线程池中调用。采集函数出错时跳过其指标，
+    记录日志并计入collector_errors_total
+    """
+    collected: List[str] = []
+    for collector in _collectors:
+        try:
+            for metric in collector():
+                collected.extend(metric.render())
+        except Exception:
+            name = getattr(collector, "__module__", "") + "." + getattr(collector, "__qualname__", repr(collector))
+            COLLECTOR_ERRORS.inc(collector=name)
+            # logger模块依赖本模块，在这里才导入
+            from .logger import app_logger
+            app_logger.error(f"指标采集函数 {name} 出错", exc_info=True)
+    lines: List[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    lines.extend(collected)
+    return "\n".join(lines) + "\n"
+
+
+# 公共指标
+STAGE_DURATION = histogram("stage_duration_seconds", "各处理阶段耗时", ["stage"])
+HTTP_REQUESTS = counter("http_requests_total", "HTTP请求数", ["method", "route", "status"])
+HTTP_DURATION = histogram("http_request_duration_seconds", "HTTP请求耗时（到响应头发出为止）", ["route"])
+LLM_REQUESTS = counter("llm_requests_total", "大模型API请求数", ["status"])
+LLM_TOKENS = counter("llm_tokens_total", "大模型API消耗的token数", ["type"])
+BYTES_IN = counter("bytes_in_total", "接收的输入数据字节数", ["source"])
+BYTES_OUT = counter("bytes_out_total", "生成的输出数据字节数")
+COLLECTOR_ERRORS = counter("collector_errors_total", "指标采集函数出错的次数", ["collector"])
+
+
+@contextmanager
+def span(stage: str):
+    """记录一个处理阶段的耗时，可在同步和异步代码中使用"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+
+
+def observe_stage(stage: str, seconds: float):
+    """记录已知耗时的处理阶段（例如由沙箱工作进程返回的耗时）"""
+    STAGE_DURATION.observe(seconds, stage=stage)
+
+
+def record_llm_usage(response_data: dict):
+    """从兼容OpenAI的响应中记录token用量"""
+    usage = response_data.get("usage") or {}
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            LLM_TOKENS.inc(usage[kind], type=kind[:-len("_tokens")])
+
+
+def snapshot_gauge(name: str, documentation: str, values: Dict[Tuple[str, ...], float],
+                   labelnames: Sequence[str] = ()) -> Gauge:
+    """为采集函数构造一个一次性的Gauge"""
+    metric = Gauge(name, documentation, labelnames)
+    for key, value in values.items():
+        metric.set(value, **dict(zip(metric.labelnames, key)))
+    return metric
+
+
+def snapshot_counter(name: str, documentation: str, values: Dict[Tuple[str, ...], float],
+                     labelnames: Sequence[str] = ()) -> Counter:
+    """为采集函数构造一个一次性的Counter"""
+    metric = Counter(name, documentation, labelnames)
+    for key, value in values.items():
+        metric.inc(value, **dict(zip(metric.labelnames, key)))
+    return metric
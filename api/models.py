@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, List
 
 class APIConfig(BaseModel):
     """API配置模型"""
@@ -23,4 +23,66 @@ class FormatResponse(BaseModel):
 class ErrorResponse(BaseModel):
     """错误响应模型"""
     success: bool = False
-    message: str = Field(..., description="错误消息") 
\ No newline at end of file
+    message: str = Field(..., description="错误消息") 
+class ScriptCacheEntry(BaseModel):
+    """脚本缓存条目模型"""
+    key: str = Field(..., description="缓存键")
+    script_path: str = Field(..., description="脚本路径")
+    instruction: Optional[str] = Field(None, description="生成脚本时的格式转换要求")
+    model_name: Optional[str] = Field(None, description="生成脚本的模型名称")
+    created_at: float = Field(..., description="创建时间戳")
+    last_used: float = Field(..., description="最近使用时间戳")
+    hits: int = Field(0, description="命中次数")
+    pinned: bool = Field(False, description="是否已固定，固定的条目不会被淘汰")
+
+class ScriptCacheStats(BaseModel):
+    """脚本缓存统计模型"""
+    enabled: bool = Field(..., description="是否启用脚本缓存")
+    entries: int = Field(..., description="条目数")
+    pinned: int = Field(..., description="固定条目数")
+    hits: int = Field(..., description="命中次数")
+    misses: int = Field(..., description="未命中次数")
+    evictions: int = Field(..., description="淘汰次数")
+    hit_rate: float = Field(..., description="命中率")
+    max_entries: int = Field(..., description="最大条目数")
+    ttl: int = Field(..., description="条目过期时间（秒），0表示永不过期")
+
+class ScriptCacheResponse(BaseModel):
+    """脚本缓存查询响应模型"""
+    stats: ScriptCacheStats = Field(..., description="统计信息")
+    entries: List[ScriptCacheEntry] = Field(default_factory=list, description="缓存条目")
+
+class TextJobRequest(TextFormatRequest):
+    """文本格式转换任务请求模型"""
+    priority: int = Field(0, description="任务优先级，数值越大越先执行")
+
+class JobStatusResponse(BaseModel):
+    """异步任务状态响应模型"""
+    job_id: str = Field(..., description="任务ID")
+    status: str = Field(..., description="任务状态：queued/running/succeeded/failed/cancelled")
+    stage: str = Field(..., description="当前阶段：queued/generating/executing/done")
+    progress: float = Field(..., description="任务进度，0到1之间")
+    priority: int = Field(0, description="任务优先级")
+    filename: Optional[str] = Field(None, description="上传的文件名")
+    error: Optional[str] = Field(None, description="失败原因")
+    created_at: float = Field(..., description="提交时间戳")
+    started_at: Optional[float] = Field(None, description="开始执行时间戳")
+    finished_at: Optional[float] = Field(None, description="结束时间戳")
+    result_url: Optional[str] = Field(None, description="结果下载地址，任务成功后提供")
+
+class SourceResponse(BaseModel):
+    """增量转换数据源响应模型"""
+    source_id: str = Field(..., description="数据源ID")
+    format_instruction: str = Field(..., description="格式转换要求")
+    append_safe: bool = Field(..., description="脚本能否分段执行；不能时每次有新数据都整体重新转换")
+    header: bool = Field(..., description="输入是否有表头")
+    offset: int = Field(..., description="已转换到的字节偏移（对齐到记录边界）")
+    output_size: int = Field(..., description="累积输出的大小（字节）")
+    run: Optional[str] = Field(None, description="本次运行方式：incremental/full/unchanged")
+    converted_bytes: int = Field(0, description="本次交给脚本转换的输入字节数")
+    incremental_runs: int = Field(..., description="增量转换次数")
+    full_runs: int = Field(..., description="整体转换次数")
+    created_at: float = Field(..., description="注册时间戳")
+    updated_at: float = Field(..., description="最近更新时间戳")
+    output_url: str = Field(..., description="累积输出下载地址，支持Range请求")
+    script_content: Optional[str] = Field(None, description="转换脚本内容，注册时返回")
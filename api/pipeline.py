@@ -0,0 +1,125 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional
+from .logger import app_logger
+from .metrics import register_collector, snapshot_gauge
+
+# 各阶段并发上限
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 32))  # 同时进行的大模型请求数
+EXEC_CONCURRENCY = int(os.getenv("EXEC_CONCURRENCY", os.cpu_count() or 4))  # 同时执行的脚本数
+IO_CONCURRENCY = int(os.getenv("IO_CONCURRENCY", 16))  # 同时进行的磁盘读写数
+
+
+class Stage:
+    """
+    请求处理流水线中的一个阶段
+
+    每个阶段用信号量限制同时进行的任务数；需要执行阻塞调用的阶段还带有一个
+    有界线程池，保证同步的磁盘读写和脚本执行不会阻塞事件循环
+    """
+
+    def __init__(self, name: str, concurrency: int, use_executor: bool = True):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.use_executor = use_executor
+        self.active = 0
+        self.waiting = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # 延迟创建，确保信号量绑定到运行中的事件循环
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.concurrency,
+                thread_name_prefix=f"{self.name}-stage"
+            )
+        return self._executor
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用阶段的一个并发名额"""
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在阶段的线程池中执行阻塞函数"""
+        async with self.slot():
+            if not self.use_executor:
+                return func(*args, **kwargs)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def stats(self) -> Dict[str, int]:
+        return {"concurrency": self.concurrency, "active": self.active, "waiting": self.waiting}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._semaphore = None
+
+
+# 流水线各阶段
+llm_stage = Stage("llm", LLM_CONCURRENCY, use_executor=False)
+exec_stage = Stage("exec", EXEC_CONCURRENCY)
+io_stage = Stage("io", IO_CONCURRENCY)
+
+STAGES = [llm_stage, exec_stage, io_stage]
+
+
+async def run_io(func: Callable, *args, **kwargs) -> Any:
+    """在磁盘I/O阶段执行阻塞函数"""
+    return await io_stage.run(func, *args, **kwargs)
+
+
+async def run_exec(func: Callable, *args, **kwargs) -> Any:
+    """在脚本执行阶段执行阻塞函数"""
+    return await exec_stage.run(func, *args, **kwargs)
+
+
+def pipeline_stats() -> Dict[str, Dict[str, int]]:
+    """返回各阶段的并发状态"""
+    return {stage.name: stage.stats() for stage in STAGES}
+
+
+def _collect_metrics():
+    """流水线各阶段的并发上限、执行中和排队中的任务数"""
+    stats = pipeline_stats()
+    return [
+        snapshot_gauge("stage_concurrency", "流水线阶段并发上限",
+                       {(name,): s["concurrency"] for name, s in stats.items()}, ["stage"]),
+        snapshot_gauge("stage_active", "流水线阶段执行中的任务数",
+                       {(name,): s["active"] for name, s in stats.items()}, ["stage"]),
+        snapshot_gauge("stage_waiting", "流水线阶段排队等待的任务数",
+                       {(name,): s["waiting"] for name, s in stats.items()}, ["stage"])
+    ]
+
+
+register_collector(_collect_metrics)
+
+
+def shutdown_pipeline():
+    """关闭各阶段的线程池"""
+    for stage in STAGES:
+        stage.shutdown()
+    app_logger.info("请求处理流水线已关闭")
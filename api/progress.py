@@ -0,0 +1,93 @@
+"""
+转换进度事件
+
+带进度的接口（/api/format-text/events、/api/format-file/events）为每个请求创建一个Progress，
+生成脚本、验证、执行等阶段调用emit发出事件，响应以Server-Sent Events逐条推送给页面。
+emit可以在线程池中调用；收到的token数和输出文件的大小按PROGRESS_INTERVAL节流上报。
+"""
+import os
+import json
+import time
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
+
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 0.5))  # token数和输出字节数事件的最短间隔（秒）
+
+# 进度事件的阶段
+STAGE_UPLOADED = "uploaded"  # 上传文件已保存
+STAGE_GENERATING = "generating"  # 开始请求大模型生成脚本
+STAGE_TOKENS = "tokens"  # 收到的生成内容（字符数和估计的token数）
+STAGE_CODE_READY = "code_ready"  # 代码块已结束，开始语法检查
+STAGE_CACHED = "cached"  # 使用缓存的脚本或内置转换器，不调用大模型
+STAGE_VALIDATING = "validating"  # 在示例数据上试运行
+STAGE_REPAIRING = "repairing"  # 试运行未通过，请求大模型修复
+STAGE_EXECUTING = "executing"  # 在完整输入上执行
+STAGE_WRITING = "writing"  # 执行中输出文件已写入的字节数
+STAGE_WRITTEN = "written"  # 执行完成，输出文件的大小
+
+
+def sse_event(event: str, data: Any) -> bytes:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class Progress:
+    """一个请求的进度事件队列，必须在事件循环中创建"""
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._started = time.monotonic()
+        self._tokens_at = 0.0
+        self._watched: Optional[str] = None
+        self._watched_size = 0
+
+    def emit(self, stage: str, **data):
+        """发出事件，可以在任意线程中调用"""
+        event: Dict[str, Any] = {"stage": stage, "elapsed": round(time.monotonic() - self._started, 3), **data}
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self._queue.put_nowait(event)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+        except RuntimeError:
+            # 事件循环已关闭，进度不再有人接收
+            pass
+
+    def tokens(self, chars: int, tokens: int, final: bool = False):
+        """上报已收到的生成内容的字符数和估计的token数，按PROGRESS_INTERVAL节流"""
+        now = time.monotonic()
+        if final or now - self._tokens_at >= PROGRESS_INTERVAL:
+            self._tokens_at = now
+            self.emit(STAGE_TOKENS, chars=chars, tokens=tokens)
+
+    def watch(self, path: Optional[str]):
+        """执行期间定期上报该文件已写入的字节数，传入None停止"""
+        self._watched = path
+        self._watched_size = 0
+
+    def _poll_watched(self):
+        path = self._watched
+        if path is None:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size != self._watched_size:
+            self._watched_size = size
+            self.emit(STAGE_WRITING, bytes=size)
+
+    async def follow(self, task: asyncio.Future) -> AsyncIterator[Dict[str, Any]]:
+        """逐条产出事件，直到task完成且队列中的事件都已取出"""
+        while True:
+            if self._queue.empty() and task.done():
+                return
+            try:
+                yield await asyncio.wait_for(self._queue.get(), timeout=PROGRESS_INTERVAL)
+            except asyncio.TimeoutError:
+                self._poll_watched()
@@ -0,0 +1,181 @@
+import os
+import shutil
+import hashlib
+import threading
+from typing import Dict, Optional
+from .logger import script_logger
+from .lifecycle import lifecycle, shard_path, quota_from_env
+from .compression import compress_file, GZIP_SUFFIX
+from .metrics import register_collector, snapshot_counter
+from .shared_store import shared_store
+
+# 转换结果存储配置
+RESULT_STORE_ENABLED = os.getenv("RESULT_STORE_ENABLED", "true").lower() == "true"
+RESULTS_DIR = os.getenv("RESULTS_DIR", "results")
+
+# 结果压缩保存配置：文本结果通常可压缩5-10倍，压缩保存后可直接以gzip编码发送给客户端
+RESULT_COMPRESS = os.getenv("RESULT_COMPRESS", "true").lower() == "true"
+RESULT_COMPRESS_LEVEL = int(os.getenv("RESULT_COMPRESS_LEVEL", 1))  # 压缩级别，默认优先速度
+RESULT_COMPRESS_MIN_BYTES = int(os.getenv("RESULT_COMPRESS_MIN_BYTES", 4096))  # 小于该大小的结果不压缩
+RESULT_COMPRESS_MAX_BYTES = int(os.getenv("RESULT_COMPRESS_MAX_BYTES", 1024 ** 3))  # 大于该大小的结果不压缩，避免拖慢请求
+RESULT_SHARED_MAX_ENTRIES = int(os.getenv("RESULT_SHARED_MAX_ENTRIES", 10000))  # 网络共享存储中保留的结果数
+
+RESULTS_NAMESPACE = "results"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def result_key(input_digest: str, format_instruction: str, script_content: str) -> str:
+    """由输入内容哈希、格式要求和脚本内容哈希组成的结果键，同一键的输出内容相同"""
+    script_digest = content_hash(script_content.encode("utf-8"))
+    raw = "\0".join([input_digest, format_instruction, script_digest])
+    return content_hash(raw.encode("utf-8"))
+
+
+class ResultStore:
+    """
+    按内容寻址的转换结果存储
+
+    (输入哈希, 格式要求, 脚本哈希) 相同的转换输出相同，执行一次后输出文件保存在 results/<前缀>/<键>.out，
+    之后相同的转换和下载请求直接使用该文件，不再执行脚本。文件由生命周期管理按配额清理。
+    大小合适的结果以gzip压缩保存为 <键>.out.gz，读取时用compression.open_plain透明解压。
+    共享存储支持文件（网络后端）时，结果同时上传，其他机器本地未命中时下载使用；
+    同一台机器上的多个工作进程直接共用结果目录。
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.compressed_in = 0
+        self.compressed_out = 0
+
+    def _path(self, key: str) -> str:
+        return shard_path(self.base_dir, f"{key}.out")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        查找已保存的输出文件（可能是压缩保存的.gz文件）
+
+        命中时返回的文件已被引用计数保护，使用完毕后需调用lifecycle.release
+        """
+        base = self._path(key)
+        for path in (base + GZIP_SUFFIX, base):
+            # 先加引用再检查文件是否存在，避免检查之后被清理
+            lifecycle.acquire(path)
+            if os.path.exists(path):
+                lifecycle.touch(path)
+                with self._lock:
+                    self.hits += 1
+                script_logger.info(f"命中转换结果: {key[:12]}")
+                return path
+            lifecycle.release(path)
+        path = self._fetch_shared(key)
+        if path:
+            return path
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _fetch_shared(self, key: str) -> Optional[str]:
+        """从网络共享存储下载其他机器保存的结果"""
+        if not shared_store.has_blobs:
+            return None
+        record = shared_store.get(RESULTS_NAMESPACE, key)
+        if record is None:
+            return None
+        path = self._path(key) + (GZIP_SUFFIX if record["file"].endswith(GZIP_SUFFIX) else "")
+        lifecycle.acquire(path)
+        if not shared_store.fetch_blob(RESULTS_NAMESPACE, key, path):
+            lifecycle.release(path)
+            return None
+        shared_store.record_use(RESULTS_NAMESPACE, key)
+        with self._lock:
+            self.remote_hits += 1
+        script_logger.info(f"从共享存储取得转换结果: {key[:12]}")
+        return path
+
+    def _share(self, key: str, path: str):
+        """上传结果到网络共享存储，先上传文件再发布条目，其他机器看到条目时文件一定可用"""
+        if not shared_store.has_blobs or not shared_store.put_blob(RESULTS_NAMESPACE, key, path):
+            return
+        _, published = shared_store.publish(
+            RESULTS_NAMESPACE, key, {"file": os.path.basename(path), "size": os.path.getsize(path)}
+        )
+        if published:
+            shared_store.evict(RESULTS_NAMESPACE, RESULT_SHARED_MAX_ENTRIES)
+
+    def put(self, key: str, output_file: str) -> str:
+        """
+        把执行得到的输出文件移入存储（按配置压缩），返回存储中的路径
+
+        返回的文件已被引用计数保护；原输出文件被移走，其引用由调用方释放
+        """
+        size = os.path.getsize(output_file)
+        compress = RESULT_COMPRESS and RESULT_COMPRESS_MIN_BYTES <= size <= RESULT_COMPRESS_MAX_BYTES
+        path = self._path(key) + (GZIP_SUFFIX if compress else "")
+        lifecycle.acquire(path)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if compress:
+                compress_file(output_file, temp_path, RESULT_COMPRESS_LEVEL)
+                os.remove(output_file)
+            else:
+                try:
+                    os.replace(output_file, temp_path)
+                except OSError:
+                    # 输出在内存文件系统等其他文件系统上时复制
+                    shutil.copyfile(output_file, temp_path)
+                    os.remove(output_file)
+            os.replace(temp_path, path)
+        except Exception:
+            lifecycle.release(path)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self._share(key, path)
+        with self._lock:
+            self.stores += 1
+            if compress:
+                self.compressed_in += size
+                self.compressed_out += os.path.getsize(path)
+        return path
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "remote_hits": self.remote_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "compressed_in": self.compressed_in,
+                "compressed_out": self.compressed_out
+            }
+
+
+# 全局结果存储
+result_store = ResultStore(RESULTS_DIR)
+lifecycle.manage(RESULTS_DIR, quota_from_env("RESULTS", 10 * 1024 ** 3, 24 * 3600, 100000))
+
+
+def _collect_metrics():
+    """结果存储的命中情况"""
+    stats = result_store.stats()
+    return [
+        snapshot_counter("result_store_lookups_total", "转换结果存储的查找次数",
+                         {("hit",): stats["hits"], ("remote_hit",): stats["remote_hits"], ("miss",): stats["misses"]},
+                         ["result"]),
+        snapshot_counter("result_store_writes_total", "写入转换结果存储的次数", {(): stats["stores"]}),
+        snapshot_counter("result_store_compressed_bytes_total", "压缩保存的结果在压缩前后的字节数",
+                         {("raw",): stats["compressed_in"], ("stored",): stats["compressed_out"]}, ["size"])
+    ]
+
+
+register_collector(_collect_metrics)
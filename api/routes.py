@@ -1,21 +1,358 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks, Request
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool
 import os
-from typing import Optional
+import json
+import uuid
+import asyncio
+import hashlib
+import mimetypes
+import zipfile
+from typing import Optional, List, Tuple
+from urllib.parse import quote
+from email.utils import formatdate, parsedate_to_datetime
 
-from .models import TextFormatRequest, FormatResponse, ErrorResponse, APIConfig
+from .models import (
+    TextFormatRequest,
+    FormatResponse,
+    ErrorResponse,
+    APIConfig,
+    ScriptCacheResponse,
+    TextJobRequest,
+    JobStatusResponse,
+    SourceResponse
+)
 from .utils import (
-    save_uploaded_file, 
+    save_upload_stream,
     save_text_content, 
-    generate_python_script,
+    generate_python_script_async,
     execute_python_script,
     read_file_content,
-    get_file_content
+    read_sample,
+    iter_file_chunks,
+    iter_text_content,
+    ECHO_STREAM_MIN_BYTES,
+    MODE_LINES,
+    UPLOAD_DIR,
+    OUTPUT_DIR,
+    STREAM_CHUNK_SIZE
+)
+from .batch import (
+    create_batch_dir,
+    save_batch_files,
+    extract_archive,
+    pick_representative,
+    build_result_archive,
+    BATCH_MAX_FILES
 )
+from .jobs import job_scheduler, job_store, JobQueueFull, STATUS_SUCCEEDED
+from .incremental import incremental, source_store, PrefixHasher, SourceNotFound
+from .pipeline import run_io, run_exec
+from .script_cache import script_cache
+from .converters import list_converters, fast_path_stats
+from .lifecycle import lifecycle, shard_path
+from .memory_io import memory_io
+from .singleflight import conversions, flight_key
+from .result_store import result_store, result_key, content_hash, RESULT_STORE_ENABLED
+from .progress import Progress, sse_event, STAGE_UPLOADED
+from .compression import is_gzip_path, plain_size, iter_plain_chunks, accepts_encoding, GZIP_SUFFIX
 from .logger import api_logger
 
 router = APIRouter(prefix="/api", tags=["format"])
 
+async def convert_text_shared(content: str, format_instruction: str, api_config: APIConfig,
+                              progress: Optional[Progress] = None):
+    """
+    转换文本内容，相同内容、格式要求和模型的并发请求只生成和执行一次
+    
+    提供progress时上报生成和执行的进度；与进行中的相同请求合并时只有第一个请求收到进度
+    
+    返回:
+        Tuple[Lease, bool]: (结果，value为(输出文件, 脚本内容, 结果键), 是否与其他请求共享)，
+            使用完毕后需调用conversions.release；结果键在未使用结果存储时为None
+    """
+    data = content.encode("utf-8")
+    input_digest = content_hash(data)
+    key = flight_key(input_digest, format_instruction, api_config.model_name)
+    
+    async def convert():
+        api_logger.info("正在生成转换脚本...")
+        script_path, script_content = await generate_python_script_async(
+            content, 
+            format_instruction,
+            api_config,
+            progress=progress
+        )
+        api_logger.debug(f"转换脚本已生成: {script_path}")
+        
+        # 小的内容放在内存文件系统中，整个转换不读写磁盘，因此也不使用（保存在磁盘上的）结果存储
+        content_size = len(data)
+        in_memory = memory_io.reserve(content_size)
+        
+        # 相同输入和脚本的转换已执行过时直接使用保存的结果，不再保存输入和执行脚本
+        use_store = RESULT_STORE_ENABLED and not in_memory
+        stored_key = result_key(input_digest, format_instruction, script_content) if use_store else None
+        if stored_key:
+            stored = await run_io(result_store.get, stored_key)
+            if stored:
+                return (stored, script_content, stored_key), lambda: lifecycle.release(stored)
+        
+        input_file = output_file = None
+        try:
+            input_file = await run_io(save_text_content, data, in_memory)
+            api_logger.debug(f"文本内容已保存到文件: {input_file}")
+            
+            api_logger.info("正在执行转换脚本...")
+            output_file = await run_exec(
+                execute_python_script, script_path, input_file, in_memory=in_memory, progress=progress
+            )
+            api_logger.debug(f"转换结果已保存到: {output_file}")
+            if stored_key:
+                stored = await run_io(result_store.put, stored_key, output_file)
+        except Exception:
+            lifecycle.release(output_file)
+            if in_memory:
+                memory_io.discard(output_file)
+                memory_io.release(content_size)
+            raise
+        finally:
+            lifecycle.release(input_file)
+            if in_memory:
+                memory_io.discard(input_file)
+        
+        if stored_key:
+            # 输出文件已移入结果存储
+            lifecycle.release(output_file)
+            return (stored, script_content, stored_key), lambda: lifecycle.release(stored)
+        
+        def cleanup():
+            # 所有请求都使用完毕后，内存文件立即删除，磁盘文件交由生命周期管理清理
+            lifecycle.release(output_file)
+            if in_memory:
+                memory_io.discard(output_file)
+                memory_io.release(content_size)
+        return (output_file, script_content, None), cleanup
+    
+    return await conversions.do(key, convert)
+
+async def convert_file_shared(input_file: str, input_digest: str, format_instruction: str, api_config: APIConfig,
+                              progress: Optional[Progress] = None):
+    """
+    转换已保存的上传文件，相同内容、格式要求和模型的并发请求只生成和执行一次
+    
+    返回值同convert_text_shared
+    """
+    key = flight_key(input_digest, format_instruction, api_config.model_name)
+    
+    async def convert():
+        with lifecycle.hold(input_file):
+            # 只读取文件的少量片段用于生成脚本
+            sample_data = await run_io(read_sample, input_file)
+            
+            api_logger.info("正在生成转换脚本...")
+            script_path, script_content = await generate_python_script_async(
+                sample_data, 
+                format_instruction,
+                api_config,
+                progress=progress,
+                input_file=input_file
+            )
+            api_logger.debug(f"转换脚本已生成: {script_path}")
+            
+            stored_key = result_key(input_digest, format_instruction, script_content) if RESULT_STORE_ENABLED else None
+            if stored_key:
+                stored = await run_io(result_store.get, stored_key)
+                if stored:
+                    return (stored, script_content, stored_key), lambda: lifecycle.release(stored)
+            
+            api_logger.info("正在执行转换脚本...")
+            output_file = await run_exec(execute_python_script, script_path, input_file, progress=progress)
+            api_logger.debug(f"转换结果已保存到: {output_file}")
+        
+        if stored_key:
+            try:
+                stored = await run_io(result_store.put, stored_key, output_file)
+            finally:
+                lifecycle.release(output_file)
+            return (stored, script_content, stored_key), lambda: lifecycle.release(stored)
+        return (output_file, script_content, None), lambda: lifecycle.release(output_file)
+    
+    return await conversions.do(key, convert)
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # 弱比较：忽略W/前缀
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+def _parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单个字节范围，返回闭区间 (start, end)
+    
+    格式错误或多个范围时返回 (0, size - 1) 表示发送完整内容，范围无法满足时返回None
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return 0, size - 1
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if not start_text:
+            length = int(end_text)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return 0, size - 1
+    if start >= size or start > end:
+        return None
+    return start, min(end, size - 1)
+
+def _plain_stream_response(
+    path: str,
+    filename: str,
+    media_type: Optional[str],
+    headers: dict,
+    range_header: Optional[str],
+    background: BackgroundTask
+) -> Response:
+    """边解压边发送压缩保存的文件，支持单个字节范围"""
+    size = plain_size(path)
+    start, end, status_code = 0, size - 1, 200
+    if range_header:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"}, background=background)
+        if byte_range != (0, size - 1):
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(max(0, end - start + 1))
+    headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+    return StreamingResponse(
+        iter_plain_chunks(path, STREAM_CHUNK_SIZE, start, end),
+        status_code=status_code,
+        media_type=media_type or mimetypes.guess_type(filename)[0] or "text/plain",
+        headers=headers,
+        background=background
+    )
+
+def _iter_format_json(message: str, output_file: str, script_content: str):
+    """按FormatResponse的字段逐块生成JSON，output_content分块解码和转义，不在内存中拼接完整内容"""
+    yield (b'{"success": true, "message": ' + json.dumps(message, ensure_ascii=False).encode("utf-8")
+           + b', "output_content": "')
+    for text in iter_text_content(output_file):
+        yield json.dumps(text, ensure_ascii=False)[1:-1].encode("utf-8")
+    yield b'", "script_content": ' + json.dumps(script_content, ensure_ascii=False).encode("utf-8") + b"}"
+
+def streamed_format_response(message: str, output_file: str, script_content: str, lease) -> StreamingResponse:
+    """较大的转换结果流式返回与FormatResponse相同结构的JSON，响应发送完成后再释放结果"""
+    return StreamingResponse(
+        _iter_format_json(message, output_file, script_content),
+        media_type="application/json",
+        background=BackgroundTask(conversions.release, lease)
+    )
+
+async def _iter_progress_events(progress: Progress, task: asyncio.Future, message: str, cleanup=None):
+    """
+    以Server-Sent Events推送进度事件（progress），转换完成后推送与FormatResponse结构相同的结果（result），
+    失败时推送错误（error）。客户端断开时取消对转换的等待，合并的进行中请求不受影响
+    """
+    lease = None
+    try:
+        async for event in progress.follow(task):
+            yield sse_event("progress", event)
+        lease, _ = task.result()
+        output_file, script_content, _ = lease.value
+        # 结果JSON分块生成，不含换行，可以直接作为一条消息的data
+        yield b"event: result\ndata: "
+        async for chunk in iterate_in_threadpool(_iter_format_json(message, output_file, script_content)):
+            yield chunk
+        yield b"\n\n"
+    except Exception as e:
+        api_logger.error(f"带进度的格式转换失败: {str(e)}", exc_info=True)
+        yield sse_event("error", {"message": str(e)})
+    finally:
+        if not task.done():
+            task.cancel()
+        conversions.release(lease)
+        if cleanup:
+            cleanup()
+
+def progress_response(progress: Progress, conversion, message: str, cleanup=None) -> StreamingResponse:
+    """在后台执行转换，响应以Server-Sent Events推送进度和结果"""
+    task = asyncio.ensure_future(conversion)
+    return StreamingResponse(
+        _iter_progress_events(progress, task, message, cleanup),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def download_response(
+    request: Request,
+    path: str,
+    filename: str,
+    result_key: Optional[str],
+    background: BackgroundTask,
+    media_type: Optional[str] = None
+) -> Response:
+    """
+    返回下载文件的响应，支持条件请求和Range请求
+    
+    来自结果存储的文件以结果键作为ETag（内容由键决定），其他文件按修改时间和大小生成ETag。
+    客户端的If-None-Match或If-Modified-Since表明已有最新内容时返回304，Range请求由FileResponse处理。
+    压缩保存的文件按客户端的Accept-Encoding直接发送或解压后发送
+    """
+    stat_result = os.stat(path)
+    if result_key:
+        etag = f'"{result_key[:32]}"'
+    else:
+        etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache"
+    }
+    
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    not_modified = False
+    if if_none_match is not None:
+        not_modified = _etag_matches(if_none_match, etag)
+    elif if_modified_since:
+        try:
+            not_modified = int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            not_modified = False
+    if not_modified:
+        return Response(status_code=304, headers=headers, background=background)
+    
+    if is_gzip_path(path):
+        # 压缩保存的结果：客户端接受gzip且不是Range请求时直接发送压缩文件，否则边解压边发送
+        headers["Vary"] = "Accept-Encoding"
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if if_range is not None and if_range.strip() != etag:
+            range_header = None
+        if range_header is None and accepts_encoding(request.headers.get("accept-encoding", ""), "gzip"):
+            headers["Content-Encoding"] = "gzip"
+            headers["ETag"] = f"W/{etag}"
+        else:
+            return _plain_stream_response(path, filename, media_type, headers, range_header, background)
+    
+    return FileResponse(
+        path=path,
+        filename=filename,
+        media_type=media_type,
+        headers=headers,
+        stat_result=stat_result,
+        background=background
+    )
+
 @router.post(
     "/format-text", 
     response_model=FormatResponse,
@@ -28,31 +365,29 @@ async def format_text(
     通过直接提供文本内容进行格式转换
     """
     api_logger.info(f"接收文本格式转换请求，格式要求: {request.format_instruction[:100]}...")
+    lease = None
     try:
         if not request.content or request.content.strip() == "":
             api_logger.warning("文本内容为空")
             return ErrorResponse(message="文本内容不能为空")
         
-        # 保存文本内容到文件
-        input_file = save_text_content(request.content)
-        api_logger.debug(f"文本内容已保存到文件: {input_file}")
-        
-        # 生成转换脚本
-        api_logger.info("正在生成转换脚本...")
-        script_path, script_content = generate_python_script(
+        # 生成并执行转换脚本
+        lease, _ = await convert_text_shared(
             request.content, 
             request.format_instruction,
             request.api_config
         )
-        api_logger.debug(f"转换脚本已生成: {script_path}")
+        output_file, script_content, _ = lease.value
         
-        # 执行脚本进行转换
-        api_logger.info("正在执行转换脚本...")
-        output_file = execute_python_script(script_path, input_file)
-        api_logger.debug(f"转换结果已保存到: {output_file}")
+        # 较大的结果流式返回，响应发送完成后再释放
+        output_size = await run_io(plain_size, output_file)
+        if output_size >= ECHO_STREAM_MIN_BYTES:
+            api_logger.info(f"格式转换成功，输出内容大小: {output_size} 字节，流式返回")
+            response, lease = streamed_format_response("格式转换成功", output_file, script_content, lease), None
+            return response
         
         # 读取转换后的内容
-        output_content = read_file_content(output_file)
+        output_content = await run_io(read_file_content, output_file)
         api_logger.info(f"格式转换成功，输出内容大小: {len(output_content)} 字节")
         
         return FormatResponse(
@@ -65,6 +400,8 @@ async def format_text(
     except Exception as e:
         api_logger.error(f"文本格式转换失败: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        conversions.release(lease)
 
 @router.post(
     "/format-file",
@@ -82,6 +419,7 @@ async def format_file(
     通过上传文件进行格式转换
     """
     api_logger.info(f"接收文件格式转换请求，文件名: {file.filename}, 格式要求: {format_instruction[:100]}...")
+    input_file = lease = None
     try:
         # 创建API配置
         api_config = APIConfig(
@@ -90,34 +428,24 @@ async def format_file(
             model_name=model_name
         )
         
-        # 读取上传的文件内容
-        file_content = await file.read()
-        file_size = len(file_content)
-        api_logger.debug(f"接收到文件大小: {file_size} 字节")
+        # 分块保存上传的文件，同时计算内容哈希
+        hasher = hashlib.sha256()
+        input_file, file_size = await run_io(save_upload_stream, file.file, file.filename, hasher)
+        api_logger.debug(f"文件已保存到: {input_file}, 大小: {file_size} 字节")
         
-        # 保存上传的文件
-        input_file = save_uploaded_file(file_content, file.filename)
-        api_logger.debug(f"文件已保存到: {input_file}")
-        
-        # 读取文件内容用于生成脚本
-        sample_data = read_file_content(input_file)
-        
-        # 生成转换脚本
-        api_logger.info("正在生成转换脚本...")
-        script_path, script_content = generate_python_script(
-            sample_data, 
-            format_instruction,
-            api_config
-        )
-        api_logger.debug(f"转换脚本已生成: {script_path}")
+        # 生成并执行转换脚本
+        lease, _ = await convert_file_shared(input_file, hasher.hexdigest(), format_instruction, api_config)
+        output_file, script_content, _ = lease.value
         
-        # 执行脚本进行转换
-        api_logger.info("正在执行转换脚本...")
-        output_file = execute_python_script(script_path, input_file)
-        api_logger.debug(f"转换结果已保存到: {output_file}")
+        # 较大的结果流式返回，响应发送完成后再释放；输入文件不再需要，照常释放
+        output_size = await run_io(plain_size, output_file)
+        if output_size >= ECHO_STREAM_MIN_BYTES:
+            api_logger.info(f"文件格式转换成功，输出内容大小: {output_size} 字节，流式返回")
+            response, lease = streamed_format_response("文件格式转换成功", output_file, script_content, lease), None
+            return response
         
         # 读取转换后的内容
-        output_content = read_file_content(output_file)
+        output_content = await run_io(read_file_content, output_file)
         api_logger.info(f"文件格式转换成功，输出内容大小: {len(output_content)} 字节")
         
         return FormatResponse(
@@ -130,12 +458,55 @@ async def format_file(
     except Exception as e:
         api_logger.error(f"文件格式转换失败: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        lifecycle.release(input_file)
+        conversions.release(lease)
+
+@router.post("/format-text/events")
+async def format_text_events(request: TextFormatRequest):
+    """
+    与/api/format-text相同的文本格式转换，以Server-Sent Events推送生成、验证、执行各阶段的进度，
+    最后推送转换结果
+    """
+    api_logger.info(f"接收带进度的文本格式转换请求，格式要求: {request.format_instruction[:100]}...")
+    if not request.content or request.content.strip() == "":
+        raise HTTPException(status_code=400, detail="文本内容不能为空")
+    progress = Progress()
+    conversion = convert_text_shared(request.content, request.format_instruction, request.api_config, progress)
+    return progress_response(progress, conversion, "格式转换成功")
+
+@router.post("/format-file/events")
+async def format_file_events(
+    file: UploadFile = File(...),
+    format_instruction: str = Form(...),
+    api_key: str = Form(...),
+    api_url: str = Form(...),
+    model_name: str = Form(...)
+):
+    """
+    与/api/format-file相同的文件格式转换，以Server-Sent Events推送各阶段的进度和转换结果
+    """
+    api_logger.info(f"接收带进度的文件格式转换请求，文件名: {file.filename}, 格式要求: {format_instruction[:100]}...")
+    api_config = APIConfig(api_key=api_key, api_url=api_url, model_name=model_name)
+    
+    # 上传文件在返回响应之前保存，转换完成或客户端断开后释放
+    hasher = hashlib.sha256()
+    try:
+        input_file, file_size = await run_io(save_upload_stream, file.file, file.filename, hasher)
+    except Exception as e:
+        api_logger.error(f"保存上传文件失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    progress = Progress()
+    progress.emit(STAGE_UPLOADED, bytes=file_size)
+    conversion = convert_file_shared(input_file, hasher.hexdigest(), format_instruction, api_config, progress)
+    return progress_response(progress, conversion, "文件格式转换成功", lambda: lifecycle.release(input_file))
 
 @router.post(
     "/download-output",
     responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}}
 )
 async def download_output(
+    request: Request,
     content: str = Form(...),
     format_instruction: str = Form(...),
     api_key: str = Form(...),
@@ -147,6 +518,7 @@ async def download_output(
     转换文本并下载转换后的文件
     """
     api_logger.info("接收文本转换并下载请求")
+    lease = None
     try:
         if not content or content.strip() == "":
             api_logger.warning("文本内容为空")
@@ -159,37 +531,22 @@ async def download_output(
             model_name=model_name
         )
         
-        # 保存文本内容到文件
-        input_file = save_text_content(content)
-        api_logger.debug(f"文本内容已保存到文件: {input_file}")
-        
-        # 生成转换脚本
-        api_logger.info("正在生成转换脚本...")
-        script_path, _ = generate_python_script(
-            content, 
-            format_instruction,
-            api_config
-        )
-        api_logger.debug(f"转换脚本已生成: {script_path}")
-        
-        # 执行脚本进行转换
-        api_logger.info("正在执行转换脚本...")
-        output_file = execute_python_script(script_path, input_file)
-        api_logger.debug(f"转换结果已保存到: {output_file}")
+        # 生成并执行转换脚本
+        lease, _ = await convert_text_shared(content, format_instruction, api_config)
+        output_file, _, stored_key = lease.value
         
         # 创建下载的文件名
         download_filename = f"formatted_output.txt"
         api_logger.info(f"准备下载文件，文件名: {download_filename}")
         
-        # 返回文件
-        return FileResponse(
-            path=output_file, 
-            filename=download_filename,
-            media_type="text/plain",
-            background=background_tasks
-        )
+        # 文件发送完成后再释放
+        background_tasks.add_task(conversions.release, lease)
+        
+        # 返回文件，支持ETag/Last-Modified条件请求和Range请求
+        return download_response(request, output_file, download_filename, stored_key, background_tasks, "text/plain")
     
     except Exception as e:
+        conversions.release(lease)
         api_logger.error(f"文本转换并下载失败: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -198,6 +555,7 @@ async def download_output(
     responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}}
 )
 async def download_output_file(
+    request: Request,
     file: UploadFile = File(...),
     format_instruction: str = Form(...),
     api_key: str = Form(...),
@@ -209,6 +567,7 @@ async def download_output_file(
     转换上传的文件并下载转换后的文件
     """
     api_logger.info(f"接收文件转换并下载请求，文件名: {file.filename}")
+    input_file = lease = None
     try:
         # 创建API配置
         api_config = APIConfig(
@@ -217,44 +576,525 @@ async def download_output_file(
             model_name=model_name
         )
         
-        # 读取上传的文件内容
-        file_content = await file.read()
-        file_size = len(file_content)
-        api_logger.debug(f"接收到文件大小: {file_size} 字节")
+        # 分块保存上传的文件，同时计算内容哈希
+        hasher = hashlib.sha256()
+        input_file, file_size = await run_io(save_upload_stream, file.file, file.filename, hasher)
+        api_logger.debug(f"文件已保存到: {input_file}, 大小: {file_size} 字节")
         
-        # 保存上传的文件
-        input_file = save_uploaded_file(file_content, file.filename)
-        api_logger.debug(f"文件已保存到: {input_file}")
+        # 生成并执行转换脚本
+        lease, _ = await convert_file_shared(input_file, hasher.hexdigest(), format_instruction, api_config)
+        output_file, _, stored_key = lease.value
         
-        # 读取文件内容用于生成脚本
-        sample_data = read_file_content(input_file)
+        # 创建下载的文件名
+        # 压缩上传的文件已解压，下载文件名去掉.gz后缀
+        original_name = file.filename[:-len(GZIP_SUFFIX)] if file.filename.endswith(GZIP_SUFFIX) else file.filename
+        name, ext = os.path.splitext(original_name)
+        download_filename = f"{name}_formatted{ext}"
+        api_logger.info(f"准备下载文件，文件名: {download_filename}")
         
-        # 生成转换脚本
-        api_logger.info("正在生成转换脚本...")
-        script_path, _ = generate_python_script(
-            sample_data, 
+        # 文件发送完成后再释放
+        background_tasks.add_task(lifecycle.release, input_file)
+        background_tasks.add_task(conversions.release, lease)
+        
+        # 返回文件，支持ETag/Last-Modified条件请求和Range请求
+        return download_response(request, output_file, download_filename, stored_key, background_tasks)
+    
+    except Exception as e:
+        lifecycle.release(input_file)
+        conversions.release(lease)
+        api_logger.error(f"文件转换并下载失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e)) 
+
+@router.post(
+    "/format-file-stream",
+    responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}}
+)
+async def format_file_stream(
+    file: UploadFile = File(...),
+    format_instruction: str = Form(...),
+    api_key: str = Form(...),
+    api_url: str = Form(...),
+    model_name: str = Form(...)
+):
+    """
+    流式转换大文件：上传分块落盘，脚本逐行转换，结果分块流式返回
+    """
+    api_logger.info(f"接收流式文件转换请求，文件名: {file.filename}, 格式要求: {format_instruction[:100]}...")
+    input_file = output_file = None
+    try:
+        # 创建API配置
+        api_config = APIConfig(
+            api_key=api_key,
+            api_url=api_url,
+            model_name=model_name
+        )
+        
+        # 分块保存上传的文件
+        input_file, file_size = await run_io(save_upload_stream, file.file, file.filename)
+        api_logger.debug(f"文件已保存到: {input_file}, 大小: {file_size} 字节")
+        
+        # 只读取文件头部用于生成脚本
+        sample_data = await run_io(read_sample, input_file)
+        
+        # 生成逐行转换脚本
+        api_logger.info("正在生成逐行转换脚本...")
+        script_path, _ = await generate_python_script_async(
+            sample_data,
             format_instruction,
-            api_config
+            api_config,
+            mode=MODE_LINES,
+            input_file=input_file
         )
         api_logger.debug(f"转换脚本已生成: {script_path}")
         
-        # 执行脚本进行转换
+        # 执行脚本进行逐行转换
         api_logger.info("正在执行转换脚本...")
-        output_file = execute_python_script(script_path, input_file)
+        output_file = await run_exec(execute_python_script, script_path, input_file, MODE_LINES)
         api_logger.debug(f"转换结果已保存到: {output_file}")
         
         # 创建下载的文件名
-        name, ext = os.path.splitext(file.filename)
+        name, ext = os.path.splitext(os.path.basename(file.filename or "output.txt"))
         download_filename = f"{name}_formatted{ext}"
-        api_logger.info(f"准备下载文件，文件名: {download_filename}")
+        api_logger.info(f"流式返回转换结果，文件名: {download_filename}")
+        
+        return StreamingResponse(
+            iter_file_chunks(output_file),
+            media_type="application/octet-stream",
+            headers={
+                "Content-Disposition": f"attachment; filename*=utf-8''{quote(download_filename)}",
+                "Content-Length": str(os.path.getsize(output_file))
+            },
+            background=BackgroundTask(lifecycle.release, input_file, output_file)
+        )
+    
+    except Exception as e:
+        lifecycle.release(input_file, output_file)
+        api_logger.error(f"流式文件转换失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post(
+    "/format-batch",
+    responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}}
+)
+async def format_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    format_instruction: str = Form(...),
+    api_key: str = Form(...),
+    api_url: str = Form(...),
+    model_name: str = Form(...)
+):
+    """
+    批量转换多个同格式文件：只生成一次脚本，并行执行后返回包含结果和清单的zip文件
+    
+    文件可以通过多个files字段上传，也可以打包为zip通过archive字段上传
+    """
+    api_logger.info(f"接收批量转换请求，文件数: {len(files or [])}, 压缩包: {archive.filename if archive else '无'}")
+    batch_dir = archive_path = None
+    output_files = []
+    try:
+        # 创建API配置
+        api_config = APIConfig(
+            api_key=api_key,
+            api_url=api_url,
+            model_name=model_name
+        )
         
-        # 返回文件
+        # 保存上传的文件和压缩包中的文件
+        batch_dir = await run_io(create_batch_dir, UPLOAD_DIR)
+        lifecycle.acquire(batch_dir)
+        batch_files = []
+        if files:
+            batch_files += await run_io(save_batch_files, [(f.filename, f.file) for f in files], batch_dir)
+        if archive:
+            archive_path, _ = await run_io(save_upload_stream, archive.file, archive.filename)
+            try:
+                batch_files += await run_io(extract_archive, archive_path, batch_dir)
+            except (zipfile.BadZipFile, ValueError) as e:
+                raise HTTPException(status_code=400, detail=f"压缩包无效: {str(e)}")
+        if not batch_files:
+            raise HTTPException(status_code=400, detail="未提供需要转换的文件")
+        if len(batch_files) > BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"单个批次最多 {BATCH_MAX_FILES} 个文件")
+        api_logger.debug(f"批次文件已保存到: {batch_dir}, 文件数: {len(batch_files)}")
+        
+        # 用代表性文件的头部生成一次转换脚本
+        sample_file = await run_io(pick_representative, batch_files)
+        sample_data = await run_io(read_sample, sample_file)
+        api_logger.info("正在生成转换脚本...")
+        script_path, script_content = await generate_python_script_async(
+            sample_data,
+            format_instruction,
+            api_config,
+            input_file=sample_file
+        )
+        api_logger.debug(f"转换脚本已生成: {script_path}")
+        
+        # 并行执行各文件的转换，单个文件失败不影响其他文件
+        async def convert_one(name: str, path: str):
+            try:
+                output_file = await run_exec(execute_python_script, script_path, path)
+                return {"file": name, "status": "success", "output_file": output_file}
+            except Exception as e:
+                api_logger.warning(f"批量转换中文件 {name} 转换失败: {str(e)}")
+                return {"file": name, "status": "failed", "error": str(e)}
+        
+        api_logger.info(f"正在并行执行 {len(batch_files)} 个文件的转换...")
+        results = await asyncio.gather(*[convert_one(name, path) for name, path in batch_files])
+        output_files = [r["output_file"] for r in results if r["status"] == "success"]
+        failed = len(results) - len(output_files)
+        
+        # 打包转换结果和清单
+        result_archive = shard_path(OUTPUT_DIR, f"batch_{uuid.uuid4().hex}.zip")
+        await run_io(build_result_archive, results, result_archive, script_content)
+        api_logger.info(f"批量转换完成，成功: {len(results) - failed}, 失败: {failed}")
+        
+        lifecycle.acquire(result_archive)
         return FileResponse(
-            path=output_file, 
-            filename=download_filename,
-            background=background_tasks
+            path=result_archive,
+            filename="formatted_batch.zip",
+            media_type="application/zip",
+            headers={"X-Batch-Total": str(len(results)), "X-Batch-Failed": str(failed)},
+            background=BackgroundTask(lifecycle.release, result_archive)
         )
     
+    except HTTPException:
+        raise
     except Exception as e:
-        api_logger.error(f"文件转换并下载失败: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        api_logger.error(f"批量转换失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # 批次文件和各文件的输出已打包，交由生命周期管理清理
+        lifecycle.release(batch_dir, archive_path, *output_files)
+
+def _job_status(job: dict) -> JobStatusResponse:
+    """将任务记录转换为状态响应"""
+    return JobStatusResponse(
+        job_id=job["id"],
+        status=job["status"],
+        stage=job["stage"],
+        progress=job["progress"],
+        priority=job["priority"],
+        filename=job.get("filename"),
+        error=job.get("error"),
+        created_at=job["created_at"],
+        started_at=job.get("started_at"),
+        finished_at=job.get("finished_at"),
+        result_url=f"/api/jobs/{job['id']}/result" if job["status"] == STATUS_SUCCEEDED else None
+    )
+
+@router.post(
+    "/jobs/text",
+    response_model=JobStatusResponse,
+    status_code=202,
+    responses={400: {"model": ErrorResponse}, 429: {"model": ErrorResponse}}
+)
+async def submit_text_job(request: TextJobRequest):
+    """
+    提交文本格式转换任务，立即返回任务ID，之后通过任务状态接口轮询
+    """
+    api_logger.info(f"接收文本转换任务，格式要求: {request.format_instruction[:100]}...")
+    if not request.content or request.content.strip() == "":
+        raise HTTPException(status_code=400, detail="文本内容不能为空")
+    input_file = await run_io(save_text_content, request.content)
+    try:
+        job = await job_scheduler.submit(
+            input_file,
+            request.format_instruction,
+            request.api_config,
+            request.priority
+        )
+    except JobQueueFull as e:
+        lifecycle.release(input_file)
+        raise HTTPException(status_code=429, detail=str(e))
+    return _job_status(job)
+
+@router.post(
+    "/jobs/file",
+    response_model=JobStatusResponse,
+    status_code=202,
+    responses={429: {"model": ErrorResponse}}
+)
+async def submit_file_job(
+    file: UploadFile = File(...),
+    format_instruction: str = Form(...),
+    api_key: str = Form(...),
+    api_url: str = Form(...),
+    model_name: str = Form(...),
+    priority: int = Form(0)
+):
+    """
+    提交文件格式转换任务，立即返回任务ID，之后通过任务状态接口轮询
+    """
+    api_logger.info(f"接收文件转换任务，文件名: {file.filename}, 格式要求: {format_instruction[:100]}...")
+    api_config = APIConfig(
+        api_key=api_key,
+        api_url=api_url,
+        model_name=model_name
+    )
+    input_file, file_size = await run_io(save_upload_stream, file.file, file.filename)
+    api_logger.debug(f"文件已保存到: {input_file}, 大小: {file_size} 字节")
+    try:
+        job = await job_scheduler.submit(input_file, format_instruction, api_config, priority, file.filename)
+    except JobQueueFull as e:
+        lifecycle.release(input_file)
+        raise HTTPException(status_code=429, detail=str(e))
+    return _job_status(job)
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=JobStatusResponse,
+    responses={404: {"model": ErrorResponse}}
+)
+async def get_job(job_id: str):
+    """
+    查询任务状态和进度
+    """
+    job = await run_io(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return _job_status(job)
+
+@router.get(
+    "/jobs/{job_id}/result",
+    responses={404: {"model": ErrorResponse}, 409: {"model": ErrorResponse}}
+)
+async def get_job_result(job_id: str, request: Request):
+    """
+    下载已完成任务的转换结果
+    """
+    job = await run_io(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if job["status"] != STATUS_SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"任务尚未成功完成，当前状态: {job['status']}")
+    if not job["output_file"] or not os.path.exists(job["output_file"]):
+        raise HTTPException(status_code=404, detail="任务结果已过期")
+    if job["filename"]:
+        name, ext = os.path.splitext(os.path.basename(job["filename"]))
+        download_filename = f"{name}_formatted{ext}"
+    else:
+        download_filename = "formatted_output.txt"
+    lifecycle.acquire(job["output_file"])
+    return download_response(
+        request,
+        job["output_file"],
+        download_filename,
+        None,
+        BackgroundTask(lifecycle.release, job["output_file"])
+    )
+
+@router.delete(
+    "/jobs/{job_id}",
+    responses={404: {"model": ErrorResponse}, 409: {"model": ErrorResponse}}
+)
+async def cancel_job(job_id: str):
+    """
+    取消排队中的任务
+    """
+    if not await run_io(job_store.cancel, job_id):
+        job = await run_io(job_store.get, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        raise HTTPException(status_code=409, detail=f"只能取消排队中的任务，当前状态: {job['status']}")
+    api_logger.info(f"任务已取消: {job_id}")
+    return {"success": True, "message": "任务已取消"}
+
+def _source_status(source: dict, include_script: bool = False) -> SourceResponse:
+    return SourceResponse(
+        source_id=source["id"],
+        format_instruction=source["format_instruction"],
+        append_safe=bool(source["append_safe"]),
+        header=bool(source["header"]),
+        offset=source["offset"],
+        output_size=source["output_size"],
+        run=source.get("run"),
+        converted_bytes=source.get("converted_bytes", 0),
+        incremental_runs=source["incremental_runs"],
+        full_runs=source["full_runs"],
+        created_at=source["created_at"],
+        updated_at=source["updated_at"],
+        output_url=f"/api/sources/{source['id']}/output",
+        script_content=source["script_content"] if include_script else None
+    )
+
+@router.post(
+    "/sources",
+    response_model=SourceResponse,
+    status_code=201,
+    responses={500: {"model": ErrorResponse}}
+)
+async def register_source(
+    file: UploadFile = File(...),
+    format_instruction: str = Form(...),
+    api_key: str = Form(...),
+    api_url: str = Form(...),
+    model_name: str = Form(...)
+):
+    """
+    注册追加写入的数据源：按当前内容生成转换脚本并转换，之后通过更新接口提交增长后的文件
+    """
+    api_logger.info(f"接收数据源注册请求，文件名: {file.filename}, 格式要求: {format_instruction[:100]}...")
+    input_file = None
+    try:
+        api_config = APIConfig(
+            api_key=api_key,
+            api_url=api_url,
+            model_name=model_name
+        )
+        input_file, file_size = await run_io(save_upload_stream, file.file, file.filename)
+        api_logger.debug(f"文件已保存到: {input_file}, 大小: {file_size} 字节")
+        
+        sample_data = await run_io(read_sample, input_file)
+        _, script_content = await generate_python_script_async(
+            sample_data, format_instruction, api_config, input_file=input_file
+        )
+        source = await run_exec(incremental.register, format_instruction, model_name, script_content, input_file)
+        return _source_status(source, include_script=True)
+    
+    except Exception as e:
+        api_logger.error(f"数据源注册失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        lifecycle.release(input_file)
+
+@router.post(
+    "/sources/{source_id}/update",
+    response_model=SourceResponse,
+    responses={404: {"model": ErrorResponse}, 500: {"model": ErrorResponse}}
+)
+async def update_source(source_id: str, file: UploadFile = File(...)):
+    """
+    提交数据源增长后的完整文件：已转换的前缀未变化时只转换新追加的记录并追加到累积输出，
+    前缀变化时整体重新转换
+    """
+    source = await run_io(source_store.get, source_id)
+    if source is None:
+        raise HTTPException(status_code=404, detail="数据源不存在")
+    input_file = None
+    try:
+        # 上传落盘的同时计算已转换前缀的哈希
+        hasher = PrefixHasher(source["offset"])
+        input_file, file_size = await run_io(save_upload_stream, file.file, file.filename, hasher)
+        api_logger.debug(f"文件已保存到: {input_file}, 大小: {file_size} 字节")
+        source = await run_exec(incremental.update, source_id, input_file, hasher)
+        api_logger.info(
+            f"数据源已更新: {source_id}, 方式: {source['run']}, 转换字节: {source['converted_bytes']}"
+        )
+        return _source_status(source)
+    
+    except SourceNotFound:
+        raise HTTPException(status_code=404, detail="数据源不存在")
+    except Exception as e:
+        api_logger.error(f"数据源更新失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        lifecycle.release(input_file)
+
+@router.get(
+    "/sources/{source_id}",
+    response_model=SourceResponse,
+    responses={404: {"model": ErrorResponse}}
+)
+async def get_source(source_id: str):
+    """
+    查询数据源的转换进度
+    """
+    source = await run_io(source_store.get, source_id)
+    if source is None:
+        raise HTTPException(status_code=404, detail="数据源不存在")
+    return _source_status(source)
+
+@router.get(
+    "/sources/{source_id}/output",
+    responses={404: {"model": ErrorResponse}}
+)
+async def get_source_output(source_id: str, request: Request):
+    """
+    下载数据源的累积输出，可用Range请求只下载上次之后追加的部分
+    """
+    source = await run_io(source_store.get, source_id)
+    if source is None or not source["output_file"]:
+        raise HTTPException(status_code=404, detail="数据源不存在")
+    try:
+        return download_response(request, source["output_file"], f"{source_id}_formatted.txt", None, None)
+    except FileNotFoundError:
+        # 整体重新转换时旧的输出文件已被替换
+        raise HTTPException(status_code=404, detail="输出文件不存在，请重试")
+
+@router.delete(
+    "/sources/{source_id}",
+    responses={404: {"model": ErrorResponse}}
+)
+async def delete_source(source_id: str):
+    """
+    删除数据源及其累积输出
+    """
+    try:
+        await run_io(incremental.delete, source_id)
+    except SourceNotFound:
+        raise HTTPException(status_code=404, detail="数据源不存在")
+    return {"success": True, "message": "数据源已删除"}
+
+@router.get("/script-cache", response_model=ScriptCacheResponse)
+async def get_script_cache():
+    """
+    查看脚本缓存的统计信息和条目
+    """
+    stats, entries = await run_io(lambda: (script_cache.stats(), script_cache.entries()))
+    return ScriptCacheResponse(stats=stats, entries=entries)
+
+@router.post(
+    "/script-cache/{key}/pin",
+    responses={404: {"model": ErrorResponse}}
+)
+async def pin_script_cache_entry(key: str):
+    """
+    固定脚本缓存条目，使其不会被淘汰
+    """
+    if not await run_io(script_cache.pin, key, True):
+        raise HTTPException(status_code=404, detail="缓存条目不存在")
+    api_logger.info(f"固定脚本缓存条目: {key}")
+    return {"success": True, "message": "缓存条目已固定"}
+
+@router.delete(
+    "/script-cache/{key}/pin",
+    responses={404: {"model": ErrorResponse}}
+)
+async def unpin_script_cache_entry(key: str):
+    """
+    取消固定脚本缓存条目
+    """
+    if not await run_io(script_cache.pin, key, False):
+        raise HTTPException(status_code=404, detail="缓存条目不存在")
+    api_logger.info(f"取消固定脚本缓存条目: {key}")
+    return {"success": True, "message": "缓存条目已取消固定"}
+
+@router.delete(
+    "/script-cache/{key}",
+    responses={404: {"model": ErrorResponse}}
+)
+async def invalidate_script_cache_entry(key: str):
+    """
+    使脚本缓存条目失效并删除对应脚本
+    """
+    if not await run_io(script_cache.invalidate, key):
+        raise HTTPException(status_code=404, detail="缓存条目不存在")
+    api_logger.info(f"脚本缓存条目已失效: {key}")
+    return {"success": True, "message": "缓存条目已失效"}
+
+@router.delete("/script-cache")
+async def clear_script_cache(include_pinned: bool = False):
+    """
+    清空脚本缓存，默认保留固定的条目
+    """
+    removed = await run_io(script_cache.clear, include_pinned)
+    api_logger.info(f"清空脚本缓存，移除条目数: {removed}")
+    return {"success": True, "message": f"已移除 {removed} 个缓存条目"}
+
+@router.get("/converters")
+async def get_converters():
+    """
+    查看内置转换器列表和快速路径命中统计
+    """
+    return {"converters": list_converters(), "stats": fast_path_stats.snapshot()}
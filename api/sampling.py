@@ -0,0 +1,200 @@
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from .mapped_io import mapped, detect_encoding, decode_window, ENCODING_DETECT_BYTES
+
+# 示例数据采样配置
+SAMPLE_TOKEN_BUDGET = int(os.getenv("SAMPLE_TOKEN_BUDGET", 1500))  # 提示词中示例数据的token预算
+SAMPLE_WINDOWS = int(os.getenv("SAMPLE_WINDOWS", 8))  # 头尾之外在文件中均匀读取的窗口数
+SAMPLE_WINDOW_BYTES = int(os.getenv("SAMPLE_WINDOW_BYTES", 16 * 1024))  # 每个窗口读取的字节数
+SAMPLE_MAX_LINE_CHARS = int(os.getenv("SAMPLE_MAX_LINE_CHARS", 400))  # 单行超过该长度时截断
+SAMPLE_MAX_SHAPES = 256  # 聚类时最多保留的行结构数
+
+# 各部分占token预算的比例，剩余部分用于补充结构不同的行
+HEAD_SHARE = 0.4
+MIDDLE_SHARE = 0.15
+TAIL_SHARE = 0.15
+
+# 示例中被省略内容的标记
+SAMPLE_GAP = "……（省略部分内容）……"
+
+# 窗口：(在输入中的起始位置, 行列表)
+Window = Tuple[int, List[str]]
+
+_DIGITS = re.compile(r"\d+")
+_LETTERS = re.compile(r"[^\W\d_]+")
+_SPACES = re.compile(r"\s+")
+
+
+def fast_shape(line: str) -> str:
+    """
+    行结构的快速近似：连续数字->9，连续字母/汉字->a，连续空白->空格
+
+    与script_cache.line_shape思路相同，但只用正则替换，适合对数千行做聚类
+    """
+    return _SPACES.sub(" ", _LETTERS.sub("a", _DIGITS.sub("9", line[:200])))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计token数：ASCII字符约4个一个token，其余字符（主要是汉字）约1个一个token
+
+    只用到字符数和UTF-8字节数，不逐字符遍历
+    """
+    return tokens_for(len(text), len(text.encode("utf-8")))
+
+
+def tokens_for(chars: int, utf8_bytes: int) -> int:
+    """按字符数和UTF-8字节数估计token数，逐段接收的内容可以累加这两个数后再估计"""
+    # 非ASCII字符大多占3个字节，据此估计其数量
+    non_ascii = min(chars, (utf8_bytes - chars) // 2)
+    return (chars - non_ascii) // 4 + non_ascii + 1
+
+
+def _clip(line: str) -> str:
+    if len(line) > SAMPLE_MAX_LINE_CHARS:
+        return line[:SAMPLE_MAX_LINE_CHARS] + "…"
+    return line
+
+
+def _window_lines(data: str, at_start: bool, at_end: bool) -> List[str]:
+    """把窗口内容切分为完整的行：不在开头时丢掉第一行的残段，不在结尾时丢掉最后一行的残段"""
+    lines = data.split("\n")
+    if not at_start:
+        lines = lines[1:]
+    if not at_end:
+        lines = lines[:-1]
+    elif lines and lines[-1] == "":
+        lines = lines[:-1]
+    return [_clip(line.rstrip("\r")) for line in lines]
+
+
+def _window_offsets(size: int) -> List[int]:
+    """头部、均匀分布的中间窗口和尾部窗口的起始位置"""
+    offsets = [0]
+    step = size / (SAMPLE_WINDOWS + 1)
+    offsets += [int(step * (i + 1)) for i in range(SAMPLE_WINDOWS)]
+    offsets.append(max(0, size - SAMPLE_WINDOW_BYTES))
+    return sorted(set(offsets))
+
+
+def read_file_windows(file_path: str) -> Tuple[List[Window], bool]:
+    """
+    从内存映射的文件中读取若干窗口，只有窗口所在的页被读入，内存占用与文件大小无关；
+    按文件开头检测到的编码解码
+
+    返回:
+        Tuple[List[Window], bool]: (窗口列表, 是否已读取完整文件)
+    """
+    windows: List[Window] = []
+    with mapped(file_path) as buf:
+        size = len(buf)
+        encoding, bom = detect_encoding(buf[:ENCODING_DETECT_BYTES])
+        if size <= SAMPLE_WINDOW_BYTES * (SAMPLE_WINDOWS + 2):
+            data = decode_window(buf, bom, size, encoding)
+            return [(0, _window_lines(data, True, True))], True
+        for offset in _window_offsets(size):
+            end = min(size, offset + SAMPLE_WINDOW_BYTES)
+            data = decode_window(buf, max(offset, bom), end, encoding)
+            windows.append((offset, _window_lines(data, offset == 0, end >= size)))
+    return windows, False
+
+
+def read_text_windows(text: str) -> Tuple[List[Window], bool]:
+    """从已在内存中的文本中取若干窗口，窗口大小按字符计"""
+    size = len(text)
+    if size <= SAMPLE_WINDOW_BYTES * (SAMPLE_WINDOWS + 2):
+        return [(0, _window_lines(text, True, True))], True
+    windows = []
+    for offset in _window_offsets(size):
+        end = offset + SAMPLE_WINDOW_BYTES
+        windows.append((offset, _window_lines(text[offset:end], offset == 0, end >= size)))
+    return windows, False
+
+
+def _take(lines: List[Tuple[int, int]], windows: List[Window], budget: int, chosen: Dict, reverse: bool = False) -> int:
+    """按顺序挑选行直到用完预算，返回实际使用的token数"""
+    used = 0
+    for key in (reversed(lines) if reverse else lines):
+        if key in chosen:
+            continue
+        cost = estimate_tokens(windows[key[0]][1][key[1]])
+        if used + cost > budget and used > 0:
+            break
+        chosen[key] = cost
+        used += cost
+    return used
+
+
+def select_sample(windows: List[Window], budget: int) -> str:
+    """
+    在token预算内从各窗口中挑选示例行
+
+    依次挑选：开头的若干行（通常包含表头）、文件中部的行、结尾的行，然后按行结构聚类，
+    为尚未覆盖的每种结构补充一个代表行（常见结构优先）。结果按原始顺序排列，
+    不相邻的行之间插入省略标记。
+    """
+    chosen: Dict[Tuple[int, int], int] = {}
+    head = [(0, i) for i in range(len(windows[0][1]))]
+    used = _take(head, windows, int(budget * HEAD_SHARE), chosen)
+
+    if len(windows) > 1:
+        middle_index = len(windows) // 2
+        middle = [(middle_index, i) for i in range(len(windows[middle_index][1]))]
+        used += _take(middle, windows, int(budget * MIDDLE_SHARE), chosen)
+        last = len(windows) - 1
+        tail = [(last, i) for i in range(len(windows[last][1]))]
+        used += _take(tail, windows, int(budget * TAIL_SHARE), chosen, reverse=True)
+
+    # 按行结构聚类：每种结构记录出现次数和第一次出现的位置
+    clusters: "OrderedDict[str, List]" = OrderedDict()
+    for w, (_, lines) in enumerate(windows):
+        for i, line in enumerate(lines):
+            shape = fast_shape(line)
+            if shape in clusters:
+                clusters[shape][0] += 1
+            elif len(clusters) < SAMPLE_MAX_SHAPES:
+                clusters[shape] = [1, (w, i)]
+    covered = {fast_shape(windows[w][1][i]) for w, i in chosen}
+    remaining = budget - used
+    for shape, (count, key) in sorted(clusters.items(), key=lambda item: -item[1][0]):
+        if shape in covered or not shape.strip():
+            continue
+        cost = estimate_tokens(windows[key[0]][1][key[1]])
+        if cost > remaining:
+            continue
+        chosen[key] = cost
+        remaining -= cost
+
+    parts = []
+    previous = None
+    for key in sorted(chosen):
+        if previous is not None and key != (previous[0], previous[1] + 1):
+            parts.append(SAMPLE_GAP)
+        parts.append(windows[key[0]][1][key[1]])
+        previous = key
+    # 没有从最后一个窗口的最后一行结束时，说明后面还有内容
+    last_window = len(windows) - 1
+    if previous is not None and previous != (last_window, len(windows[last_window][1]) - 1):
+        parts.append(SAMPLE_GAP)
+    return "\n".join(parts)
+
+
+def sample_file(file_path: str, budget: int = SAMPLE_TOKEN_BUDGET) -> str:
+    """从文件中采样有代表性的示例数据，小文件在预算内时原样返回"""
+    windows, complete = read_file_windows(file_path)
+    if complete:
+        text = "\n".join(windows[0][1])
+        if estimate_tokens(text) <= budget:
+            return text
+    return select_sample(windows, budget)
+
+
+def sample_text(text: str, budget: int = SAMPLE_TOKEN_BUDGET) -> str:
+    """从文本中采样有代表性的示例数据，在预算内时原样返回"""
+    # 估算中每个token最多对应4个字符，长度超过预算4倍的文本无需估算即可判定超出预算
+    if len(text) <= budget * 4 and estimate_tokens(text) <= budget:
+        return text
+    windows, _ = read_text_windows(text)
+    return select_sample(windows, budget)
@@ -0,0 +1,245 @@
+import os
+import sys
+import queue
+import socket
+import threading
+import subprocess
+from multiprocessing.connection import Connection
+from typing import Dict, Any, Optional
+from .logger import script_logger
+from .sandbox_worker import MODE_FILE
+from .metrics import register_collector, snapshot_gauge, snapshot_counter
+
+# 沙箱执行配置
+SANDBOX_ENABLED = os.getenv("SANDBOX_ENABLED", "true").lower() == "true"
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", os.cpu_count() or 4))  # 预启动的工作进程数
+SANDBOX_MAX_JOBS = int(os.getenv("SANDBOX_MAX_JOBS", 100))  # 每个工作进程执行多少个任务后回收
+SANDBOX_CPU_TIME = int(os.getenv("SANDBOX_CPU_TIME", 60))  # 单个任务CPU时间上限（秒）
+SANDBOX_WALL_TIME = float(os.getenv("SANDBOX_WALL_TIME", 120))  # 单个任务墙钟时间上限（秒）
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", 1024))  # 单个任务地址空间上限（MB）
+
+# 工作进程以 python -m api.sandbox_worker 方式启动，需要在项目根目录下运行
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SandboxError(Exception):
+    """沙箱执行失败"""
+
+    def __init__(self, message: str, traceback_text: str = "", output: str = ""):
+        super().__init__(message)
+        self.traceback_text = traceback_text
+        self.output = output
+
+
+class SandboxTimeout(SandboxError):
+    """沙箱执行超时"""
+
+
+class SandboxOutputLimit(SandboxError):
+    """脚本写入的文件超出max_output_bytes"""
+
+
+class _Worker:
+    """
+    一个预启动的沙箱工作进程
+
+    工作进程是独立的解释器，只加载标准库和sandbox_worker模块，不会重新导入服务端代码
+    """
+
+    def __init__(self):
+        parent_sock, child_sock = socket.socketpair()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "api.sandbox_worker", str(child_sock.fileno())],
+            pass_fds=[child_sock.fileno()],
+            cwd=PROJECT_ROOT,
+            stdin=subprocess.DEVNULL
+        )
+        child_sock.close()
+        self.conn = Connection(parent_sock.detach())
+        self.jobs = 0
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid
+
+    def stop(self, timeout: float = 2):
+        """通知工作进程退出，超时未退出则强制终止"""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class SandboxPool:
+    """
+    沙箱进程池
+
+    预先启动一组工作进程，每个工作进程同一时间只执行一个脚本，并对每个任务施加
+    CPU时间、内存（rlimit）和墙钟时间限制。工作进程在执行指定数量的任务、触发资源限制
+    或超时后被回收并重新启动。
+    """
+
+    def __init__(self, size: int, max_jobs: int):
+        self.size = max(1, size)
+        self.max_jobs = max_jobs
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers: Dict[int, _Worker] = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self.jobs_total = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.module_cache_hits = 0
+
+    def start(self):
+        """预启动全部工作进程"""
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                self._add_worker()
+            self._started = True
+        script_logger.info(f"沙箱进程池已启动，工作进程数: {self.size}")
+
+    def _add_worker(self):
+        worker = _Worker()
+        self._workers[id(worker)] = worker
+        self._idle.put(worker)
+
+    def _replace(self, worker: _Worker, kill: bool = False):
+        """回收工作进程并启动一个新的替代它"""
+        with self._lock:
+            self._workers.pop(id(worker), None)
+            self.recycled += 1
+            if self._started:
+                self._add_worker()
+        if kill:
+            worker.kill()
+            worker.conn.close()
+        else:
+            worker.stop()
+
+    def run(
+        self,
+        script_path: str,
+        input_file: str,
+        output_file: str,
+        mode: str = MODE_FILE,
+        cpu_time: int = SANDBOX_CPU_TIME,
+        wall_time: float = SANDBOX_WALL_TIME,
+        memory_mb: int = SANDBOX_MEMORY_MB,
+        max_output_bytes: int = 0
+    ) -> Dict[str, Any]:
+        """
+        在空闲的工作进程中执行脚本（阻塞直到完成）
+
+        max_output_bytes不为0时限制写入的文件大小，超出时抛出SandboxOutputLimit
+
+        返回:
+            Dict[str, Any]: 工作进程返回的执行结果，其中output_file为输出文件路径
+        """
+        if not self._started:
+            self.start()
+        job = {
+            "script_path": os.path.abspath(script_path),
+            "input_file": os.path.abspath(input_file),
+            "output_file": os.path.abspath(output_file),
+            "mode": mode,
+            "cpu_time": cpu_time,
+            "memory_bytes": memory_mb * 1024 * 1024 if memory_mb else 0,
+            "file_bytes": max_output_bytes
+        }
+        worker = self._idle.get()
+        self.jobs_total += 1
+        try:
+            worker.conn.send(job)
+            if not worker.conn.poll(wall_time):
+                self.timeouts += 1
+                script_logger.warning(f"沙箱工作进程 {worker.pid} 执行超时，强制终止")
+                self._replace(worker, kill=True)
+                raise SandboxTimeout(f"脚本执行超过 {wall_time} 秒，已终止")
+            result = worker.conn.recv()
+        except SandboxTimeout:
+            raise
+        except (EOFError, OSError) as e:
+            self.failures += 1
+            script_logger.warning(f"沙箱工作进程 {worker.pid} 异常退出: {str(e)}")
+            self._replace(worker, kill=True)
+            raise SandboxError("沙箱工作进程异常退出")
+
+        worker.jobs += 1
+        if result.get("recycle") or worker.jobs >= self.max_jobs:
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+
+        if result.get("output"):
+            script_logger.debug(f"脚本输出: {result['output']}")
+        if not result["ok"]:
+            self.failures += 1
+            if result.get("output_limit"):
+                raise SandboxOutputLimit(result["error"], result.get("traceback", ""), result.get("output", ""))
+            raise SandboxError(result["error"], result.get("traceback", ""), result.get("output", ""))
+        if result.get("module_cache_hit"):
+            self.module_cache_hits += 1
+        result["output_file"] = output_file
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """返回进程池统计信息"""
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "busy": len(self._workers) - self._idle.qsize(),
+            "jobs_total": self.jobs_total,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "recycled": self.recycled,
+            "module_cache_hits": self.module_cache_hits
+        }
+
+    def shutdown(self):
+        """停止全部工作进程"""
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+            workers = list(self._workers.values())
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+        while not self._idle.empty():
+            self._idle.get_nowait()
+        script_logger.info("沙箱进程池已关闭")
+
+
+# 全局沙箱进程池
+sandbox_pool = SandboxPool(SANDBOX_WORKERS, SANDBOX_MAX_JOBS)
+
+
+def _collect_metrics():
+    """沙箱工作进程状态和执行统计"""
+    stats = sandbox_pool.stats()
+    return [
+        snapshot_gauge("sandbox_workers", "沙箱工作进程数",
+                       {("idle",): stats["idle"], ("busy",): stats["busy"]}, ["state"]),
+        snapshot_counter("sandbox_jobs_total", "沙箱执行的任务数",
+                         {("total",): stats["jobs_total"], ("failed",): stats["failures"],
+                          ("timeout",): stats["timeouts"]}, ["result"]),
+        snapshot_counter("sandbox_recycled_total", "回收的沙箱工作进程数", {(): stats["recycled"]}),
+        snapshot_counter("module_cache_hits_total", "沙箱脚本模块缓存命中次数", {(): stats["module_cache_hits"]})
+    ]
+
+
+register_collector(_collect_metrics)
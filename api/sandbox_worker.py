@@ -0,0 +1,264 @@
+"""
+沙箱工作进程
+
+本模块运行在沙箱工作进程中，只依赖标准库，避免在每个工作进程中初始化日志等服务端组件
+"""
+import os
+import io
+import sys
+import errno
+import time
+import signal
+import types
+import hashlib
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import redirect_stdout, redirect_stderr
+from typing import Tuple
+from .mapped_io import mapped, open_text
+
+try:
+    import resource
+except ImportError:  # 非Unix平台不支持资源限制
+    resource = None
+
+# 返回给父进程的脚本输出最大长度
+MAX_CAPTURED_OUTPUT = 4096
+
+# 脚本约定：file模式定义convert_text(input_file, output_file)（或convert_buffer(data, output_file)），
+# lines模式定义生成器convert_lines(lines)
+MODE_FILE = "file"
+MODE_LINES = "lines"
+
+# 每个进程缓存的已加载脚本模块数量
+MODULE_CACHE_SIZE = int(os.getenv("SCRIPT_MODULE_CACHE_SIZE", 64))
+
+
+class CPUTimeExceeded(Exception):
+    """脚本超出CPU时间限制"""
+
+
+def _on_sigxcpu(signum, frame):
+    raise CPUTimeExceeded("脚本执行超出CPU时间限制")
+
+
+def _apply_limits(cpu_time: int, memory_bytes: int, file_bytes: int = 0):
+    """
+    为当前任务设置资源限制，返回原有的软限制以便任务结束后恢复
+
+    CPU时间是进程累计值，因此软限制设置为"已用时间+本任务配额"；file_bytes限制写入的单个文件大小
+    （工作进程忽略SIGXFSZ，超出时写入抛出OSError(EFBIG)）
+    """
+    if resource is None:
+        return None
+    saved = {}
+    if cpu_time:
+        soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        limit = int(usage.ru_utime + usage.ru_stime) + cpu_time + 1
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+        saved[resource.RLIMIT_CPU] = (soft, hard)
+    if memory_bytes:
+        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+        limit = memory_bytes if hard == resource.RLIM_INFINITY else min(memory_bytes, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+        saved[resource.RLIMIT_AS] = (soft, hard)
+    if file_bytes:
+        soft, hard = resource.getrlimit(resource.RLIMIT_FSIZE)
+        limit = file_bytes if hard == resource.RLIM_INFINITY else min(file_bytes, hard)
+        resource.setrlimit(resource.RLIMIT_FSIZE, (limit, hard))
+        saved[resource.RLIMIT_FSIZE] = (soft, hard)
+    return saved
+
+
+def _restore_limits(saved):
+    if not saved:
+        return
+    for which, limits in saved.items():
+        resource.setrlimit(which, limits)
+
+
+def _allow_mapping(size: int):
+    """
+    把地址空间软限制提高size字节，以便映射整个输入文件
+
+    返回原有的软限制以便恢复（没有限制时返回None）；硬限制不允许时返回False
+    """
+    if resource is None or size == 0:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    limit = soft + size
+    if hard != resource.RLIM_INFINITY and limit > hard:
+        return False
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    return {resource.RLIMIT_AS: (soft, hard)}
+
+
+class ModuleCache:
+    """
+    已加载脚本模块的LRU缓存
+
+    以脚本内容的哈希为键，缓存编译后的代码执行得到的模块。每个脚本使用独立的模块对象和
+    唯一的模块名（format_module_<哈希>），不同脚本之间互不影响；热点脚本再次执行时
+    不需要重新编译和导入。
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self._modules: "OrderedDict[str, types.ModuleType]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, script_path: str) -> Tuple[types.ModuleType, bool]:
+        """
+        加载脚本模块
+
+        返回:
+            Tuple[ModuleType, bool]: (模块, 是否命中缓存)
+        """
+        with open(script_path, "rb") as f:
+            source = f.read()
+        digest = hashlib.sha256(source).hexdigest()
+        with self._lock:
+            module = self._modules.get(digest)
+            if module is not None:
+                self._modules.move_to_end(digest)
+                self.hits += 1
+                return module, True
+
+        # 在锁外编译和执行，避免慢脚本阻塞其他线程
+        name = f"format_module_{digest[:16]}"
+        module = types.ModuleType(name)
+        module.__file__ = os.path.abspath(script_path)
+        sys.modules[name] = module
+        try:
+            exec(compile(source, module.__file__, "exec"), module.__dict__)
+        except BaseException:
+            sys.modules.pop(name, None)
+            raise
+
+        with self._lock:
+            self.misses += 1
+            self._modules[digest] = module
+            self._modules.move_to_end(digest)
+            while len(self._modules) > self.max_size:
+                _, evicted = self._modules.popitem(last=False)
+                sys.modules.pop(evicted.__name__, None)
+        return module, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._modules), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+module_cache = ModuleCache(MODULE_CACHE_SIZE)
+
+
+def convert_file(script_path: str, input_file: str, output_file: str, mode: str = MODE_FILE) -> Tuple[bool, float]:
+    """
+    按脚本约定执行转换
+
+    file模式调用 convert_text(input_file, output_file)，脚本改为定义
+    convert_buffer(data, output_file) 时传入输入文件内存映射的只读memoryview。整个映射计入
+    RLIMIT_AS（与是否访问无关），因此执行期间把地址空间软限制临时提高映射的大小；硬限制不允许时
+    改为调用convert_text，没有定义convert_text时按超出内存限制处理。lines模式调用生成器
+    convert_lines(lines)，按检测到的编码逐行读取输入并逐行写出结果，内存占用与文件大小无关
+
+    返回:
+        Tuple[bool, float]: (脚本模块是否命中模块缓存, 加载脚本模块的耗时)
+    """
+    load_start = time.perf_counter()
+    module, cache_hit = module_cache.load(script_path)
+    load_seconds = time.perf_counter() - load_start
+    if mode == MODE_LINES:
+        if not hasattr(module, "convert_lines"):
+            raise AttributeError("脚本中未定义convert_lines函数")
+        with open_text(input_file) as src, \
+                open(output_file, "w", encoding="utf-8", newline="") as dst:
+            for line in module.convert_lines(src):
+                if line is None:
+                    continue
+                dst.write(line if line.endswith("\n") else line + "\n")
+        return cache_hit, load_seconds
+    if hasattr(module, "convert_buffer"):
+        saved = _allow_mapping(os.path.getsize(input_file))
+        if saved is not False:
+            try:
+                with mapped(input_file, sequential=True) as buf, memoryview(buf) as data:
+                    module.convert_buffer(data, output_file)
+            finally:
+                _restore_limits(saved)
+            return cache_hit, load_seconds
+        if not hasattr(module, "convert_text"):
+            raise MemoryError("输入文件的内存映射超出地址空间限制")
+    if not hasattr(module, "convert_text"):
+        raise AttributeError("脚本中未定义convert_text或convert_buffer函数")
+    module.convert_text(input_file, output_file)
+    return cache_hit, load_seconds
+
+
+def run_job(job: dict) -> dict:
+    """在当前进程中执行一个转换任务"""
+    start_time = time.time()
+    captured = io.StringIO()
+    saved = None
+    try:
+        saved = _apply_limits(job.get("cpu_time", 0), job.get("memory_bytes", 0), job.get("file_bytes", 0))
+        with redirect_stdout(captured), redirect_stderr(captured):
+            cache_hit, load_seconds = convert_file(
+                job["script_path"], job["input_file"], job["output_file"], job.get("mode", MODE_FILE)
+            )
+        result = {
+            "ok": True,
+            "output_file": job["output_file"],
+            "module_cache_hit": cache_hit,
+            "load_seconds": load_seconds
+        }
+    except MemoryError:
+        # 触发资源限制后进程状态不可信，要求父进程回收该工作进程
+        result = {"ok": False, "error": "脚本执行超出内存限制", "traceback": traceback.format_exc(), "recycle": True}
+    except CPUTimeExceeded as e:
+        result = {"ok": False, "error": str(e), "traceback": traceback.format_exc(), "recycle": True}
+    except OSError as e:
+        result = {"ok": False, "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+        if e.errno == errno.EFBIG and job.get("file_bytes"):
+            result["output_limit"] = True
+    except BaseException as e:
+        result = {"ok": False, "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+    finally:
+        _restore_limits(saved)
+    result["output"] = captured.getvalue()[-MAX_CAPTURED_OUTPUT:]
+    result["elapsed"] = time.time() - start_time
+    result["pid"] = os.getpid()
+    return result
+
+
+def worker_main(conn):
+    """工作进程主循环：逐个接收任务并返回结果，收到None时退出"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, "SIGXCPU"):
+        signal.signal(signal.SIGXCPU, _on_sigxcpu)
+    if hasattr(signal, "SIGXFSZ"):
+        # 超出RLIMIT_FSIZE时让写入抛出OSError，而不是终止进程
+        signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        conn.send(run_job(job))
+    conn.close()
+
+
+if __name__ == "__main__":
+    # 由父进程以 python -m api.sandbox_worker <fd> 启动，fd为与父进程通信的socket
+    from multiprocessing.connection import Connection
+    worker_main(Connection(int(sys.argv[1])))
@@ -0,0 +1,261 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, Any, Optional, List
+from .logger import script_logger
+from .metrics import register_collector, snapshot_gauge, snapshot_counter
+from .shared_store import shared_store, SharedStore
+
+# 脚本缓存配置
+SCRIPT_CACHE_ENABLED = os.getenv("SCRIPT_CACHE_ENABLED", "true").lower() == "true"
+SCRIPT_CACHE_INDEX = os.getenv("SCRIPT_CACHE_INDEX", os.path.join("scripts", "script_cache.json"))  # 旧版索引，启动时导入共享存储
+SCRIPT_CACHE_MAX_ENTRIES = int(os.getenv("SCRIPT_CACHE_MAX_ENTRIES", 1000))
+SCRIPT_CACHE_TTL = int(os.getenv("SCRIPT_CACHE_TTL", 7 * 24 * 3600))  # 秒，0表示永不过期
+FINGERPRINT_LINES = int(os.getenv("SCRIPT_CACHE_FINGERPRINT_LINES", 20))  # 参与结构指纹计算的行数
+
+SCRIPTS_NAMESPACE = "scripts"
+
+# 结构指纹中需要合并的字符类别
+_SHAPE_RUNS = re.compile(r"(.)\1+")
+
+
+def normalize_instruction(instruction: str) -> str:
+    """规范化格式转换要求：去除首尾空白和结尾标点、合并空白、统一小写"""
+    text = re.sub(r"\s+", " ", instruction.strip().lower())
+    return text.rstrip("。.！!；;，, ")
+
+
+def line_shape(line: str) -> str:
+    """将一行文本映射为结构形状：字母/汉字->a，数字->9，空白->空格，其余字符保留，连续相同类别合并"""
+    chars = []
+    for ch in line:
+        if ch.isdigit():
+            chars.append("9")
+        elif ch.isalpha():
+            chars.append("a")
+        elif ch.isspace():
+            chars.append(" ")
+        else:
+            chars.append(ch)
+    return _SHAPE_RUNS.sub(r"\1", "".join(chars))
+
+
+def data_fingerprint(sample_data: str) -> str:
+    """
+    计算示例数据的结构指纹
+
+    只关心数据"长什么样"（分隔符、字段类型、行结构），不关心具体取值，
+    因此同一类数据的不同内容会得到相同的指纹
+    """
+    lines = [line for line in sample_data.splitlines() if line.strip()][:FINGERPRINT_LINES]
+    if not lines:
+        return hashlib.sha256(b"").hexdigest()[:16]
+    shapes = [line_shape(line) for line in lines]
+    # 首行单独保留（通常是表头），其余行去重排序，避免取值顺序影响指纹
+    signature = "\n".join([shapes[0]] + sorted(set(shapes[1:])))
+    return hashlib.sha256(signature.encode("utf-8")).hexdigest()[:16]
+
+
+def make_cache_key(format_instruction: str, sample_data: str, model_name: str, mode: str = "file") -> str:
+    """根据规范化的格式要求、示例数据结构指纹、模型名称和脚本约定生成缓存键"""
+    parts = [
+        normalize_instruction(format_instruction),
+        data_fingerprint(sample_data),
+        model_name.strip()
+    ]
+    if mode != "file":
+        parts.append(mode)
+    raw = "\x00".join(parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ScriptCache:
+    """
+    共享的脚本缓存
+
+    以缓存键映射到已生成的脚本，条目（脚本路径、脚本内容和生成信息）保存在共享存储中，
+    同一台机器或多台机器上的所有工作进程共用一份缓存，支持LRU/TTL淘汰、固定（pin）和失效操作。
+    固定的条目不会被淘汰。同一个键并发生成时先通过验证并发布的脚本胜出。
+    本地没有脚本文件时（例如由其他机器生成）按条目中的脚本内容写出。
+    """
+
+    def __init__(self, store: SharedStore, max_entries: int = 1000, ttl: int = 0, legacy_index: Optional[str] = None):
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        if legacy_index:
+            self._migrate(legacy_index)
+
+    def _migrate(self, index_path: str):
+        """把旧版JSON索引中的条目导入共享存储，导入后索引文件改名保留"""
+        if not os.path.exists(index_path):
+            return
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            imported = 0
+            for entry in entries:
+                if not os.path.exists(entry.get("script_path", "")):
+                    continue
+                with open(entry["script_path"], "r", encoding="utf-8") as f:
+                    content = f.read()
+                _, published = self.store.publish(SCRIPTS_NAMESPACE, entry["key"], {**entry, "content": content})
+                if published and entry.get("pinned"):
+                    self.store.set_pinned(SCRIPTS_NAMESPACE, entry["key"], True)
+                imported += published
+            os.replace(index_path, f"{index_path}.migrated")
+            script_logger.info(f"已将脚本缓存索引导入共享存储: {index_path}, 条目数: {imported}")
+        except Exception as e:
+            script_logger.warning(f"导入脚本缓存索引失败，已忽略: {index_path}, 错误: {str(e)}")
+
+    @staticmethod
+    def _public(entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in entry.items() if k != "content"}
+
+    def _is_expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return bool(self.ttl) and not entry.get("pinned") and now - entry["last_used"] > self.ttl
+
+    @staticmethod
+    def _remove_file(entry: Dict[str, Any]):
+        """删除条目对应的脚本文件，只由成功删除条目的进程调用"""
+        if os.path.exists(entry["script_path"]):
+            try:
+                os.remove(entry["script_path"])
+            except OSError as e:
+                script_logger.warning(f"删除缓存脚本失败: {entry['script_path']}, 错误: {str(e)}")
+
+    @staticmethod
+    def _materialize(entry: Dict[str, Any]) -> bool:
+        """按条目中的脚本内容写出本地脚本文件"""
+        if not entry.get("content"):
+            return False
+        path = entry["script_path"]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(entry["content"])
+        os.replace(temp_path, path)
+        script_logger.info(f"从共享存储写出缓存脚本: {path}")
+        return True
+
+    def _evict(self):
+        """淘汰过期条目和超出容量的非固定条目"""
+        victims = self.store.evict(SCRIPTS_NAMESPACE, self.max_entries, self.ttl)
+        for entry in victims:
+            self._remove_file(entry)
+        with self._lock:
+            self._evictions += len(victims)
+
+    def _miss(self) -> None:
+        with self._lock:
+            self._misses += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """查找缓存条目，命中时返回条目并记录使用"""
+        entry = self.store.get(SCRIPTS_NAMESPACE, key)
+        now = time.time()
+        if entry is None:
+            return self._miss()
+        if self._is_expired(entry, now):
+            removed = self.store.delete(SCRIPTS_NAMESPACE, key)
+            if removed:
+                self._remove_file(removed)
+                with self._lock:
+                    self._evictions += 1
+            return self._miss()
+        if not os.path.exists(entry["script_path"]) and not self._materialize(entry):
+            self.store.delete(SCRIPTS_NAMESPACE, key)
+            return self._miss()
+        self.store.record_use(SCRIPTS_NAMESPACE, key)
+        with self._lock:
+            self._hits += 1
+        return {**self._public(entry), "last_used": now, "hits": entry.get("hits", 0) + 1}
+
+    def put(self, key: str, script_path: str, **metadata) -> Dict[str, Any]:
+        """
+        发布缓存条目
+
+        键已存在时（其他进程先发布了通过验证的脚本）保留已有条目，本次的脚本只用于当前请求
+        """
+        with open(script_path, "r", encoding="utf-8") as f:
+            content = f.read()
+        entry, published = self.store.publish(
+            SCRIPTS_NAMESPACE, key, {"script_path": script_path, "content": content, **metadata}
+        )
+        if not published:
+            script_logger.info(f"脚本缓存条目已由其他请求发布: {key[:12]}")
+        self._evict()
+        return self._public(entry)
+
+    def pin(self, key: str, pinned: bool = True) -> bool:
+        """固定或取消固定条目，返回条目是否存在"""
+        if not self.store.set_pinned(SCRIPTS_NAMESPACE, key, pinned):
+            return False
+        if not pinned:
+            self._evict()
+        return True
+
+    def invalidate(self, key: str) -> bool:
+        """使条目失效并删除对应脚本，返回条目是否存在"""
+        entry = self.store.delete(SCRIPTS_NAMESPACE, key)
+        if entry is None:
+            return False
+        self._remove_file(entry)
+        return True
+
+    def clear(self, include_pinned: bool = False) -> int:
+        """清空缓存，返回移除的条目数"""
+        entries = self.store.clear(SCRIPTS_NAMESPACE, include_pinned)
+        for entry in entries:
+            self._remove_file(entry)
+        return len(entries)
+
+    def pinned_paths(self) -> List[str]:
+        """返回固定条目对应的脚本路径"""
+        return [e["script_path"] for e in self.store.list(SCRIPTS_NAMESPACE, pinned_only=True)]
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """按最近使用时间倒序返回所有条目"""
+        return [self._public(e) for e in self.store.list(SCRIPTS_NAMESPACE)]
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息（条目数来自共享存储，命中统计为本进程的数据）"""
+        entries, pinned = self.store.count(SCRIPTS_NAMESPACE)
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": SCRIPT_CACHE_ENABLED,
+                "entries": entries,
+                "pinned": pinned,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "max_entries": self.max_entries,
+                "ttl": self.ttl
+            }
+
+
+# 全局脚本缓存实例
+script_cache = ScriptCache(shared_store, SCRIPT_CACHE_MAX_ENTRIES, SCRIPT_CACHE_TTL, SCRIPT_CACHE_INDEX)
+
+
+def _collect_metrics():
+    """脚本缓存的条目数和命中统计"""
+    stats = script_cache.stats()
+    return [
+        snapshot_gauge("script_cache_entries", "脚本缓存条目数", {(): stats["entries"]}),
+        snapshot_counter("script_cache_lookups_total", "脚本缓存查找次数",
+                         {("hit",): stats["hits"], ("miss",): stats["misses"]}, ["result"]),
+        snapshot_counter("script_cache_evictions_total", "脚本缓存淘汰条目数", {(): stats["evictions"]})
+    ]
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,276 @@
+import os
+import ast
+import uuid
+import hashlib
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from .logger import script_logger
+from .sandbox import sandbox_pool, SANDBOX_WORKERS
+from .sandbox_worker import MODE_FILE
+from .script_cache import line_shape
+from .mapped_io import mapped, file_encoding, code_unit, next_line_start
+from .shared_store import shared_store
+
+# 分片执行配置
+SHARDING_ENABLED = os.getenv("SHARDING_ENABLED", "true").lower() == "true"
+SHARD_MIN_BYTES = int(os.getenv("SHARD_MIN_BYTES", 8 * 1024 * 1024))  # 小于该大小的文件整体执行
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", SANDBOX_WORKERS))  # 最大分片数
+SHARD_VERIFY_LINES = int(os.getenv("SHARD_VERIFY_LINES", 200))  # 分片安全性校验使用的示例行数
+
+# 读写分片时的缓冲区大小
+_COPY_BUFFER = 1024 * 1024
+
+# 本进程的分片安全性校验结果缓存：(脚本内容哈希, 约定, 是否有表头) -> 是否分片安全；
+# 校验结果同时发布到共享存储，其他工作进程直接复用
+_verdicts = {}
+_verdicts_lock = threading.Lock()
+_MAX_VERDICTS = 1024
+VERDICTS_NAMESPACE = "shard_verdicts"
+
+# 并发分发分片任务的线程池，实际执行由沙箱进程池完成
+_dispatcher = ThreadPoolExecutor(max_workers=max(1, SHARD_COUNT), thread_name_prefix="shard")
+
+
+def read_declarations(script_path: str) -> dict:
+    """
+    通过语法树读取脚本中的模块级声明（SHARD_SAFE、SHARD_HEADER），不执行脚本代码
+
+    返回:
+        dict: 声明名称到常量值的映射
+    """
+    with open(script_path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=script_path)
+    declarations = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id in ("SHARD_SAFE", "SHARD_HEADER"):
+                    declarations[target.id] = node.value.value
+    return declarations
+
+
+def detect_header(lines: List[str]) -> bool:
+    """启发式判断首行是否为表头：首行结构与后续各行都不同，且后续行结构一致"""
+    rows = [line for line in lines if line.strip()]
+    if len(rows) < 3:
+        return False
+    first = line_shape(rows[0].rstrip("\r\n"))
+    rest = [line_shape(line.rstrip("\r\n")) for line in rows[1:51]]
+    most_common = max(set(rest), key=rest.count)
+    return first not in rest and rest.count(most_common) >= 2
+
+
+def _read_head_lines(file_path: str, max_lines: int) -> List[bytes]:
+    lines = []
+    with open(file_path, "rb") as f:
+        for line in f:
+            lines.append(line)
+            if len(lines) >= max_lines:
+                break
+    return lines
+
+
+def split_file(input_file: str, shard_count: int, work_dir: str, header: bool) -> List[str]:
+    """
+    在行边界处将文件切分为多个分片
+
+    有表头时，表头行会复制到除第一个分片外的每个分片开头
+    """
+    prefix = os.path.join(work_dir, f"shard_{uuid.uuid4().hex}")
+    shard_paths = []
+    with mapped(input_file, sequential=True) as buf, memoryview(buf) as view:
+        file_size = len(buf)
+        header_line = view[:next_line_start(buf, 0)] if header else b""
+        # 计算对齐到行首的分片起始偏移
+        offsets = [0]
+        for i in range(1, shard_count):
+            position = next_line_start(buf, max(offsets[-1], file_size * i // shard_count))
+            if position >= file_size:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+        offsets.append(file_size)
+
+        # 分片内容直接从映射的页写出，不经过中间缓冲区
+        for index in range(len(offsets) - 1):
+            start, end = offsets[index], offsets[index + 1]
+            shard_path = f"{prefix}_{index}.in"
+            with open(shard_path, "wb") as dst:
+                if index > 0 and header_line:
+                    dst.write(header_line)
+                for chunk_start in range(start, end, _COPY_BUFFER):
+                    with view[chunk_start:min(end, chunk_start + _COPY_BUFFER)] as chunk:
+                        dst.write(chunk)
+            shard_paths.append(shard_path)
+        if isinstance(header_line, memoryview):
+            header_line.release()
+    return shard_paths
+
+
+def merge_outputs(shard_outputs: List[str], output_file: str, header: bool):
+    """
+    按顺序合并各分片的输出
+
+    有表头时，如果后续分片输出的首行与第一个分片输出的首行相同，则视为重复的输出表头并跳过；
+    前一个分片的输出不以换行结尾时，在分片之间补一个换行
+    """
+    first_line: Optional[bytes] = None
+    need_separator = False
+    with open(output_file, "wb") as dst:
+        for index, shard_output in enumerate(shard_outputs):
+            if not os.path.exists(shard_output):
+                continue
+            last_chunk = b""
+            with open(shard_output, "rb") as src:
+                line = src.readline()
+                if index == 0:
+                    first_line = line
+                elif header and line == first_line:
+                    line = b""
+                for chunk in itertools.chain([line], iter(lambda: src.read(_COPY_BUFFER), b"")):
+                    if not chunk:
+                        continue
+                    if need_separator:
+                        dst.write(b"\n")
+                        need_separator = False
+                    dst.write(chunk)
+                    last_chunk = chunk
+            if last_chunk:
+                need_separator = not last_chunk.endswith(b"\n")
+
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _run_shards(script_path: str, shard_inputs: List[str], mode: str) -> List[str]:
+    """并行执行各分片，任一分片失败则整体失败"""
+    shard_outputs = [f"{path[:-3]}.out" for path in shard_inputs]
+    futures = [
+        _dispatcher.submit(sandbox_pool.run, script_path, shard_input, shard_output, mode)
+        for shard_input, shard_output in zip(shard_inputs, shard_outputs)
+    ]
+    try:
+        for future in futures:
+            future.result()
+    except Exception:
+        for future in futures:
+            future.cancel()
+        _remove_files(shard_outputs)
+        raise
+    return shard_outputs
+
+
+def _verify_on_sample(script_path: str, input_file: str, mode: str, header: bool, work_dir: str) -> bool:
+    """在输入文件的示例行上分别整体执行和分片执行脚本，比较两者输出是否一致"""
+    lines = _read_head_lines(input_file, SHARD_VERIFY_LINES)
+    if len(lines) < 4:
+        return False
+    prefix = os.path.join(work_dir, f"verify_{uuid.uuid4().hex}")
+    sample_input = f"{prefix}.in"
+    whole_output = f"{prefix}.out"
+    merged_output = f"{prefix}.merged"
+    with open(sample_input, "wb") as f:
+        f.writelines(lines)
+    temp_files = [sample_input, whole_output, merged_output]
+    try:
+        sandbox_pool.run(script_path, sample_input, whole_output, mode)
+        shard_inputs = split_file(sample_input, 2, work_dir, header)
+        temp_files.extend(shard_inputs)
+        shard_outputs = _run_shards(script_path, shard_inputs, mode)
+        temp_files.extend(shard_outputs)
+        merge_outputs(shard_outputs, merged_output, header)
+        if not os.path.exists(whole_output) or os.path.getsize(whole_output) == 0:
+            return False
+        with open(whole_output, "rb") as a, open(merged_output, "rb") as b:
+            return a.read() == b.read()
+    except Exception as e:
+        script_logger.info(f"分片安全性校验未通过: {script_path}, 原因: {str(e)}")
+        return False
+    finally:
+        _remove_files(temp_files)
+
+
+def check_shard_safety(script_path: str, input_file: str, mode: str, work_dir: str) -> Tuple[bool, bool]:
+    """
+    判断脚本能否对该输入分片执行
+
+    优先使用脚本自身的SHARD_SAFE/SHARD_HEADER声明；未声明时在示例数据上比较整体执行和
+    分片执行的输出，结果按脚本内容缓存
+
+    返回:
+        Tuple[bool, bool]: (是否分片安全, 是否有表头)
+    """
+    declarations = read_declarations(script_path)
+    if "SHARD_HEADER" in declarations:
+        header = bool(declarations["SHARD_HEADER"])
+    else:
+        encoding, _ = file_encoding(input_file)
+        head = [line.decode(encoding, errors="ignore") for line in _read_head_lines(input_file, 50)]
+        header = detect_header(head)
+    if "SHARD_SAFE" in declarations:
+        return bool(declarations["SHARD_SAFE"]), header
+
+    with open(script_path, "rb") as f:
+        script_hash = hashlib.sha256(f.read()).hexdigest()
+    key = (script_hash, mode, header)
+    with _verdicts_lock:
+        if key in _verdicts:
+            return _verdicts[key], header
+    # 本进程没有结果时查找其他工作进程的校验结果
+    store_key = f"{script_hash}:{mode}:{int(header)}"
+    record = shared_store.get(VERDICTS_NAMESPACE, store_key)
+    if record is not None:
+        safe = record["safe"]
+    else:
+        safe = _verify_on_sample(script_path, input_file, mode, header, work_dir)
+        _, published = shared_store.publish(VERDICTS_NAMESPACE, store_key, {"safe": safe})
+        if published:
+            shared_store.evict(VERDICTS_NAMESPACE, _MAX_VERDICTS)
+    with _verdicts_lock:
+        if len(_verdicts) >= _MAX_VERDICTS:
+            _verdicts.clear()
+        _verdicts[key] = safe
+    script_logger.info(f"脚本分片安全性校验结果: {script_path}, 安全: {safe}, 表头: {header}")
+    return safe, header
+
+
+def should_shard(input_file: str) -> bool:
+    """判断输入文件是否值得分片执行；按字节查找换行切分，UTF-16/32编码的输入整体执行"""
+    return (
+        SHARDING_ENABLED
+        and SHARD_COUNT > 1
+        and sandbox_pool.size > 1
+        and os.path.getsize(input_file) >= SHARD_MIN_BYTES
+        and code_unit(file_encoding(input_file)[0]) == 1
+    )
+
+
+def run_sharded(script_path: str, input_file: str, output_file: str, mode: str = MODE_FILE) -> bool:
+    """
+    尝试分片并行执行脚本，结果按顺序合并到output_file
+
+    返回:
+        bool: 是否以分片方式完成；返回False时调用方应整体执行
+    """
+    work_dir = os.path.dirname(output_file) or "."
+    safe, header = check_shard_safety(script_path, input_file, mode, work_dir)
+    if not safe:
+        return False
+
+    shard_count = min(SHARD_COUNT, sandbox_pool.size)
+    shard_inputs = split_file(input_file, shard_count, work_dir, header)
+    script_logger.info(f"分片执行脚本: {script_path}, 分片数: {len(shard_inputs)}, 表头: {header}")
+    shard_outputs: List[str] = []
+    try:
+        shard_outputs = _run_shards(script_path, shard_inputs, mode)
+        merge_outputs(shard_outputs, output_file, header)
+    finally:
+        _remove_files(shard_inputs + shard_outputs)
+    return True
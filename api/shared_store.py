@@ -0,0 +1,654 @@
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+from . import DATA_DIR
+from .logger import app_logger
+from .metrics import register_collector, snapshot_counter, snapshot_gauge
+
+# 共享存储配置：多个工作进程或多台机器共用的脚本缓存索引、脚本校验结果和转换结果
+SHARED_STORE_BACKEND = os.getenv("SHARED_STORE_BACKEND", "sqlite").lower()  # sqlite / file / http
+SHARED_STORE_PATH = os.getenv("SHARED_STORE_PATH", "")  # sqlite为数据库文件，file为目录，留空使用默认位置
+SHARED_STORE_URL = os.getenv("SHARED_STORE_URL", "http://127.0.0.1:9920")  # http后端的服务地址
+SHARED_STORE_TIMEOUT = float(os.getenv("SHARED_STORE_TIMEOUT", 5))  # http后端的请求超时（秒）
+SHARED_STORE_LOCAL_TTL = float(os.getenv("SHARED_STORE_LOCAL_TTL", 5))  # http后端读取结果在本进程缓存的时间（秒）
+SHARED_STORE_LOCAL_MAX = int(os.getenv("SHARED_STORE_LOCAL_MAX", 4096))  # 本进程缓存的最大条目数
+SHARED_STORE_FLUSH_INTERVAL = float(os.getenv("SHARED_STORE_FLUSH_INTERVAL", 5))  # 命中统计批量写回的间隔（秒）
+SHARED_STORE_BLOB_MAX_BYTES = int(os.getenv("SHARED_STORE_BLOB_MAX_BYTES", 256 * 1024 ** 2))  # 上传到共享存储的结果文件大小上限
+
+DEFAULT_PATHS = {"sqlite": os.path.join(DATA_DIR, "shared_store.db"), "file": os.path.join(DATA_DIR, "shared_store")}
+
+# 条目中由存储维护的字段，其余字段作为值整体保存
+_META_FIELDS = ("key", "created_at", "last_used", "hits", "pinned")
+
+
+def _split(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in record.items() if k not in _META_FIELDS}
+
+
+class SQLiteBackend:
+    """
+    SQLite（WAL模式）后端，适用于同一台机器上的多个工作进程
+
+    WAL模式下读取不阻塞写入，每个线程使用独立的连接；写操作在 BEGIN IMMEDIATE 事务中进行，
+    发布和淘汰在一个事务内完成判断和修改，多个进程同时操作时结果一致
+    """
+
+    name = "sqlite"
+    remote = False
+    has_blobs = False
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        conn = self._conn()
+        with self._write(conn):
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    pinned INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_lru ON entries (namespace, pinned, last_used)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 自动提交模式，写操作显式开启事务
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    @contextmanager
+    def _write(conn: sqlite3.Connection):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _record(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            **json.loads(row["value"]),
+            "key": row["key"],
+            "created_at": row["created_at"],
+            "last_used": row["last_used"],
+            "hits": row["hits"],
+            "pinned": bool(row["pinned"])
+        }
+
+    def _select(self, conn, namespace: str, keys: List[str]) -> List[Dict[str, Any]]:
+        records = []
+        for key in keys:
+            row = conn.execute("SELECT * FROM entries WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            if row:
+                records.append(self._record(row))
+        return records
+
+    def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        records = self._select(self._conn(), namespace, [key])
+        return records[0] if records else None
+
+    def publish(self, namespace: str, key: str, value: Dict[str, Any], now: float) -> Tuple[Dict[str, Any], bool]:
+        conn = self._conn()
+        with self._write(conn):
+            cursor = conn.execute(
+                "INSERT INTO entries (namespace, key, value, created_at, last_used) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO NOTHING",
+                (namespace, key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            record = self._select(conn, namespace, [key])[0]
+        return record, cursor.rowcount > 0
+
+    def touch(self, namespace: str, usage: Dict[str, Tuple[int, float]]):
+        conn = self._conn()
+        with self._write(conn):
+            conn.executemany(
+                "UPDATE entries SET hits = hits + ?, last_used = MAX(last_used, ?) WHERE namespace = ? AND key = ?",
+                [(hits, last_used, namespace, key) for key, (hits, last_used) in usage.items()]
+            )
+
+    def set_pinned(self, namespace: str, key: str, pinned: bool) -> bool:
+        conn = self._conn()
+        with self._write(conn):
+            cursor = conn.execute(
+                "UPDATE entries SET pinned = ? WHERE namespace = ? AND key = ?", (int(pinned), namespace, key)
+            )
+        return cursor.rowcount > 0
+
+    def _delete(self, conn, namespace: str, keys: List[str]) -> List[Dict[str, Any]]:
+        records = self._select(conn, namespace, keys)
+        conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", [(namespace, r["key"]) for r in records])
+        return records
+
+    def delete(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        with self._write(conn):
+            records = self._delete(conn, namespace, [key])
+        return records[0] if records else None
+
+    def evict(self, namespace: str, max_entries: int, ttl: float, now: float) -> List[Dict[str, Any]]:
+        conn = self._conn()
+        with self._write(conn):
+            keys = []
+            if ttl:
+                keys += [row[0] for row in conn.execute(
+                    "SELECT key FROM entries WHERE namespace = ? AND pinned = 0 AND last_used < ?",
+                    (namespace, now - ttl)
+                )]
+            total = conn.execute("SELECT COUNT(*) FROM entries WHERE namespace = ?", (namespace,)).fetchone()[0]
+            excess = total - len(keys) - max_entries
+            if excess > 0:
+                keys += [row[0] for row in conn.execute(
+                    f"SELECT key FROM entries WHERE namespace = ? AND pinned = 0 "
+                    f"{'AND last_used >= ?' if ttl else ''} ORDER BY last_used LIMIT ?",
+                    (namespace, now - ttl, excess) if ttl else (namespace, excess)
+                )]
+            return self._delete(conn, namespace, keys)
+
+    def clear(self, namespace: str, include_pinned: bool) -> List[Dict[str, Any]]:
+        conn = self._conn()
+        with self._write(conn):
+            keys = [row[0] for row in conn.execute(
+                "SELECT key FROM entries WHERE namespace = ?" + ("" if include_pinned else " AND pinned = 0"),
+                (namespace,)
+            )]
+            return self._delete(conn, namespace, keys)
+
+    def list(self, namespace: str, pinned_only: bool = False) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT * FROM entries WHERE namespace = ?" + (" AND pinned = 1" if pinned_only else "")
+            + " ORDER BY last_used DESC",
+            (namespace,)
+        ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def count(self, namespace: str) -> Tuple[int, int]:
+        row = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(pinned), 0) FROM entries WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return row[0], row[1]
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+class FileBackend:
+    """
+    文件后端，每个条目一个JSON文件，适用于不方便使用SQLite的共享文件系统
+
+    发布时先写临时文件，再用硬链接原子地创建条目文件，已存在时链接失败，先发布者胜出；
+    读取不加锁，修改命中统计、固定和淘汰时持有命名空间的文件锁
+    """
+
+    name = "file"
+    remote = False
+    has_blobs = False
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _dir(self, namespace: str) -> str:
+        return os.path.join(self.path, namespace)
+
+    def _file(self, namespace: str, key: str) -> str:
+        return os.path.join(self._dir(namespace), key[:2], f"{key}.json")
+
+    @contextmanager
+    def _locked(self, namespace: str):
+        os.makedirs(self._dir(namespace), exist_ok=True)
+        with open(os.path.join(self._dir(namespace), ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _temp(path: str, record: Dict[str, Any]) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        return temp_path
+
+    def _rewrite(self, path: str, record: Dict[str, Any]):
+        os.replace(self._temp(path, record), path)
+
+    def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        return self._read(self._file(namespace, key))
+
+    def publish(self, namespace: str, key: str, value: Dict[str, Any], now: float) -> Tuple[Dict[str, Any], bool]:
+        path = self._file(namespace, key)
+        record = {**value, "key": key, "created_at": now, "last_used": now, "hits": 0, "pinned": False}
+        temp_path = self._temp(path, record)
+        try:
+            os.link(temp_path, path)
+            return record, True
+        except FileExistsError:
+            existing = self._read(path)
+            return (existing, False) if existing else (record, False)
+        finally:
+            os.remove(temp_path)
+
+    def touch(self, namespace: str, usage: Dict[str, Tuple[int, float]]):
+        with self._locked(namespace):
+            for key, (hits, last_used) in usage.items():
+                path = self._file(namespace, key)
+                record = self._read(path)
+                if record:
+                    record["hits"] = record.get("hits", 0) + hits
+                    record["last_used"] = max(record.get("last_used", 0), last_used)
+                    self._rewrite(path, record)
+
+    def set_pinned(self, namespace: str, key: str, pinned: bool) -> bool:
+        with self._locked(namespace):
+            path = self._file(namespace, key)
+            record = self._read(path)
+            if record is None:
+                return False
+            record["pinned"] = pinned
+            self._rewrite(path, record)
+            return True
+
+    def _delete(self, namespace: str, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        removed = []
+        for record in records:
+            try:
+                os.remove(self._file(namespace, record["key"]))
+                removed.append(record)
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def delete(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._locked(namespace):
+            record = self._read(self._file(namespace, key))
+            removed = self._delete(namespace, [record]) if record else []
+        return removed[0] if removed else None
+
+    def _all(self, namespace: str) -> List[Dict[str, Any]]:
+        records = []
+        base = self._dir(namespace)
+        if not os.path.isdir(base):
+            return records
+        for prefix in os.scandir(base):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.name.endswith(".json"):
+                    record = self._read(entry.path)
+                    if record:
+                        records.append(record)
+        return records
+
+    def evict(self, namespace: str, max_entries: int, ttl: float, now: float) -> List[Dict[str, Any]]:
+        with self._locked(namespace):
+            records = self._all(namespace)
+            victims = [r for r in records if ttl and not r.get("pinned") and r["last_used"] < now - ttl]
+            expired = {r["key"] for r in victims}
+            remaining = sorted(
+                (r for r in records if not r.get("pinned") and r["key"] not in expired), key=lambda r: r["last_used"]
+            )
+            excess = len(records) - len(victims) - max_entries
+            if excess > 0:
+                victims += remaining[:excess]
+            return self._delete(namespace, victims)
+
+    def clear(self, namespace: str, include_pinned: bool) -> List[Dict[str, Any]]:
+        with self._locked(namespace):
+            records = [r for r in self._all(namespace) if include_pinned or not r.get("pinned")]
+            return self._delete(namespace, records)
+
+    def list(self, namespace: str, pinned_only: bool = False) -> List[Dict[str, Any]]:
+        records = [r for r in self._all(namespace) if r.get("pinned") or not pinned_only]
+        return sorted(records, key=lambda r: r["last_used"], reverse=True)
+
+    def count(self, namespace: str) -> Tuple[int, int]:
+        records = self._all(namespace)
+        return len(records), sum(1 for r in records if r.get("pinned"))
+
+    def close(self):
+        pass
+
+
+class HTTPBackend:
+    """
+    网络存储后端，通过HTTP访问共享存储服务，适用于多台机器
+
+    接口由 tools/shared_store_server.py 提供（本地替身，内部使用SQLite后端），
+    条目的原子发布和一致淘汰由服务端完成；还支持上传和下载转换结果文件（blob）
+    """
+
+    name = "http"
+    remote = True
+    has_blobs = True
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._http: Optional[httpx.Client] = None
+
+    @property
+    def _client(self) -> httpx.Client:
+        """连接池在第一次请求时创建，关闭后（例如启动器派生工作进程之前）在下次请求时重新创建"""
+        if self._http is None:
+            self._http = httpx.Client(base_url=self.url, timeout=self.timeout)
+        return self._http
+
+    def _call(self, method: str, path: str, **kwargs) -> Optional[Any]:
+        response = self._client.request(method, path, **kwargs)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        return self._call("GET", f"/v1/{namespace}/{key}")
+
+    def publish(self, namespace: str, key: str, value: Dict[str, Any], now: float) -> Tuple[Dict[str, Any], bool]:
+        result = self._call("POST", f"/v1/{namespace}/{key}", json={"value": value, "now": now})
+        return result["record"], result["published"]
+
+    def touch(self, namespace: str, usage: Dict[str, Tuple[int, float]]):
+        self._call("POST", f"/v1/{namespace}/_touch", json={"usage": usage})
+
+    def set_pinned(self, namespace: str, key: str, pinned: bool) -> bool:
+        return self._call("PATCH", f"/v1/{namespace}/{key}", json={"pinned": pinned}) is not None
+
+    def delete(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        return self._call("DELETE", f"/v1/{namespace}/{key}")
+
+    def evict(self, namespace: str, max_entries: int, ttl: float, now: float) -> List[Dict[str, Any]]:
+        return self._call("POST", f"/v1/{namespace}/_evict", json={"max_entries": max_entries, "ttl": ttl, "now": now})
+
+    def clear(self, namespace: str, include_pinned: bool) -> List[Dict[str, Any]]:
+        return self._call("POST", f"/v1/{namespace}/_clear", json={"include_pinned": include_pinned})
+
+    def list(self, namespace: str, pinned_only: bool = False) -> List[Dict[str, Any]]:
+        return self._call("GET", f"/v1/{namespace}", params={"pinned_only": pinned_only})
+
+    def count(self, namespace: str) -> Tuple[int, int]:
+        result = self._call("GET", f"/v1/{namespace}/_count")
+        return result["entries"], result["pinned"]
+
+    def put_blob(self, namespace: str, key: str, path: str):
+        def chunks():
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        self._client.put(f"/blobs/{namespace}/{key}", content=chunks()).raise_for_status()
+
+    def fetch_blob(self, namespace: str, key: str, dest: str) -> bool:
+        """下载blob到dest（先写临时文件再原子替换），不存在时返回False"""
+        temp_path = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._client.stream("GET", f"/blobs/{namespace}/{key}") as response:
+            if response.status_code == 404:
+                return False
+            response.raise_for_status()
+            os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+            try:
+                with open(temp_path, "wb") as f:
+                    for chunk in response.iter_bytes(1024 * 1024):
+                        f.write(chunk)
+                os.replace(temp_path, dest)
+            except BaseException:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                raise
+        return True
+
+    def close(self):
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+
+def create_backend(kind: str = SHARED_STORE_BACKEND, path: str = SHARED_STORE_PATH):
+    """按配置创建共享存储后端"""
+    if kind == "http":
+        return HTTPBackend(SHARED_STORE_URL, SHARED_STORE_TIMEOUT)
+    if kind not in DEFAULT_PATHS:
+        raise ValueError(f"不支持的共享存储后端: {kind}，可选: sqlite, file, http")
+    path = path or DEFAULT_PATHS[kind]
+    return SQLiteBackend(path) if kind == "sqlite" else FileBackend(path)
+
+
+class SharedStore:
+    """
+    共享存储的统一入口
+
+    - 原子发布：publish只在条目不存在时写入，多个进程同时发布同一个键时先发布者胜出，所有进程看到同一个结果
+    - 读取快速路径：读取不写存储，命中统计先在本进程累积，每隔 SHARED_STORE_FLUSH_INTERVAL 秒批量写回；
+      网络后端的读取结果在本进程缓存 SHARED_STORE_LOCAL_TTL 秒
+    - 一致淘汰：淘汰在存储内部一次性完成选择和删除，返回被删除的条目，只有删除成功的进程负责清理对应文件
+
+    查找路径上的操作（get/publish/record_use/evict/blob）在存储不可用时记录警告并按未命中处理，不影响转换
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._local: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._usage: Dict[str, Dict[str, List]] = {}
+        self._last_flush = time.monotonic()
+        self.counters = {"reads": 0, "local_hits": 0, "publishes": 0, "conflicts": 0, "evictions": 0,
+                         "flushes": 0, "errors": 0}
+
+    @property
+    def name(self) -> str:
+        return self.backend.name
+
+    @property
+    def has_blobs(self) -> bool:
+        return self.backend.has_blobs
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _failed(self, operation: str, error: Exception):
+        self._count("errors")
+        app_logger.warning(f"共享存储{operation}失败（{self.backend.name}）: {str(error)}")
+
+    def _forget(self, namespace: str, key: str):
+        with self._lock:
+            self._local.pop((namespace, key), None)
+
+    def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        """读取条目，不存在或存储不可用时返回None"""
+        if self.backend.remote:
+            with self._lock:
+                cached = self._local.get((namespace, key))
+                if cached and cached[0] > time.monotonic():
+                    self.counters["local_hits"] += 1
+                    return dict(cached[1])
+        self._count("reads")
+        try:
+            record = self.backend.get(namespace, key)
+        except Exception as e:
+            self._failed("读取", e)
+            return None
+        if record is not None and self.backend.remote:
+            self._remember(namespace, key, record)
+        return record
+
+    def _remember(self, namespace: str, key: str, record: Dict[str, Any]):
+        with self._lock:
+            self._local[(namespace, key)] = (time.monotonic() + SHARED_STORE_LOCAL_TTL, dict(record))
+            self._local.move_to_end((namespace, key))
+            while len(self._local) > SHARED_STORE_LOCAL_MAX:
+                self._local.popitem(last=False)
+
+    def publish(self, namespace: str, key: str, value: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """
+        原子发布条目
+
+        返回:
+            Tuple[Dict, bool]: (存储中的条目, 是否由本次发布写入)；存储不可用时返回本次的值和False
+        """
+        now = time.time()
+        try:
+            record, published = self.backend.publish(namespace, key, _split(value), now)
+        except Exception as e:
+            self._failed("发布", e)
+            return {**value, "key": key, "created_at": now, "last_used": now, "hits": 0, "pinned": False}, False
+        self._count("publishes" if published else "conflicts")
+        if self.backend.remote:
+            self._remember(namespace, key, record)
+        return record, published
+
+    def record_use(self, namespace: str, key: str):
+        """记录一次命中，累积后批量写回"""
+        now = time.time()
+        with self._lock:
+            usage = self._usage.setdefault(namespace, {}).setdefault(key, [0, now])
+            usage[0] += 1
+            usage[1] = now
+            due = time.monotonic() - self._last_flush >= SHARED_STORE_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        """把累积的命中统计写回存储"""
+        with self._lock:
+            pending, self._usage = self._usage, {}
+            self._last_flush = time.monotonic()
+        for namespace, usage in pending.items():
+            try:
+                self.backend.touch(namespace, {key: (hits, last_used) for key, (hits, last_used) in usage.items()})
+            except Exception as e:
+                self._failed("写回命中统计", e)
+        if pending:
+            self._count("flushes")
+
+    def evict(self, namespace: str, max_entries: int, ttl: float = 0) -> List[Dict[str, Any]]:
+        """淘汰过期条目和超出容量的最久未使用条目（固定的条目除外），返回被本进程删除的条目"""
+        self.flush()
+        try:
+            victims = self.backend.evict(namespace, max_entries, ttl, time.time())
+        except Exception as e:
+            self._failed("淘汰", e)
+            return []
+        for record in victims:
+            self._forget(namespace, record["key"])
+        self._count("evictions", len(victims))
+        return victims
+
+    def set_pinned(self, namespace: str, key: str, pinned: bool) -> bool:
+        self._forget(namespace, key)
+        return self.backend.set_pinned(namespace, key, pinned)
+
+    def delete(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        """删除条目，返回被本进程删除的条目（其他进程已删除时返回None）"""
+        self._forget(namespace, key)
+        return self.backend.delete(namespace, key)
+
+    def clear(self, namespace: str, include_pinned: bool = False) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._local = OrderedDict((k, v) for k, v in self._local.items() if k[0] != namespace)
+        return self.backend.clear(namespace, include_pinned)
+
+    def list(self, namespace: str, pinned_only: bool = False) -> List[Dict[str, Any]]:
+        self.flush()
+        return self.backend.list(namespace, pinned_only)
+
+    def count(self, namespace: str) -> Tuple[int, int]:
+        """(条目数, 固定条目数)，存储不可用时返回(0, 0)"""
+        try:
+            return self.backend.count(namespace)
+        except Exception as e:
+            self._failed("统计", e)
+            return 0, 0
+
+    def put_blob(self, namespace: str, key: str, path: str) -> bool:
+        """上传文件内容，后端不支持或文件过大时跳过"""
+        if not self.backend.has_blobs or os.path.getsize(path) > SHARED_STORE_BLOB_MAX_BYTES:
+            return False
+        try:
+            self.backend.put_blob(namespace, key, path)
+            return True
+        except Exception as e:
+            self._failed("上传文件", e)
+            return False
+
+    def fetch_blob(self, namespace: str, key: str, dest: str) -> bool:
+        if not self.backend.has_blobs:
+            return False
+        try:
+            return self.backend.fetch_blob(namespace, key, dest)
+        except Exception as e:
+            self._failed("下载文件", e)
+            return False
+
+    def close(self):
+        """写回命中统计并关闭后端，在服务关闭时调用"""
+        self.flush()
+        self.backend.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, "local_entries": len(self._local)}
+
+
+# 全局共享存储
+shared_store = SharedStore(create_backend())
+
+
+def _collect_metrics():
+    """共享存储的操作次数"""
+    stats = shared_store.stats()
+    operations = ("reads", "local_hits", "publishes", "conflicts", "evictions", "flushes", "errors")
+    return [
+        snapshot_counter("shared_store_operations_total", "共享存储的操作次数",
+                         {(shared_store.name, op): stats[op] for op in operations}, ["backend", "operation"]),
+        snapshot_gauge("shared_store_local_entries", "网络后端在本进程缓存的条目数", {(): stats["local_entries"]})
+    ]
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,158 @@
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from .logger import api_logger
+from .metrics import counter, register_collector, snapshot_gauge
+
+# 相同请求合并配置
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+SINGLEFLIGHT_RESULT_TTL = float(os.getenv("SINGLEFLIGHT_RESULT_TTL", 10))  # 完成后结果保留的时间（秒），用于吸收客户端重试
+SINGLEFLIGHT_MAX_RESULTS = int(os.getenv("SINGLEFLIGHT_MAX_RESULTS", 256))  # 最多保留的已完成结果数
+
+COALESCED = counter("singleflight_requests_total", "转换请求的执行方式", ["result"])
+
+# 执行函数返回 (结果, 清理函数)，清理函数在最后一个使用者释放结果后调用
+Flight = Callable[[], Awaitable[Tuple[Any, Callable[[], None]]]]
+
+
+def flight_key(content_digest: str, format_instruction: str, model_name: str, kind: str = "convert") -> str:
+    """由输入内容的哈希、格式要求和模型名称组成的合并键"""
+    raw = "\0".join([kind, content_digest, format_instruction, model_name])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Lease:
+    """
+    共享结果的一次使用
+
+    结果（例如输出文件）由所有合并的请求和短期结果缓存共同引用，
+    引用计数归零时才调用清理函数释放输出文件
+    """
+
+    def __init__(self, value: Any, cleanup: Callable[[], None]):
+        self.value = value
+        self._cleanup = cleanup
+        self.refs = 0
+        self.expires = 0.0
+
+    def _release(self):
+        self.refs -= 1
+        if self.refs <= 0:
+            try:
+                self._cleanup()
+            except Exception as e:
+                api_logger.warning(f"释放合并请求的结果失败: {str(e)}")
+
+
+class SingleFlight:
+    """
+    相同请求合并（single-flight）
+
+    同一个键同时只执行一次：第一个请求在独立的任务中执行，之后到达的相同请求等待该任务并共享结果，
+    发起请求的客户端断开也不会中断其他等待者。完成的结果再保留一小段时间，
+    客户端重试或紧接着到达的相同请求直接复用。失败的结果不保留。
+    所有方法都在事件循环线程中调用。
+    """
+
+    def __init__(self, ttl: float, max_results: int):
+        # 保留时间至少1秒，保证等待者在结果被清理前取得引用
+        self.ttl = max(ttl, 1.0)
+        self.max_results = max_results
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._results: "OrderedDict[str, Lease]" = OrderedDict()
+
+    async def _run(self, key: str, fn: Flight) -> Lease:
+        try:
+            value, cleanup = await fn()
+            lease = Lease(value, cleanup)
+            # 短期结果缓存持有一个引用
+            lease.refs = 1
+            lease.expires = time.monotonic() + self.ttl
+            self._results[key] = lease
+            asyncio.get_running_loop().call_later(self.ttl + 0.1, self.prune)
+            while len(self._results) > max(self.max_results, 1):
+                _, oldest = self._results.popitem(last=False)
+                oldest._release()
+            return lease
+        finally:
+            self._inflight.pop(key, None)
+
+    @staticmethod
+    def _consume_exception(task: asyncio.Future):
+        # 所有等待者都已取消时，避免"异常未被获取"的警告
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, fn: Flight) -> Tuple[Lease, bool]:
+        """
+        执行或合并一个请求
+
+        返回:
+            Tuple[Lease, bool]: (结果, 是否与其他请求共享)，使用完毕后需调用release
+        """
+        if not SINGLEFLIGHT_ENABLED:
+            value, cleanup = await fn()
+            lease = Lease(value, cleanup)
+            lease.refs = 1
+            return lease, False
+
+        self.prune()
+        lease = self._results.get(key)
+        if lease is not None:
+            COALESCED.inc(result="cached")
+            lease.refs += 1
+            self._results.move_to_end(key)
+            return lease, True
+
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, fn))
+            task.add_done_callback(self._consume_exception)
+            self._inflight[key] = task
+            COALESCED.inc(result="leader")
+        else:
+            COALESCED.inc(result="coalesced")
+            api_logger.info(f"合并相同的进行中请求: {key[:12]}")
+        lease = await asyncio.shield(task)
+        lease.refs += 1
+        return lease, shared
+
+    def release(self, lease: Optional[Lease]):
+        """释放一次使用"""
+        if lease is not None:
+            lease._release()
+
+    def prune(self):
+        """清理过期的结果"""
+        now = time.monotonic()
+        for key in [key for key, lease in self._results.items() if lease.expires <= now]:
+            self._results.pop(key)._release()
+
+    def clear(self):
+        """清空保留的结果，在服务关闭时调用"""
+        while self._results:
+            _, lease = self._results.popitem()
+            lease._release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"inflight": len(self._inflight), "results": len(self._results)}
+
+
+# 全局转换请求合并实例
+conversions = SingleFlight(SINGLEFLIGHT_RESULT_TTL, SINGLEFLIGHT_MAX_RESULTS)
+
+
+def _collect_metrics():
+    """进行中的合并请求数和保留的结果数"""
+    stats = conversions.stats()
+    return [
+        snapshot_gauge("singleflight_inflight", "进行中的转换请求数（合并后）", {(): stats["inflight"]}),
+        snapshot_gauge("singleflight_results", "短期保留的转换结果数", {(): stats["results"]})
+    ]
+
+
+register_collector(_collect_metrics)
@@ -1,21 +1,54 @@
 import os
+import re
 import uuid
-import importlib.util
-import sys
-from typing import Dict, Any, Optional, Tuple
-import requests
-from dotenv import load_dotenv
+import codecs
+import shutil
+from typing import Dict, Any, List, Optional, Tuple
 from .logger import script_logger
 from .models import APIConfig
-
-# 加载环境变量
-load_dotenv()
+from .script_cache import script_cache, make_cache_key, SCRIPT_CACHE_ENABLED
+from .pipeline import run_io, run_exec
+from .llm_client import post_chat_completion, stream_chat_completion
+from .progress import (
+    Progress, STAGE_GENERATING, STAGE_CODE_READY, STAGE_CACHED, STAGE_VALIDATING, STAGE_REPAIRING,
+    STAGE_EXECUTING, STAGE_WRITTEN
+)
+from .sandbox import sandbox_pool, SANDBOX_ENABLED, SandboxOutputLimit
+from .sandbox_worker import convert_file, MODE_FILE, MODE_LINES
+from .sharding import should_shard, run_sharded
+from .converters import match_converter, save_builtin_script, run_builtin, resolve_builtin
+from .metrics import span, observe_stage, BYTES_IN, BYTES_OUT
+from .lifecycle import lifecycle, shard_path, quota_from_env, DirQuota
+from .memory_io import memory_io
+from .sampling import sample_file, sample_text, estimate_tokens, tokens_for, SAMPLE_GAP
+from .compression import open_plain, iter_plain_chunks, is_gzip_path, is_gzip_stream, StreamDecoder, GZIP_SUFFIX
+from .mapped_io import mapped, file_encoding, iter_text_chunks, transcode_to_utf8
+from .validation import (
+    validate_script, check_syntax, needs_repair, build_repair_payload, ScriptValidationError, VALIDATION_ENABLED
+)
 
 # 目录配置
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", "outputs")
 SCRIPTS_DIR = "scripts"
 
+# 流式处理配置
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 1024 * 1024))  # 上传落盘和结果回传的分块大小（字节）
+ECHO_STREAM_MIN_BYTES = int(os.getenv("ECHO_STREAM_MIN_BYTES", 1024 * 1024))  # 转换结果达到该大小时流式返回JSON
+INPUT_TRANSCODE = os.getenv("INPUT_TRANSCODE", "true").lower() == "true"  # 上传的非UTF-8文件是否在落盘时转为UTF-8
+
+# 各目录的磁盘配额：上传和输出文件默认保留1天，脚本默认保留30天
+lifecycle.manage(UPLOAD_DIR, quota_from_env("UPLOAD", 10 * 1024 ** 3, 24 * 3600, 100000))
+lifecycle.manage(OUTPUT_DIR, quota_from_env("OUTPUT", 10 * 1024 ** 3, 24 * 3600, 100000))
+# 生成的脚本保存在哈希前缀子目录中，只清理这些脚本，顶层随代码库提交的基准测试脚本保留
+lifecycle.manage(SCRIPTS_DIR, quota_from_env("SCRIPTS", 1024 ** 3, 30 * 24 * 3600, 10000, suffix=".py",
+                                             shards_only=True))
+# 固定的缓存脚本不会被清理
+lifecycle.add_protector(script_cache.pinned_paths)
+# 内存文件正常情况下在请求结束时删除，这里只清理进程异常退出后残留的文件
+if memory_io.available:
+    lifecycle.manage(memory_io.directory, DirQuota(max_age=3600))
+
 def create_dirs():
     """创建必要的目录"""
     for dir_path in [UPLOAD_DIR, OUTPUT_DIR, SCRIPTS_DIR]:
@@ -23,73 +56,160 @@ def create_dirs():
         script_logger.debug(f"创建目录: {dir_path}")
 
 def save_uploaded_file(file_content: bytes, filename: Optional[str] = None) -> str:
-    """保存上传的文件并返回文件路径"""
+    """保存上传的文件并返回文件路径（已被引用计数保护，使用完毕后需调用lifecycle.release）"""
     if not filename:
         # 生成唯一文件名
         filename = f"{uuid.uuid4().hex}.txt"
     
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    file_path = shard_path(UPLOAD_DIR, filename)
+    lifecycle.acquire(file_path)
     with open(file_path, "wb") as f:
         f.write(file_content)
     
     script_logger.debug(f"保存上传的文件: {file_path}, 大小: {len(file_content)} 字节")
     return file_path
 
-def save_text_content(text: str) -> str:
-    """将文本内容保存为文件并返回文件路径"""
-    filename = f"{uuid.uuid4().hex}.txt"
-    file_path = os.path.join(UPLOAD_DIR, filename)
+def save_upload_stream(fileobj, filename: Optional[str] = None, hasher=None) -> Tuple[str, int]:
+    """
+    将上传的文件对象分块写入磁盘，内存占用与文件大小无关
     
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(text)
+    gzip压缩的上传文件（.gz文件名或gzip魔数开头）在写入的同时解压，脚本总是读取原始内容。
+    返回的文件已被引用计数保护，使用完毕后需调用lifecycle.release。
+    提供hasher（hashlib对象）时在写入的同时计算（解压后）内容的哈希。
+    INPUT_TRANSCODE开启时，按开头内容检测出不是UTF-8编码（如GBK、带BOM的UTF-16）的文件
+    在写入的同时转为UTF-8，哈希按转换后的内容计算
     
-    script_logger.debug(f"保存文本内容到文件: {file_path}, 长度: {len(text)} 字符")
-    return file_path
+    返回:
+        Tuple[str, int]: (文件路径, 文件大小)
+    """
+    # 加上唯一前缀，避免并发上传同名文件互相覆盖
+    name = os.path.basename(filename) if filename else "upload.txt"
+    fileobj.seek(0)
+    decoder = None
+    if is_gzip_stream(fileobj):
+        decoder = StreamDecoder("gzip")
+        if name.endswith(GZIP_SUFFIX):
+            name = name[:-len(GZIP_SUFFIX)] or "upload.txt"
+    file_path = shard_path(UPLOAD_DIR, f"{uuid.uuid4().hex}_{name}")
+    lifecycle.acquire(file_path)
+    
+    encoding = "utf-8"
+    try:
+        with span("upload"):
+            with open(file_path, "wb") as f:
+                chunks = iter(lambda: fileobj.read(STREAM_CHUNK_SIZE), b"")
+                if decoder is not None:
+                    chunks = _decompress_chunks(decoder, chunks)
+                if INPUT_TRANSCODE:
+                    encoding, chunks = transcode_to_utf8(chunks)
+                if hasher is None and decoder is None and encoding == "utf-8":
+                    # 无需处理的上传：写入用于检测编码的第一块后直接复制剩余部分
+                    for chunk in chunks:
+                        f.write(chunk)
+                        break
+                    shutil.copyfileobj(fileobj, f, STREAM_CHUNK_SIZE)
+                else:
+                    for chunk in chunks:
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        f.write(chunk)
+            file_size = os.path.getsize(file_path)
+    except Exception:
+        lifecycle.release(file_path)
+        raise
+    BYTES_IN.inc(file_size, source="upload")
+    
+    notes = ("（已解压）" if decoder else "") + (f"（已从{encoding}转为UTF-8）" if encoding != "utf-8" else "")
+    script_logger.debug(f"分块保存上传的文件: {file_path}, 大小: {file_size} 字节{notes}")
+    return file_path, file_size
 
-def read_file_content(file_path: str) -> str:
-    """读取文件内容"""
-    with open(file_path, "r", encoding="utf-8") as f:
-        content = f.read()
-    script_logger.debug(f"读取文件内容: {file_path}, 长度: {len(content)} 字符")
-    return content
+def _decompress_chunks(decoder, chunks):
+    for chunk in chunks:
+        yield decoder.decompress(chunk)
+    yield decoder.flush()
+
+def read_sample(file_path: str) -> str:
+    """从文件的头部、中部、尾部和结构不同的行中采样示例数据，内存占用与文件大小无关"""
+    with span("sample"):
+        sample = sample_file(file_path)
+    script_logger.debug(f"采样示例数据: {file_path}, 长度: {len(sample)} 字符")
+    return sample
+
+def iter_file_chunks(file_path: str, chunk_size: int = STREAM_CHUNK_SIZE):
+    """分块读取文件，用于流式返回结果"""
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
 
-def generate_python_script(sample_data: str, format_instruction: str, api_config: APIConfig) -> Tuple[str, str]:
+def save_text_content(text, in_memory: bool = False) -> str:
     """
-    调用大模型API生成Python脚本
+    将文本内容（str，或已编码为UTF-8的bytes）保存为文件并返回文件路径
+    （已被引用计数保护，使用完毕后需调用lifecycle.release）
     
-    参数:
-        sample_data: 示例数据
-        format_instruction: 格式转换要求
-        api_config: API配置
-        
-    返回:
-        Tuple[str, str]: (脚本路径, 脚本内容)
+    in_memory为True时写入内存文件系统，使用完毕后需调用memory_io.discard删除；
+    内存文件系统空间不足时退回磁盘
     """
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_config.api_key}"
-    }
+    data = text if isinstance(text, bytes) else text.encode("utf-8")
+    filename = f"{uuid.uuid4().hex}.txt"
+    file_path = None
+    if in_memory and memory_io.available:
+        file_path = memory_io.path(filename)
+        try:
+            with open(file_path, "wb") as f:
+                f.write(data)
+            lifecycle.acquire(file_path)
+        except OSError as e:
+            script_logger.warning(f"写入内存文件失败，改为写入磁盘: {str(e)}")
+            memory_io.discard(file_path)
+            file_path = None
+    if file_path is None:
+        file_path = shard_path(UPLOAD_DIR, filename)
+        lifecycle.acquire(file_path)
+        with span("upload"):
+            with open(file_path, "wb") as f:
+                f.write(data)
+    BYTES_IN.inc(len(data), source="text")
     
-    script_logger.info(f"使用模型 {api_config.model_name} 生成Python脚本")
-    # 构建提示词
-    prompt = f"""
-你是一个专业的文本格式转换专家。请根据用户的格式转换要求，生成一个Python脚本来转换文本。
+    script_logger.debug(f"保存文本内容到文件: {file_path}, 大小: {len(data)} 字节")
+    return file_path
 
-### 用户提供的示例数据：
-```
-{sample_data[:500]}  # 限制示例数据大小，防止token过多
-```
+def read_file_content(file_path: str) -> str:
+    """读取文件内容，压缩保存的文件透明解压，未压缩的文件按检测到的编码解码"""
+    with span("readback"):
+        if is_gzip_path(file_path):
+            with open_plain(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+        else:
+            encoding, bom = file_encoding(file_path)
+            with mapped(file_path, sequential=True) as buf, memoryview(buf) as view, view[bom:] as body:
+                content = codecs.decode(body, encoding, "replace")
+    script_logger.debug(f"读取文件内容: {file_path}, 长度: {len(content)} 字符")
+    return content
 
-### 格式转换要求：
-{format_instruction}
+def iter_text_content(file_path: str, chunk_size: int = STREAM_CHUNK_SIZE):
+    """分块解码文件内容，用于流式回传转换结果，内存占用与文件大小无关；压缩保存的文件透明解压"""
+    if not is_gzip_path(file_path):
+        yield from iter_text_chunks(file_path, chunk_size)
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    for chunk in iter_plain_chunks(file_path, chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
 
-### 要求：
+# 不同脚本约定对应的提示词要求和示例
+SCRIPT_CONTRACTS = {
+    MODE_FILE: """### 要求：
 1. 生成一个完整的Python脚本，脚本接受input_file和output_file两个参数
 2. 脚本应该从input_file读取内容，按照格式要求转换，并将结果写入output_file
 3. 脚本应该处理可能的异常情况
 4. 不要使用任何非标准库
 5. 只返回Python代码，不要包含任何解释或其他内容
 6. 确保代码可以直接运行
+7. 需要按字节扫描输入时，也可以在convert_text之外再定义convert_buffer(data, output_file)：data是输入文件内容
+   （UTF-8编码）的只读memoryview，用bytes(data[start:end])取出需要的片段；无法映射输入时仍会调用convert_text
 
 示例函数签名:
 ```python
@@ -103,12 +223,50 @@ if __name__ == "__main__":
         print("Usage: python script.py input_file output_file")
         sys.exit(1)
     convert_text(sys.argv[1], sys.argv[2])
+```""",
+    MODE_LINES: """### 要求：
+1. 生成一个完整的Python脚本，其中定义生成器函数convert_lines(lines)
+2. lines是输入文件逐行的迭代器（每行带有结尾换行符），输入文件可能有数GB大小
+3. 函数应该逐行处理，并用yield逐条产出转换后的行；不要一次性读取全部输入，也不要在内存中累积全部结果
+4. 如果转换需要表头等上下文，可以在函数内部保存少量状态
+5. 不要使用任何非标准库
+6. 只返回Python代码，不要包含任何解释或其他内容
+
+示例函数签名:
+```python
+def convert_lines(lines):
+    for line in lines:
+        # 实现单行转换逻辑
+        yield line
+```"""
+}
+
+def build_script_payload(
+    sample_data: str,
+    format_instruction: str,
+    api_config: APIConfig,
+    mode: str = MODE_FILE
+) -> Dict[str, Any]:
+    """构建生成脚本的大模型请求体"""
+    # 构建提示词
+    prompt = f"""
+你是一个专业的文本格式转换专家。请根据用户的格式转换要求，生成一个Python脚本来转换文本。
+
+### 用户提供的示例数据：
+```
+{sample_text(sample_data)}
 ```
+（示例数据可能取自输入的不同位置，"{SAMPLE_GAP}"表示此处省略了部分内容，不属于数据本身）
+
+### 格式转换要求：
+{format_instruction}
+
+{SCRIPT_CONTRACTS[mode]}
 
 请只返回完整的Python代码，不包含任何其他解释。
 """
     
-    payload = {
+    return {
         "model": api_config.model_name,
         "messages": [
             {"role": "system", "content": "你是一个专业的Python开发者，擅长文本处理和格式转换。"},
@@ -117,74 +275,320 @@ if __name__ == "__main__":
         "temperature": 0.3,
         "max_tokens": 2000
     }
+
+def lookup_cached_script(
+    sample_data: str,
+    format_instruction: str,
+    api_config: APIConfig,
+    mode: str = MODE_FILE
+) -> Tuple[Optional[str], Optional[Tuple[str, str]]]:
+    """
+    在脚本缓存中查找可复用的脚本
     
-    try:
-        script_logger.info("发送API请求生成脚本")
-        response = requests.post(api_config.api_url, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        # 从响应中提取生成的脚本内容
-        script_content = response.json()["choices"][0]["message"]["content"]
-        script_logger.info(f"成功接收到脚本内容，长度: {len(script_content)} 字符")
-        
-        # 删除可能的代码块标记
-        script_content = script_content.replace("```python", "").replace("```", "").strip()
-        
-        # 保存脚本
-        script_filename = f"format_script_{uuid.uuid4().hex}.py"
-        script_path = os.path.join(SCRIPTS_DIR, script_filename)
-        
+    返回:
+        Tuple: (缓存键, 命中时为(脚本路径, 脚本内容)，否则为None)
+    """
+    if not SCRIPT_CACHE_ENABLED:
+        return None, None
+    with span("cache_lookup"):
+        cache_key = make_cache_key(format_instruction, sample_data, api_config.model_name, mode)
+        entry = script_cache.get(cache_key)
+    if entry:
+        script_path = entry["script_path"]
+        lifecycle.touch(script_path)
+        script_logger.info(f"命中脚本缓存: {cache_key[:12]}, 脚本: {script_path}")
+        return cache_key, (script_path, read_file_content(script_path))
+    script_logger.info(f"未命中脚本缓存: {cache_key[:12]}")
+    return cache_key, None
+
+
+class ScriptStream:
+    """
+    逐段拼接大模型的流式输出
+
+    代码块（```python ... ```）一结束就认为脚本已经完整，不再等待之后的说明文字，
+    尽早开始语法检查和试运行。收到的内容按段保存，每段只在尚未查找过的尾部（加上可能
+    跨段的几个字符）中查找代码块的起止标记，总耗时与内容长度成正比
+    """
+
+    _OPEN_FENCE = re.compile(r"```[\w+-]*[ \t]*\n")
+    _CLOSE_FENCE = "\n```"
+
+    def __init__(self, progress: Progress):
+        self.progress = progress
+        self._chunks: List[str] = []
+        self._chars = 0
+        self._bytes = 0
+        self._end: Optional[int] = None
+        # 尚未查找完的尾部及其在全部内容中的起始位置
+        self._pending = ""
+        self._pending_at = 0
+        self._in_code = False
+
+    @property
+    def text(self) -> str:
+        """已收到的内容；代码块结束后截止到结束标记"""
+        text = "".join(self._chunks)
+        return text if self._end is None else text[:self._end]
+
+    def _advance(self, start: int):
+        """丢弃尾部中start之前已经查找过的部分"""
+        self._pending = self._pending[start:]
+        self._pending_at += start
+
+    def feed(self, delta: str) -> bool:
+        """追加一段内容，代码块结束时返回True"""
+        self._chunks.append(delta)
+        self._chars += len(delta)
+        self._bytes += len(delta.encode("utf-8"))
+        self.progress.tokens(self._chars, tokens_for(self._chars, self._bytes))
+        self._pending += delta
+        if not self._in_code:
+            match = self._OPEN_FENCE.search(self._pending)
+            if match is None:
+                # 只保留可能是未收完的起始标记的部分（之后还没有换行的```）
+                fence = self._pending.rfind("```")
+                if fence < 0 or "\n" in self._pending[fence:]:
+                    fence = max(0, len(self._pending) - 2)
+                self._advance(fence)
+                return False
+            self._in_code = True
+            # 保留起始标记末尾的换行，空代码块也能找到结束标记
+            self._advance(match.end() - 1)
+        end = self._pending.find(self._CLOSE_FENCE)
+        if end < 0:
+            self._advance(max(0, len(self._pending) - len(self._CLOSE_FENCE) + 1))
+            return False
+        self._end = self._pending_at + end + len(self._CLOSE_FENCE)
+        text = self.text
+        self.progress.tokens(len(text), estimate_tokens(text), final=True)
+        self.progress.emit(STAGE_CODE_READY)
+        return True
+
+
+def save_generated_script(response_data: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    从大模型响应中提取脚本并保存到脚本目录
+    
+    脚本通过验证后才由promote_script写入缓存
+    
+    返回:
+        Tuple[str, str]: (脚本路径, 脚本内容)
+    """
+    # 从响应中提取生成的脚本内容
+    script_content = response_data["choices"][0]["message"]["content"]
+    script_logger.info(f"成功接收到脚本内容，长度: {len(script_content)} 字符")
+    
+    # 删除可能的代码块标记
+    script_content = script_content.replace("```python", "").replace("```", "").strip()
+    
+    # 保存脚本
+    script_filename = f"format_script_{uuid.uuid4().hex}.py"
+    script_path = shard_path(SCRIPTS_DIR, script_filename)
+    
+    with span("script_save"):
         with open(script_path, "w", encoding="utf-8") as f:
             f.write(script_content)
+    
+    script_logger.info(f"脚本已保存到: {script_path}")
+    return script_path, script_content
+
+def promote_script(
+    cache_key: Optional[str],
+    script_path: str,
+    format_instruction: str,
+    api_config: APIConfig,
+    mode: str = MODE_FILE
+):
+    """把通过验证的脚本写入缓存，供后续相同请求复用"""
+    if cache_key:
+        script_cache.put(
+            cache_key,
+            script_path,
+            instruction=format_instruction,
+            model_name=api_config.model_name,
+            mode=mode
+        )
+
+def discard_script(script_path: str):
+    """删除未通过验证、已被修复版本替代的脚本"""
+    try:
+        os.remove(script_path)
+    except OSError:
+        pass
+
+async def generate_python_script_async(
+    sample_data: str,
+    format_instruction: str,
+    api_config: APIConfig,
+    use_cache: bool = True,
+    mode: str = MODE_FILE,
+    progress: Optional[Progress] = None,
+    input_file: Optional[str] = None
+) -> Tuple[str, str]:
+    """
+    调用大模型API生成Python脚本（异步版本）
+    
+    大模型请求通过共享连接池异步发送，缓存查找和脚本保存在I/O线程池中执行，
+    试运行验证在执行线程池中进行，整个过程不阻塞事件循环。
+    提供progress时以流式方式生成脚本并上报各阶段的进度，代码块结束后立即检查语法。
+    sample_data取自文件时应提供input_file，试运行使用该文件开头的完整行，而不是截断拼接过的示例
+    
+    返回:
+        Tuple[str, str]: (脚本路径, 脚本内容)
+    """
+    builtin = match_converter(format_instruction)
+    if builtin:
+        script_logger.info(f"格式要求匹配内置转换器: {builtin[0].name}，跳过大模型调用")
+        if progress:
+            progress.emit(STAGE_CACHED, source="builtin", name=builtin[0].name)
+        return await run_io(save_builtin_script, builtin[0], builtin[1], SCRIPTS_DIR)
+    
+    cache_key = None
+    if use_cache:
+        cache_key, cached = await run_io(lookup_cached_script, sample_data, format_instruction, api_config, mode)
+        if cached:
+            if progress:
+                progress.emit(STAGE_CACHED, source="cache")
+            return cached
+    
+    script_logger.info(f"使用模型 {api_config.model_name} 生成Python脚本")
+    with span("prompt"):
+        payload = build_script_payload(sample_data, format_instruction, api_config, mode)
+    
+    try:
+        attempt = 0
+        while True:
+            script_logger.info("发送API请求生成脚本")
+            if progress is None:
+                response_data = await post_chat_completion(api_config, payload)
+            else:
+                progress.emit(STAGE_GENERATING, attempt=attempt)
+                stream = ScriptStream(progress)
+                response_data = await stream_chat_completion(api_config, payload, stream.feed)
+                # 结束代码块的那段内容可能带有之后的说明文字，以截断到代码块结尾的内容为准
+                response_data["choices"][0]["message"]["content"] = stream.text
+            script_path, script_content = await run_io(save_generated_script, response_data)
+            if not VALIDATION_ENABLED:
+                await run_io(promote_script, cache_key, script_path, format_instruction, api_config, mode)
+                return script_path, script_content
+            
+            # 语法错误直接请求修复；语法正确时在示例数据上试运行，未通过时把错误信息反馈给大模型修复
+            failure = check_syntax(script_content, script_path)
+            if failure is None:
+                if progress:
+                    progress.emit(STAGE_VALIDATING)
+                failure = await run_exec(
+                    validate_script, script_path, sample_data, format_instruction, mode, input_file
+                )
+            if not needs_repair(failure, attempt):
+                break
+            if progress:
+                progress.emit(STAGE_REPAIRING, attempt=attempt + 1, message=failure.message)
+            await run_io(discard_script, script_path)
+            payload = build_repair_payload(payload, script_content, failure)
+            attempt += 1
         
-        script_logger.info(f"脚本已保存到: {script_path}")
+        if failure is None:
+            await run_io(promote_script, cache_key, script_path, format_instruction, api_config, mode)
         return script_path, script_content
         
+    except ScriptValidationError:
+        raise
     except Exception as e:
         script_logger.error(f"调用API生成脚本失败: {str(e)}", exc_info=True)
         raise Exception(f"调用API生成脚本失败: {str(e)}")
 
-def execute_python_script(script_path: str, input_file: str) -> str:
+def execute_python_script(script_path: str, input_file: str, mode: str = MODE_FILE, in_memory: bool = False,
+                          progress: Optional[Progress] = None) -> str:
     """
     执行生成的Python脚本进行格式转换
     
+    输出文件已被引用计数保护，使用完毕后需调用lifecycle.release
+    
     参数:
         script_path: 脚本路径
         input_file: 输入文件路径
+        mode: 脚本约定，见generate_python_script_async
+        in_memory: 是否把输出文件放在内存文件系统中，使用完毕后需调用memory_io.discard删除。
+            输出超过memory_io.output_max_bytes时改为输出到磁盘重新执行；未启用沙箱时无法限制
+            生成脚本的输出大小，只有内置转换器的输出放在内存中
+        progress: 提供时上报开始执行、执行中已写入的字节数和输出文件大小
         
     返回:
         str: 输出文件路径
     """
+    # 生成输出文件路径
+    output_filename = f"output_{uuid.uuid4().hex}.txt"
+    if in_memory and memory_io.available and (SANDBOX_ENABLED or resolve_builtin(script_path)):
+        output_file = memory_io.path(output_filename)
+    else:
+        output_file = shard_path(OUTPUT_DIR, output_filename)
+    lifecycle.acquire(output_file)
     try:
-        # 生成输出文件路径
-        output_filename = f"output_{uuid.uuid4().hex}.txt"
-        output_file = os.path.join(OUTPUT_DIR, output_filename)
-        
         script_logger.info(f"准备执行脚本: {script_path}")
         script_logger.info(f"输入文件: {input_file}")
         script_logger.info(f"输出文件: {output_file}")
+        if progress:
+            progress.emit(STAGE_EXECUTING)
+            progress.watch(output_file)
         
-        # 加载脚本模块
-        spec = importlib.util.spec_from_file_location("format_module", script_path)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        
-        # 执行转换函数
-        script_logger.info("开始执行转换函数")
-        module.convert_text(input_file, output_file)
-        script_logger.info("转换函数执行完成")
+        with span("execute"):
+            if run_builtin(script_path, input_file, output_file):
+                # 内置转换器是受信任的代码，直接在服务进程内执行
+                script_logger.info("内置转换器执行完成")
+            elif SANDBOX_ENABLED and should_shard(input_file) and run_sharded(script_path, input_file, output_file, mode):
+                # 大文件在记录边界处切分，各分片在沙箱工作进程中并行执行后按顺序合并
+                script_logger.info("分片并行执行完成")
+            elif SANDBOX_ENABLED:
+                # 在沙箱工作进程中执行，受CPU时间、内存和墙钟时间限制
+                script_logger.info("开始在沙箱中执行转换函数")
+                output_limit = memory_io.output_max_bytes if memory_io.is_memory_path(output_file) else 0
+                try:
+                    result = sandbox_pool.run(script_path, input_file, output_file, mode,
+                                              max_output_bytes=output_limit)
+                except SandboxOutputLimit:
+                    # 内存中的输出超出上限，改为输出到磁盘重新执行
+                    memory_io.record_spill()
+                    script_logger.warning(f"输出超过内存I/O上限 {output_limit} 字节，改为输出到磁盘重新执行")
+                    lifecycle.release(output_file)
+                    memory_io.discard(output_file)
+                    output_file = shard_path(OUTPUT_DIR, output_filename)
+                    lifecycle.acquire(output_file)
+                    if progress:
+                        progress.watch(output_file)
+                    result = sandbox_pool.run(script_path, input_file, output_file, mode)
+                observe_stage("compile", result.get("load_seconds", 0.0))
+                script_logger.info(
+                    f"转换函数执行完成，工作进程: {result['pid']}, 耗时: {result['elapsed']:.4f}s, "
+                    f"模块缓存命中: {result.get('module_cache_hit', False)}"
+                )
+            else:
+                # 在服务进程内加载脚本模块并执行转换函数
+                script_logger.info("开始执行转换函数")
+                _, load_seconds = convert_file(script_path, input_file, output_file, mode)
+                observe_stage("compile", load_seconds)
+                script_logger.info("转换函数执行完成")
         
         # 验证输出文件是否存在
         if os.path.exists(output_file):
             file_size = os.path.getsize(output_file)
+            BYTES_OUT.inc(file_size)
             script_logger.info(f"输出文件已生成: {output_file}, 大小: {file_size} 字节")
+            if progress:
+                progress.emit(STAGE_WRITTEN, bytes=file_size)
         else:
             script_logger.warning(f"输出文件不存在: {output_file}")
         
         return output_file
     except Exception as e:
+        lifecycle.release(output_file)
+        memory_io.discard(output_file)
         script_logger.error(f"执行脚本失败: {str(e)}", exc_info=True)
         raise Exception(f"执行脚本失败: {str(e)}")
+    finally:
+        if progress:
+            progress.watch(None)
 
 def get_file_content(file_path: str) -> Tuple[str, str]:
     """
@@ -194,7 +598,6 @@ def get_file_content(file_path: str) -> Tuple[str, str]:
         Tuple[str, str]: (文件内容, 文件名)
     """
     filename = os.path.basename(file_path)
-    with open(file_path, "r", encoding="utf-8") as f:
-        content = f.read()
+    content = read_file_content(file_path)
     script_logger.debug(f"获取文件内容: {file_path}, 文件名: {filename}, 内容长度: {len(content)}")
-    return content, filename 
\ No newline at end of file
+    return content, filename 
@@ -0,0 +1,238 @@
+import os
+import re
+import json
+import tempfile
+import traceback
+from typing import Any, Dict, Optional, Tuple
+from .logger import script_logger
+from .sandbox import sandbox_pool, SANDBOX_ENABLED, SandboxError, SandboxOutputLimit
+from .sandbox_worker import run_job, MODE_FILE
+from .memory_io import memory_io
+from .mapped_io import mapped, detect_encoding, decode_window, ENCODING_DETECT_BYTES
+from .metrics import counter, span
+
+# 脚本验证配置
+VALIDATION_ENABLED = os.getenv("VALIDATION_ENABLED", "true").lower() == "true"
+VALIDATION_MAX_REPAIRS = int(os.getenv("VALIDATION_MAX_REPAIRS", 2))  # 验证失败后请求大模型修复的最多次数
+VALIDATION_CPU_TIME = int(os.getenv("VALIDATION_CPU_TIME", 5))  # 试运行CPU时间上限（秒）
+VALIDATION_WALL_TIME = float(os.getenv("VALIDATION_WALL_TIME", 10))  # 试运行墙钟时间上限（秒）
+VALIDATION_INPUT_BYTES = int(os.getenv("VALIDATION_INPUT_BYTES", 64 * 1024))  # 试运行输入取自真实输入开头的最大长度
+
+# 反馈给大模型的错误信息最大长度
+MAX_FEEDBACK_CHARS = 2000
+
+# 脚本捕获异常后打印的错误信息
+_ERROR_OUTPUT = re.compile(r"Traceback|Error|Exception|错误|失败|异常")
+# 格式要求中以JSON为目标格式的表述，例如"转换为JSON"、"输出json"
+_JSON_TARGET = re.compile(r"(为|成|到|输出|生成)\s*json", re.I)
+# 只输出满足条件的部分内容的格式要求，例如"提取所有URL"、"过滤掉空行"，输入中可能恰好没有需要输出的内容
+_FILTER_INSTRUCTION = re.compile(r"提取|抽取|筛选|过滤|只保留|仅保留|删除|去掉|查找|找出|匹配|extract|filter|grep|find|match", re.I)
+
+VALIDATIONS = counter("script_validations_total", "生成脚本的验证结果", ["result"])
+REPAIRS = counter("script_repairs_total", "请求大模型修复脚本的次数")
+
+
+class ValidationFailure:
+    """
+    脚本试运行未通过
+
+    kind为error时脚本执行出错或输出不符合要求；kind为suspect时脚本正常结束，但输出为空或打印了错误信息，
+    可能是脚本吞掉了异常，也可能示例数据中恰好没有需要输出的内容，修复次数用尽后仍允许使用；
+    kind为inconclusive时试运行输入只是真实输入的开头一段，脚本在其上出错不能说明脚本有问题
+    （例如多行JSON文档被截断），不请求修复，脚本照常使用但不写入缓存
+    """
+
+    def __init__(self, kind: str, message: str, traceback_text: str = "", output: str = ""):
+        self.kind = kind
+        self.message = message
+        self.traceback_text = traceback_text
+        self.output = output
+
+    def feedback(self) -> str:
+        """组织反馈给大模型的错误描述"""
+        parts = [self.message]
+        if self.traceback_text:
+            parts.append(f"错误堆栈：\n{self.traceback_text[-MAX_FEEDBACK_CHARS:]}")
+        if self.output:
+            parts.append(f"脚本输出：\n{self.output[-MAX_FEEDBACK_CHARS:]}")
+        return "\n\n".join(parts)
+
+
+class ScriptValidationError(Exception):
+    """脚本多次修复后仍未通过验证"""
+
+
+def _temp_path(suffix: str) -> str:
+    # 未启用沙箱时无法限制试运行的输出大小，不放在内存中
+    directory = memory_io.directory if memory_io.available and SANDBOX_ENABLED else None
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix="validate_", dir=directory)
+    os.close(fd)
+    return path
+
+
+def _check_output(output_file: str, format_instruction: str, captured: str) -> Optional[ValidationFailure]:
+    """
+    检查试运行的输出：是合法文本、不包含被吞掉的异常，目标格式为JSON时能够解析
+
+    试运行输入非空（空输入不试运行），输出为空时只有格式要求为筛选类（提取、过滤等）才视为通过
+    """
+    if not os.path.exists(output_file):
+        return ValidationFailure("error", "脚本执行结束，但没有生成输出文件", output=captured)
+    with open(output_file, "rb") as f:
+        data = f.read()
+    if not data.strip():
+        if captured and _ERROR_OUTPUT.search(captured):
+            return ValidationFailure("suspect", "脚本输出为空，并打印了错误信息，可能在内部捕获了异常", output=captured)
+        if _FILTER_INSTRUCTION.search(format_instruction):
+            script_logger.info("脚本在试运行输入上没有输出，格式要求为筛选类，视为通过")
+            return None
+        return ValidationFailure("suspect", "脚本执行结束，但输出为空", output=captured)
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return ValidationFailure("error", "输出不是合法的UTF-8文本")
+    if captured and _ERROR_OUTPUT.search(captured):
+        return ValidationFailure("suspect", "脚本打印了错误信息，可能在内部捕获了异常，导致部分数据没有正确转换", output=captured)
+    if _JSON_TARGET.search(format_instruction):
+        try:
+            json.loads(text)
+        except ValueError:
+            lines = [line for line in text.splitlines() if line.strip()]
+            try:
+                for line in lines:
+                    json.loads(line)
+            except ValueError as e:
+                return ValidationFailure("error", f"格式要求输出JSON，但输出无法解析为JSON: {str(e)}")
+    return None
+
+
+def check_syntax(script_content: str, script_path: str = "<script>") -> Optional[ValidationFailure]:
+    """在服务进程内编译脚本检查语法，语法错误不需要进入沙箱试运行即可请求修复"""
+    try:
+        compile(script_content, script_path, "exec")
+    except (SyntaxError, ValueError) as e:
+        return ValidationFailure("error", f"脚本存在语法错误: {str(e)}", traceback.format_exc(limit=0))
+    return None
+
+
+def _head_of_text(text: str) -> Tuple[str, bool]:
+    """文本开头不超过VALIDATION_INPUT_BYTES个字符的完整行，返回(内容, 是否为完整输入)"""
+    if len(text) <= VALIDATION_INPUT_BYTES:
+        return text, True
+    head = text[:VALIDATION_INPUT_BYTES]
+    end = head.rfind("\n")
+    return (head[:end + 1] if end >= 0 else head), False
+
+
+def _head_of_file(input_file: str) -> Tuple[str, bool]:
+    """文件开头不超过VALIDATION_INPUT_BYTES字节的完整行（按检测到的编码解码），返回(内容, 是否为完整输入)"""
+    with mapped(input_file) as buf:
+        encoding, bom = detect_encoding(buf[:ENCODING_DETECT_BYTES])
+        size = len(buf)
+        if size - bom <= VALIDATION_INPUT_BYTES:
+            return decode_window(buf, bom, size, encoding), True
+        text = decode_window(buf, bom, bom + VALIDATION_INPUT_BYTES, encoding)
+    end = text.rfind("\n")
+    return (text[:end + 1] if end >= 0 else text), False
+
+
+def validate_script(script_path: str, sample_data: str, format_instruction: str,
+                    mode: str = MODE_FILE, input_file: Optional[str] = None) -> Optional[ValidationFailure]:
+    """
+    在真实输入的开头一段上试运行脚本
+
+    提供input_file时取该文件开头的完整行，否则取sample_data（文本请求的完整内容）开头的完整行。
+    不使用提示词中的示例：示例截断了过长的行，并拼接了不相邻的片段，正确的脚本在其上也可能出错。
+    试运行输入不是完整输入时，执行出错只记为inconclusive。
+    试运行与正式执行一样在沙箱中进行，但CPU和墙钟时间限制更短
+
+    返回:
+        Optional[ValidationFailure]: 通过时返回None
+    """
+    sample, complete = _head_of_file(input_file) if input_file else _head_of_text(sample_data)
+    if not sample.strip():
+        return None
+    failure = _run_sample(script_path, sample, format_instruction, mode)
+    if failure is not None and failure.kind == "error" and not complete:
+        script_logger.info(f"脚本在截取的输入开头上出错，无法判断脚本是否有问题: {failure.message}")
+        return ValidationFailure("inconclusive", failure.message, failure.traceback_text, failure.output)
+    return failure
+
+
+def _run_sample(script_path: str, sample: str, format_instruction: str, mode: str) -> Optional[ValidationFailure]:
+    """在沙箱中对试运行输入执行脚本并检查输出"""
+    with span("validate"):
+        input_file = _temp_path(".in")
+        output_file = _temp_path(".out")
+        os.remove(output_file)
+        try:
+            with open(input_file, "w", encoding="utf-8", newline="") as f:
+                f.write(sample)
+            if SANDBOX_ENABLED:
+                try:
+                    result = sandbox_pool.run(
+                        script_path, input_file, output_file, mode,
+                        cpu_time=VALIDATION_CPU_TIME,
+                        wall_time=VALIDATION_WALL_TIME,
+                        max_output_bytes=memory_io.output_max_bytes if memory_io.is_memory_path(output_file) else 0
+                    )
+                except SandboxOutputLimit as e:
+                    # 试运行输出放在内存中，超出上限不能说明脚本有问题
+                    return ValidationFailure("inconclusive", f"试运行输出超出大小限制: {str(e)}")
+                except SandboxError as e:
+                    return ValidationFailure("error", f"脚本执行失败: {str(e)}", e.traceback_text, e.output)
+            else:
+                result = run_job({
+                    "script_path": script_path,
+                    "input_file": input_file,
+                    "output_file": output_file,
+                    "mode": mode
+                })
+                if not result["ok"]:
+                    return ValidationFailure("error", f"脚本执行失败: {result['error']}",
+                                             result.get("traceback", ""), result.get("output", ""))
+            return _check_output(output_file, format_instruction, result.get("output", ""))
+        finally:
+            for path in (input_file, output_file):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def build_repair_payload(payload: Dict[str, Any], script_content: str, failure: ValidationFailure) -> Dict[str, Any]:
+    """在原有对话后追加上一次生成的脚本和试运行的错误信息，请求大模型修复"""
+    messages = list(payload["messages"]) + [
+        {"role": "assistant", "content": script_content},
+        {"role": "user", "content": f"""上面的脚本在输入数据的开头部分上试运行没有通过：
+
+{failure.feedback()}
+
+请修复问题并返回完整的Python脚本。不要用try/except吞掉异常后只打印错误信息，无法转换时应直接抛出异常。
+请只返回完整的Python代码，不包含任何其他解释。"""}
+    ]
+    return {**payload, "messages": messages}
+
+
+def needs_repair(failure: Optional[ValidationFailure], attempt: int) -> bool:
+    """
+    根据第attempt次（从0开始）试运行的结果决定是否请求修复
+
+    修复次数用尽时，执行出错的脚本抛出ScriptValidationError，不会在完整输入上执行；
+    可疑的脚本仍然返回给调用方使用，但不会写入缓存
+    """
+    if failure is None:
+        VALIDATIONS.inc(result="passed" if attempt == 0 else "repaired")
+        return False
+    if failure.kind == "inconclusive":
+        VALIDATIONS.inc(result="inconclusive")
+        return False
+    script_logger.warning(f"脚本试运行未通过（第 {attempt + 1} 次）: {failure.message}")
+    if attempt < VALIDATION_MAX_REPAIRS:
+        REPAIRS.inc()
+        return True
+    VALIDATIONS.inc(result=f"failed_{failure.kind}")
+    if failure.kind == "error":
+        raise ScriptValidationError(f"脚本经过 {attempt} 次修复仍未通过验证: {failure.message}")
+    script_logger.warning("修复次数已用尽，使用未通过验证的脚本，该脚本不会写入缓存")
+    return False
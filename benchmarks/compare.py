@@ -0,0 +1,95 @@
+"""
+对比两次基准测试的结果
+
+按 (接口, 负载, 输入大小, 并发度) 匹配场景，列出吞吐量、p50/p95/p99延迟、峰值内存和各阶段耗时的变化。
+指定 --threshold 时，吞吐量下降或p95延迟上升超过该百分比的场景视为性能回退，以非零状态码退出。
+
+用法:
+    python -m benchmarks.compare benchmarks/results/base.json benchmarks/results/new.json --threshold 10
+"""
+import sys
+import json
+import argparse
+from typing import Dict, Optional, Tuple
+
+Key = Tuple[str, str, str, int]
+
+
+def load(path: str) -> Dict[Key, dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    return {
+        (s["route"], s["workload"], s["size"], s["concurrency"]): s
+        for s in report["scenarios"]
+    }
+
+
+def change(old: float, new: float) -> Optional[float]:
+    """相对变化的百分比，基准为0时无法计算"""
+    if not old:
+        return None
+    return (new - old) / old * 100
+
+
+def _fmt_change(value: Optional[float]) -> str:
+    return "    n/a" if value is None else f"{value:+6.1f}%"
+
+
+def compare(base: Dict[Key, dict], new: Dict[Key, dict], threshold: Optional[float]) -> int:
+    """打印对比结果，返回性能回退的场景数"""
+    regressions = 0
+    print(f"{'接口':22} {'负载':9} {'大小':>5} {'并发':>4} {'吞吐量(req/s)':>24} "
+          f"{'p50(ms)':>22} {'p95(ms)':>22} {'p99(ms)':>22} {'峰值内存(MB)':>14}")
+    for key in sorted(set(base) & set(new)):
+        old, cur = base[key], new[key]
+        rps = change(old["throughput_rps"], cur["throughput_rps"])
+        columns = [f"{old['throughput_rps']:8.2f} -> {cur['throughput_rps']:8.2f} {_fmt_change(rps)}"]
+        p95 = None
+        for q in ("p50", "p95", "p99"):
+            a, b = old["latency_seconds"][q] * 1000, cur["latency_seconds"][q] * 1000
+            delta = change(a, b)
+            if q == "p95":
+                p95 = delta
+            columns.append(f"{a:7.1f}->{b:7.1f} {_fmt_change(delta)}")
+        rss = f"{old['server'].get('rss_peak_mb', '-')}->{cur['server'].get('rss_peak_mb', '-')}"
+        regressed = threshold is not None and (
+            (rps is not None and rps < -threshold) or (p95 is not None and p95 > threshold)
+        )
+        regressions += regressed
+        route, workload, size, concurrency = key
+        print(f"{route:22} {workload:9} {size:>5} {concurrency:>4} " + " ".join(columns)
+              + f" {rss:>14}" + ("  <- 回退" if regressed else ""))
+
+        # 每个请求的阶段耗时变化
+        old_stages = old["breakdown"]["per_request"]
+        new_stages = cur["breakdown"]["per_request"]
+        parts = [
+            f"{group} {old_stages.get(group, 0) * 1000:.1f}->{new_stages.get(group, 0) * 1000:.1f}ms"
+            for group in new_stages
+        ]
+        print(f"{'':22} 阶段: " + ", ".join(parts))
+
+    only_base = sorted(set(base) - set(new))
+    only_new = sorted(set(new) - set(base))
+    if only_base:
+        print(f"仅在基准结果中的场景: {len(only_base)}")
+    if only_new:
+        print(f"仅在新结果中的场景: {len(only_new)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比两次基准测试的结果")
+    parser.add_argument("base", help="基准结果JSON")
+    parser.add_argument("new", help="新结果JSON")
+    parser.add_argument("--threshold", type=float, help="吞吐量下降或p95上升超过该百分比时视为回退")
+    args = parser.parse_args()
+
+    regressions = compare(load(args.base), load(args.new), args.threshold)
+    if regressions:
+        print(f"{regressions} 个场景性能回退超过 {args.threshold}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
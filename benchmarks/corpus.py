@@ -0,0 +1,104 @@
+"""
+基准测试输入语料
+
+按固定随机种子生成1KB到1GB的文本文件，同一大小每次生成的内容完全相同，便于不同版本之间对比。
+内容混合了中英文段落、数字行、逗号分隔的字段、链接以及 【N、标题】 形式的小节标题，
+scripts/ 中保存的各个转换脚本都能在其上运行。
+
+用法:
+    python -m benchmarks.corpus --sizes 1K,1M,64M
+"""
+import os
+import random
+import argparse
+from typing import Iterator, List
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+CORPUS_SEED = 20240601
+DEFAULT_SIZES = "1K,64K,1M,16M"
+ALL_SIZES = "1K,64K,1M,16M,256M,1G"
+
+_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+_WORDS = [
+    "数据", "格式", "转换", "服务", "文件", "内容", "用户", "订单", "日期", "金额",
+    "status", "value", "name", "count", "total", "item", "price", "report", "level", "note"
+]
+
+
+def parse_size(size: str) -> int:
+    """解析1K、64M、1G形式的大小"""
+    size = size.strip().upper()
+    if size[-1:] in _UNITS:
+        return int(float(size[:-1]) * _UNITS[size[-1]])
+    return int(size)
+
+
+def parse_sizes(sizes: str) -> List[str]:
+    return [size.strip().upper() for size in sizes.split(",") if size.strip()]
+
+
+def _lines(rng: random.Random) -> Iterator[str]:
+    section = 0
+    while True:
+        kind = rng.random()
+        if kind < 0.02:
+            section += 1
+            yield f"【{section}、{rng.choice(_WORDS)}{rng.choice(_WORDS)}】\n"
+        elif kind < 0.2:
+            yield f"{rng.randint(0, 10 ** 6)}\n"
+        elif kind < 0.4:
+            fields = [rng.choice(_WORDS) for _ in range(rng.randint(3, 8))]
+            yield ",".join(fields) + f",{rng.randint(1, 9999)}\n"
+        elif kind < 0.45:
+            yield f"见 https://example.com/{rng.choice(_WORDS)}/{rng.randint(1, 99999)}\n"
+        elif kind < 0.5:
+            yield "\n"
+        else:
+            words = [rng.choice(_WORDS) for _ in range(rng.randint(4, 16))]
+            yield " ".join(words) + "\n"
+
+
+def generate(size: int, path: str, seed: int = CORPUS_SEED):
+    """生成指定大小（字节，按行截断到不超过该大小）的语料文件"""
+    rng = random.Random(seed)
+    temp_path = f"{path}.tmp"
+    written = 0
+    buffer = []
+    buffered = 0
+    with open(temp_path, "wb") as f:
+        for line in _lines(rng):
+            data = line.encode("utf-8")
+            if written + buffered + len(data) > size:
+                break
+            buffer.append(data)
+            buffered += len(data)
+            if buffered >= 1024 * 1024:
+                f.write(b"".join(buffer))
+                written += buffered
+                buffer, buffered = [], 0
+        f.write(b"".join(buffer))
+    os.replace(temp_path, path)
+
+
+def corpus_file(size: str, corpus_dir: str = CORPUS_DIR) -> str:
+    """返回指定大小的语料文件路径，不存在时生成"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    path = os.path.join(corpus_dir, f"corpus_{size}.txt")
+    if not os.path.exists(path):
+        generate(parse_size(size), path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成基准测试输入语料")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"逗号分隔的大小列表，全部大小为 {ALL_SIZES}")
+    parser.add_argument("--dir", default=CORPUS_DIR, help="语料目录")
+    args = parser.parse_args()
+    for size in parse_sizes(args.sizes):
+        path = corpus_file(size, args.dir)
+        print(f"{path}: {os.path.getsize(path)} 字节")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+"""
+转换服务的基准测试和压测
+
+启动模拟的大模型服务和一个独立工作目录中的转换服务，按给定的并发度请求 api/routes.py 中的各个接口，
+统计吞吐量、p50/p95/p99延迟、服务进程（含沙箱工作进程）的内存和CPU占用，
+并根据测试前后 /metrics 中各阶段耗时的差值给出 生成脚本 / 执行脚本 / 读写 的耗时分解。
+结果保存为JSON，可用 benchmarks/compare.py 与其他版本的结果对比。
+
+用法:
+    python -m benchmarks.run --routes format-file,download-output-file --sizes 1K,1M --concurrency 1,8
+    python -m benchmarks.run --cold            # 关闭脚本缓存、结果存储和相同请求合并
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional
+
+import httpx
+
+from .corpus import corpus_file, parse_sizes, parse_size, DEFAULT_SIZES
+from .workloads import select_workloads, Workload, SCRIPTS_DIR, DEFAULT_WORKLOAD
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+ROUTES = [
+    "format-text", "format-file", "download-output", "download-output-file",
+    "format-file-stream", "format-batch", "jobs-text", "jobs-file"
+]
+DEFAULT_ROUTES = "format-text,format-file,download-output-file,format-file-stream,jobs-file"
+
+# 冷启动测试关闭的缓存
+COLD_ENV = {
+    "SCRIPT_CACHE_ENABLED": "false",
+    "RESULT_STORE_ENABLED": "false",
+    "SINGLEFLIGHT_ENABLED": "false"
+}
+
+# 阶段归类：生成脚本、执行脚本、读写
+STAGE_GROUPS = {
+    "generation": ("cache_lookup", "prompt", "llm", "script_save", "validate"),
+    "execution": ("execute", "compile"),
+    "io": ("upload", "sample", "readback")
+}
+
+STAGE_METRIC = "formatter_stage_duration_seconds"
+BATCH_FILES = 4
+JOB_POLL_INTERVAL = 0.05
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_http(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"服务未能在 {timeout} 秒内启动: {url}")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """线性插值的百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class ProcessSampler:
+    """定期从/proc采样进程树（服务进程及其所有子进程）的常驻内存和CPU时间"""
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _tree(self) -> List[int]:
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "r") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        pids, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            stack.extend(children.get(pid, []))
+        return pids
+
+    @staticmethod
+    def _rss(pid: int) -> int:
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    @staticmethod
+    def _cpu(pid: int, include_reaped: bool) -> float:
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return 0.0
+        # utime、stime，以及已回收子进程的cutime、cstime
+        ticks = int(fields[11]) + int(fields[12])
+        if include_reaped:
+            ticks += int(fields[13]) + int(fields[14])
+        return ticks / CLOCK_TICKS
+
+    def cpu_seconds(self) -> float:
+        """进程树累计的CPU时间，包括已退出的沙箱工作进程"""
+        return sum(self._cpu(pid, pid == self.pid) for pid in self._tree())
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(sum(self._rss(pid) for pid in self._tree()))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self.samples = []
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+
+def parse_stage_metrics(text: str) -> Dict[str, Dict[str, float]]:
+    """从/metrics中取出各阶段耗时的总和与次数"""
+    stages: Dict[str, Dict[str, float]] = {}
+    for line in text.splitlines():
+        for suffix, field in (("_sum", "seconds"), ("_count", "count")):
+            prefix = f"{STAGE_METRIC}{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage = line[len(prefix):line.index('"', len(prefix))]
+                stages.setdefault(stage, {"seconds": 0.0, "count": 0})[field] = float(line.rsplit(" ", 1)[1])
+    return stages
+
+
+def stage_breakdown(before: Dict[str, Dict[str, float]], after: Dict[str, Dict[str, float]], requests: int) -> dict:
+    """计算测试期间各阶段耗时的差值，并按生成、执行、读写归类（均为每个请求的平均秒数）"""
+    stages = {}
+    for stage, values in after.items():
+        prev = before.get(stage, {"seconds": 0.0, "count": 0})
+        count = values["count"] - prev["count"]
+        if count <= 0:
+            continue
+        seconds = values["seconds"] - prev["seconds"]
+        stages[stage] = {"count": int(count), "seconds": round(seconds, 6), "mean": round(seconds / count, 6)}
+    groups = {}
+    grouped = set()
+    for group, names in STAGE_GROUPS.items():
+        groups[group] = round(sum(stages[name]["seconds"] for name in names if name in stages) / max(requests, 1), 6)
+        grouped.update(names)
+    groups["other"] = round(sum(v["seconds"] for k, v in stages.items() if k not in grouped) / max(requests, 1), 6)
+    return {"stages": stages, "per_request": groups}
+
+
+class Server:
+    """在临时工作目录中启动的模拟大模型服务和转换服务"""
+
+    def __init__(self, env: Dict[str, str], llm_delay: float, llm_sigma: float, scripts_dir: str):
+        self.env = env
+        self.llm_delay = llm_delay
+        self.llm_sigma = llm_sigma
+        self.scripts_dir = scripts_dir
+        self.workdir = None
+        self.processes: List[subprocess.Popen] = []
+        self.llm_url = None
+        self.base_url = None
+        self.pid = None
+
+    def start(self):
+        # 独立工作目录，避免基准测试的上传、输出和缓存混入仓库目录
+        self.workdir = tempfile.mkdtemp(prefix="formatter-bench-")
+        for name in ("static", "templates"):
+            os.symlink(os.path.join(REPO_DIR, name), os.path.join(self.workdir, name))
+        env = {**os.environ, "PYTHONPATH": REPO_DIR, **self.env}
+        log = open(os.path.join(self.workdir, "server.log"), "wb")
+
+        llm_port = _free_port()
+        self.processes.append(subprocess.Popen(
+            [sys.executable, "-m", "tools.mock_llm_server", "--port", str(llm_port),
+             "--delay", str(self.llm_delay), "--sigma", str(self.llm_sigma), "--scripts-dir", self.scripts_dir],
+            cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+        ))
+        self.llm_url = f"http://127.0.0.1:{llm_port}/v1/chat/completions"
+        _wait_http(f"http://127.0.0.1:{llm_port}/stats")
+
+        port = _free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+             "--app-dir", REPO_DIR],
+            cwd=self.workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        self.processes.append(server)
+        self.pid = server.pid
+        self.base_url = f"http://127.0.0.1:{port}"
+        _wait_http(f"{self.base_url}/metrics")
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+        if self.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class Driver:
+    """按路由构造请求并读完响应"""
+
+    def __init__(self, client: httpx.AsyncClient, llm_url: str, api_key: str, model: str):
+        self.client = client
+        self.api_config = {"api_key": api_key, "api_url": llm_url, "model_name": model}
+
+    def _form(self, instruction: str) -> dict:
+        return {"format_instruction": instruction, **self.api_config}
+
+    async def _read(self, response: httpx.Response) -> int:
+        size = 0
+        async for chunk in response.aiter_raw():
+            size += len(chunk)
+        if response.status_code >= 400:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        return size
+
+    async def _post(self, path: str, **kwargs) -> int:
+        async with self.client.stream("POST", f"/api/{path}", **kwargs) as response:
+            return await self._read(response)
+
+    async def _job(self, submit: httpx.Response) -> int:
+        if submit.status_code != 202:
+            raise RuntimeError(f"HTTP {submit.status_code}")
+        job_id = submit.json()["job_id"]
+        while True:
+            status = (await self.client.get(f"/api/jobs/{job_id}")).json()
+            if status["status"] == "succeeded":
+                break
+            if status["status"] in ("failed", "cancelled"):
+                raise RuntimeError(f"任务{status['status']}: {status.get('error')}")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+        async with self.client.stream("GET", f"/api/jobs/{job_id}/result") as response:
+            return await self._read(response)
+
+    async def request(self, route: str, workload: Workload, path: str, text: Optional[str]) -> int:
+        """发送一个请求，返回读取的响应字节数"""
+        instruction = workload.instruction
+        if route == "format-text":
+            return await self._post(route, json={
+                "content": text, "format_instruction": instruction, "api_config": self.api_config
+            })
+        if route == "download-output":
+            return await self._post(route, data={"content": text, **self._form(instruction)})
+        if route == "jobs-text":
+            return await self._job(await self.client.post("/api/jobs/text", json={
+                "content": text, "format_instruction": instruction, "api_config": self.api_config
+            }))
+        if route == "format-batch":
+            handles = [open(path, "rb") for _ in range(BATCH_FILES)]
+            try:
+                files = [("files", (f"part{i}.txt", f, "text/plain")) for i, f in enumerate(handles)]
+                return await self._post(route, data=self._form(instruction), files=files)
+            finally:
+                for f in handles:
+                    f.close()
+        with open(path, "rb") as f:
+            files = {"file": (os.path.basename(path), f, "text/plain")}
+            if route == "jobs-file":
+                return await self._job(await self.client.post("/api/jobs/file", data=self._form(instruction), files=files))
+            return await self._post(route, data=self._form(instruction), files=files)
+
+
+async def run_scenario(driver: Driver, sampler: Optional[ProcessSampler], route: str,
+                       workload: Workload, size: str, concurrency: int, requests: int, warmup: int) -> dict:
+    """以给定并发度发送requests个请求并汇总结果"""
+    path = corpus_file(size)
+    input_bytes = os.path.getsize(path)
+    text = None
+    if route in ("format-text", "download-output", "jobs-text"):
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+
+    for _ in range(warmup):
+        try:
+            await driver.request(route, workload, path, text)
+        except Exception as e:
+            print(f"预热请求失败 {route} / {workload.name} / {size}: {str(e)}", flush=True)
+
+    metrics_before = parse_stage_metrics((await driver.client.get("/metrics")).text)
+    cpu_before = sampler.cpu_seconds() if sampler else 0.0
+    if sampler:
+        sampler.start()
+
+    latencies: List[float] = []
+    errors: List[str] = []
+    received = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal received
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                received += await driver.request(route, workload, path, text)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(str(e) or type(e).__name__)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - started
+
+    server_stats = {}
+    if sampler:
+        sampler.stop()
+        cpu = sampler.cpu_seconds() - cpu_before
+        rss = sampler.samples or [0]
+        server_stats = {
+            "rss_peak_mb": round(max(rss) / 1024 ** 2, 1),
+            "rss_mean_mb": round(sum(rss) / len(rss) / 1024 ** 2, 1),
+            "cpu_seconds": round(cpu, 3),
+            "cpu_utilization": round(cpu / elapsed, 3) if elapsed else 0.0
+        }
+    metrics_after = parse_stage_metrics((await driver.client.get("/metrics")).text)
+
+    ok = len(latencies)
+    result = {
+        "route": route,
+        "workload": workload.name,
+        "size": size,
+        "input_bytes": input_bytes,
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": ok,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "duration_seconds": round(elapsed, 4),
+        "throughput_rps": round(ok / elapsed, 3) if elapsed else 0.0,
+        "throughput_mbps": round(ok * input_bytes / elapsed / 1024 ** 2, 3) if elapsed else 0.0,
+        "response_bytes": received,
+        "latency_seconds": {
+            "mean": round(sum(latencies) / ok, 6) if ok else 0.0,
+            "p50": round(percentile(latencies, 0.50), 6),
+            "p95": round(percentile(latencies, 0.95), 6),
+            "p99": round(percentile(latencies, 0.99), 6),
+            "max": round(max(latencies), 6) if ok else 0.0
+        },
+        "server": server_stats,
+        "breakdown": stage_breakdown(metrics_before, metrics_after, ok)
+    }
+    print(f"{route:22} {workload.name:9} {size:>5} c={concurrency:<3} ok={ok}/{requests} "
+          f"{result['throughput_rps']:8.2f} req/s  p50={result['latency_seconds']['p50'] * 1000:8.1f}ms "
+          f"p95={result['latency_seconds']['p95'] * 1000:8.1f}ms p99={result['latency_seconds']['p99'] * 1000:8.1f}ms "
+          f"rss={server_stats.get('rss_peak_mb', '-')}MB", flush=True)
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    env = dict(COLD_ENV) if args.cold else {}
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    server = None
+    base_url = args.base_url
+    llm_url = args.llm_url
+    pid = args.server_pid
+    if base_url is None:
+        server = Server(env, args.llm_delay, args.llm_sigma, args.scripts_dir)
+        server.start()
+        base_url, llm_url, pid = server.base_url, server.llm_url, server.pid
+
+    sampler = ProcessSampler(pid) if pid else None
+    scenarios = []
+    try:
+        limits = httpx.Limits(max_connections=max(args.concurrency) * 2)
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            driver = Driver(client, llm_url, args.api_key, args.model)
+            for route in args.routes:
+                for workload in args.workloads:
+                    if route == "format-file-stream" and not workload.supports_lines:
+                        print(f"跳过 {route} / {workload.name}: 该脚本不支持逐行转换", flush=True)
+                        continue
+                    for size in args.sizes:
+                        if route in ("format-text", "download-output", "jobs-text") \
+                                and parse_size(size) > args.max_text_size:
+                            print(f"跳过 {route} / {size}: 文本接口的请求体超过 --max-text-size", flush=True)
+                            continue
+                        for concurrency in args.concurrency:
+                            scenarios.append(await run_scenario(
+                                driver, sampler, route, workload, size, concurrency,
+                                args.requests, 0 if args.cold else args.warmup
+                            ))
+    finally:
+        if server:
+            server.stop()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "label": args.label,
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "cold": args.cold,
+            "env": env,
+            "llm_delay": args.llm_delay,
+            "llm_sigma": args.llm_sigma,
+            "requests": args.requests,
+            "warmup": 0 if args.cold else args.warmup
+        },
+        "scenarios": scenarios
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转换服务的基准测试")
+    parser.add_argument("--routes", default=DEFAULT_ROUTES, help=f"逗号分隔的接口，可选: {', '.join(ROUTES)}")
+    parser.add_argument("--workloads", default=DEFAULT_WORKLOAD, help="逗号分隔的负载名称，all表示全部")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="逗号分隔的输入大小，例如 1K,1M,1G")
+    parser.add_argument("--concurrency", default="1,8", help="逗号分隔的并发度")
+    parser.add_argument("--requests", type=int, default=20, help="每个场景的请求数")
+    parser.add_argument("--warmup", type=int, default=1, help="每个场景正式测试前的预热请求数")
+    parser.add_argument("--cold", action="store_true", help="冷启动测试：关闭脚本缓存、结果存储和相同请求合并，不预热")
+    parser.add_argument("--env", action="append", default=[], help="传给服务的额外环境变量，KEY=VALUE，可重复")
+    parser.add_argument("--llm-delay", type=float, default=0.2, help="模拟大模型服务的延迟中位数（秒）")
+    parser.add_argument("--llm-sigma", type=float, default=0.0, help="模拟大模型服务延迟的对数正态sigma")
+    parser.add_argument("--scripts-dir", default=SCRIPTS_DIR, help="固定负载脚本目录")
+    parser.add_argument("--max-text-size", default="64M", help="文本接口（JSON/表单正文）允许的最大输入")
+    parser.add_argument("--timeout", type=float, default=600, help="单个请求的超时时间（秒）")
+    parser.add_argument("--base-url", help="测试已运行的服务而不是自动启动，此时需要同时指定 --llm-url")
+    parser.add_argument("--llm-url", help="已运行服务使用的大模型接口地址")
+    parser.add_argument("--server-pid", type=int, help="已运行服务的进程号，用于采集内存和CPU")
+    parser.add_argument("--api-key", default="bench")
+    parser.add_argument("--model", default="mock")
+    parser.add_argument("--label", default="", help="结果标签，例如分支名")
+    parser.add_argument("--output", help="结果JSON文件，默认保存到 benchmarks/results/")
+    args = parser.parse_args()
+
+    args.routes = [route.strip() for route in args.routes.split(",") if route.strip()]
+    unknown = [route for route in args.routes if route not in ROUTES]
+    if unknown:
+        parser.error(f"未知的接口: {', '.join(unknown)}")
+    if args.base_url and not args.llm_url:
+        parser.error("指定 --base-url 时需要同时指定 --llm-url")
+    args.workloads = select_workloads(args.workloads, args.scripts_dir)
+    args.sizes = parse_sizes(args.sizes)
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    args.max_text_size = parse_size(args.max_text_size)
+
+    report = asyncio.run(run(args))
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = time.strftime("%Y%m%d-%H%M%S") + ("-cold" if args.cold else "") + (f"-{args.label}" if args.label else "")
+        output = os.path.join(RESULTS_DIR, f"{name}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+基准测试的固定负载
+
+scripts/ 中保存的每个转换脚本是一个固定负载：格式要求中带上 [workload:<名称>] 标记，
+模拟的大模型服务（tools/mock_llm_server.py --scripts-dir scripts）据此原样返回该脚本，
+这样每次测试执行的转换逻辑相同，结果只反映服务本身的变化。
+另有一个默认负载 upper，使用模拟服务的默认脚本（转为大写，支持逐行转换）。
+"""
+import os
+import glob
+from typing import Dict, List
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+DEFAULT_WORKLOAD = "upper"
+
+
+class Workload:
+    """一个固定负载：名称、发送的格式要求以及是否支持逐行转换"""
+
+    def __init__(self, name: str, instruction: str, supports_lines: bool):
+        self.name = name
+        self.instruction = instruction
+        self.supports_lines = supports_lines
+
+
+def load_workloads(scripts_dir: str = SCRIPTS_DIR) -> Dict[str, Workload]:
+    """列出所有可用的负载，脚本负载以文件名中uuid的前8位命名"""
+    workloads = {
+        DEFAULT_WORKLOAD: Workload(DEFAULT_WORKLOAD, f"把文本转为大写 [workload:{DEFAULT_WORKLOAD}]", True)
+    }
+    for path in sorted(glob.glob(os.path.join(scripts_dir, "format_script_*.py"))):
+        name = os.path.basename(path)[len("format_script_"):][:8]
+        with open(path, "r", encoding="utf-8") as f:
+            supports_lines = "def convert_lines" in f.read()
+        workloads[name] = Workload(name, f"按固定脚本转换 [workload:{name}]", supports_lines)
+    return workloads
+
+
+def select_workloads(names: str, scripts_dir: str = SCRIPTS_DIR) -> List[Workload]:
+    """按逗号分隔的名称选择负载，all表示全部"""
+    workloads = load_workloads(scripts_dir)
+    if names == "all":
+        return list(workloads.values())
+    selected = []
+    for name in names.split(","):
+        name = name.strip()
+        if name not in workloads:
+            raise ValueError(f"未知的负载: {name}，可用负载: {', '.join(workloads)}")
+        selected.append(workloads[name])
+    return selected
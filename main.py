@@ -5,13 +5,21 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
-from dotenv import load_dotenv
+from fastapi.responses import PlainTextResponse, JSONResponse
 from api.routes import router
 from api.utils import create_dirs
-from api.logger import app_logger, LoggerMiddleware
-
-# 加载环境变量
-load_dotenv()
+from api.pipeline import shutdown_pipeline, run_io
+from api.llm_client import close_client
+from api.sandbox import sandbox_pool, SANDBOX_ENABLED
+from api.jobs import job_scheduler, job_store
+from api.incremental import source_store
+from api.lifecycle import lifecycle
+from api.singleflight import conversions
+from api.shared_store import shared_store
+from api.logger import app_logger, LoggerMiddleware, shutdown_logging
+from api.compression import CompressionMiddleware
+from api.metrics import render_metrics
+from api.health import health
 
 # 创建应用
 app = FastAPI(
@@ -20,6 +28,9 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# 添加传输压缩中间件（请求体解压、按Accept-Encoding压缩响应）
+app.add_middleware(CompressionMiddleware)
+
 # 添加日志中间件
 app.add_middleware(LoggerMiddleware)
 
@@ -47,16 +58,67 @@ async def index(request: Request):
     app_logger.info("访问主页")
     return templates.TemplateResponse("index.html", {"request": request})
 
+# Prometheus指标，采集时会读取数据库和目录统计，在I/O线程池中进行
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(await run_io(render_metrics), media_type="text/plain; version=0.0.4")
+
+# 存活检查：进程能处理请求即返回200
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    return health.liveness()
+
+# 就绪检查：启动完成、没有在排空且各组件正常时返回200，否则返回503
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    ready, checks = health.readiness()
+    return JSONResponse(
+        {"status": "ready" if ready else "not_ready", "pid": os.getpid(), "checks": checks},
+        status_code=200 if ready else 503
+    )
+
+# 就绪检查项
+if SANDBOX_ENABLED:
+    health.add_check("sandbox", lambda: sandbox_pool.stats()["idle"] + sandbox_pool.stats()["busy"] > 0)
+health.add_check("jobs", lambda: job_scheduler.running)
+
 # 启动时创建必要的目录
 @app.on_event("startup")
 async def startup_event():
     app_logger.info("服务启动，创建必要的目录")
     create_dirs()
+    if SANDBOX_ENABLED:
+        sandbox_pool.start()
+    await job_scheduler.start()
+    await lifecycle.start()
+    health.mark_ready()
+
+def prepare_fork():
+    """
+    启动器在派生工作进程之前调用：关闭主进程在预加载时打开的数据库连接和连接池，
+    工作进程在第一次使用时各自重新打开，不与主进程共用
+    """
+    job_store.close()
+    source_store.close()
+    shared_store.close()
+    lifecycle.close()
 
 # 关闭时记录日志
 @app.on_event("shutdown")
 async def shutdown_event():
+    health.mark_draining()
     app_logger.info("服务关闭")
+    await lifecycle.stop()
+    await job_scheduler.stop()
+    conversions.clear()
+    await close_client()
+    shutdown_pipeline()
+    sandbox_pool.shutdown()
+    job_store.close()
+    source_store.close()
+    shared_store.close()
+    lifecycle.close()
+    shutdown_logging()
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
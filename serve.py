@@ -0,0 +1,224 @@
+"""
+生产环境启动器
+
+主进程只导入（预加载）一次应用，绑定监听端口后派生（fork）多个工作进程，工作进程共用同一个
+监听套接字。派生出的工作进程不需要重新导入模块，启动和异常退出后的重启只需要几十毫秒。
+已安装uvloop和httptools时使用它们作为事件循环和HTTP解析器。
+
+收到SIGTERM时，每个工作进程先标记为排空（/readyz返回503）并继续处理请求DRAIN_DELAY秒，
+等负载均衡摘除后再停止接收新连接，最多再等待DRAIN_TIMEOUT秒让进行中的请求完成；
+超过期限仍未退出的工作进程被强制终止。
+
+用法:
+    python serve.py --workers 4 --port 8000
+开发环境仍使用 python main.py（自动重载）
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import importlib.util
+from typing import Dict, Tuple
+
+# 先加载.env，下面的配置和应用模块都从环境变量读取
+import api  # noqa: F401
+
+# 启动器配置
+WORKERS = int(os.getenv("WORKERS", os.cpu_count() or 1))  # 工作进程数
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+BACKLOG = int(os.getenv("BACKLOG", 2048))  # 监听队列长度
+DRAIN_DELAY = float(os.getenv("DRAIN_DELAY", 5))  # 收到SIGTERM后继续处理请求的时间（秒），等待负载均衡摘除
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 30))  # 停止接收连接后等待进行中请求完成的最长时间（秒）
+RESPAWN_BACKOFF_MAX = float(os.getenv("RESPAWN_BACKOFF_MAX", 5))  # 工作进程反复启动失败时的最长重启间隔（秒）
+
+# 已安装时使用更快的事件循环和HTTP解析器
+LOOP = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+HTTP = "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def configure_workers(workers: int):
+    """
+    多个工作进程共用本机资源：未显式配置时，把沙箱进程数和脚本执行并发数按CPU核数平分，
+    并让任务调度器和磁盘清理知道任务库和文件目录由多个进程共用；必须在导入应用之前设置
+    """
+    share = str(max(1, (os.cpu_count() or 1) // workers))
+    os.environ.setdefault("SANDBOX_WORKERS", share)
+    os.environ.setdefault("EXEC_CONCURRENCY", share)
+    os.environ["JOB_STORE_SHARED"] = "true"
+    os.environ["LIFECYCLE_SHARED"] = "true"
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def build_server(app, drain_delay: float, drain_timeout: float):
+    """
+    在主进程中创建并加载服务配置（导入协议实现、包装中间件），
+    工作进程派生后直接运行，不再重复这部分工作
+    """
+    import uvicorn
+    from api.health import health
+
+    class DrainingServer(uvicorn.Server):
+        """收到SIGTERM后先排空DRAIN_DELAY秒再停止接收连接；再次收到信号或SIGINT时立即停止"""
+
+        drain_started = None
+
+        def handle_exit(self, sig, frame):
+            # 信号处理函数中只记录时间，标记排空和写日志在事件循环中进行（最多延迟一个周期0.1秒）
+            if sig == signal.SIGTERM and self.drain_started is None and drain_delay > 0:
+                self.drain_started = time.monotonic()
+                return
+            super().handle_exit(sig, frame)
+
+        async def on_tick(self, counter: int) -> bool:
+            if self.drain_started is not None:
+                health.mark_draining()
+                if time.monotonic() - self.drain_started >= drain_delay:
+                    self.should_exit = True
+            return await super().on_tick(counter)
+
+    config = uvicorn.Config(
+        app,
+        loop=LOOP,
+        http=HTTP,
+        lifespan="on",
+        access_log=False,  # 访问日志由应用的日志中间件记录
+        timeout_graceful_shutdown=drain_timeout
+    )
+    config.load()
+    return DrainingServer(config)
+
+
+def run_worker(server, sock: socket.socket, slot: int):
+    """在派生出的工作进程中运行服务，直到收到退出信号"""
+    from api.health import health
+    from api.metrics import set_worker
+
+    health.reset()
+    set_worker(str(slot))
+    server.run(sockets=[sock])
+
+
+class Master:
+    """主进程：派生工作进程，退出后重新派生，收到SIGTERM/SIGINT时通知全部工作进程排空后退出"""
+
+    def __init__(self, app, sock: socket.socket, workers: int, drain_delay: float, drain_timeout: float):
+        self.server = build_server(app, drain_delay, drain_timeout)
+        self.sock = sock
+        self.workers = workers
+        self.drain_delay = drain_delay
+        self.drain_timeout = drain_timeout
+        self.children: Dict[int, Tuple[int, float]] = {}  # pid -> (序号, 派生时间)
+        self.failures: Dict[int, int] = {}  # 每个序号连续启动失败的次数
+        self.stopping = False
+
+    def spawn(self, slot: int):
+        pid = os.fork()
+        if pid == 0:
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM):
+                signal.signal(sig, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(self.server, self.sock, slot)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                from api.logger import shutdown_logging
+                shutdown_logging()
+                os._exit(code)
+        self.children[pid] = (slot, time.monotonic())
+
+    def _on_stop(self, sig, frame):
+        # 信号处理函数中只转发信号，不写日志
+        if self.stopping:
+            return
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        signal.alarm(int(self.drain_delay + self.drain_timeout) + 10)
+
+    def _on_deadline(self, sig, frame):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        from api.logger import app_logger
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGALRM, self._on_deadline)
+        for slot in range(self.workers):
+            self.spawn(slot)
+        app_logger.info(f"已启动 {self.workers} 个工作进程，事件循环: {LOOP}，HTTP解析: {HTTP}")
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            if pid not in self.children:
+                continue
+            slot, spawned_at = self.children.pop(pid)
+            if self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            app_logger.warning(f"工作进程 {pid} 退出，状态码: {code}，重新派生")
+            # 刚启动就退出视为启动失败，连续失败时逐步拉长重启间隔
+            if time.monotonic() - spawned_at < 1:
+                self.failures[slot] = self.failures.get(slot, 0) + 1
+                time.sleep(min(RESPAWN_BACKOFF_MAX, 0.1 * 2 ** self.failures[slot]))
+            else:
+                self.failures[slot] = 0
+            if not self.stopping:
+                self.spawn(slot)
+        app_logger.info("全部工作进程已退出")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生产环境启动器：预加载应用并派生多个工作进程")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="工作进程数")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--drain-delay", type=float, default=DRAIN_DELAY, help="收到SIGTERM后继续处理请求的秒数")
+    parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT, help="等待进行中请求完成的最长秒数")
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    configure_workers(workers)
+    started = time.perf_counter()
+    import main as application
+    from api.jobs import job_store
+    from api.logger import app_logger
+
+    # 此时还没有工作进程，上次运行中断的执行中任务全部重新排队
+    job_store.recover()
+    application.prepare_fork()
+    sock = bind_socket(args.host, args.port)
+    app_logger.info(
+        f"应用预加载耗时: {(time.perf_counter() - started) * 1000:.0f}ms，监听: {args.host}:{args.port}"
+    )
+    Master(application.app, sock, workers, args.drain_delay, args.drain_timeout).run()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
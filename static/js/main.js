@@ -75,6 +75,7 @@ async function handleTextFormSubmit() {
     const textResult = document.getElementById('text-result');
     const scriptContent = document.getElementById('script-content');
     const downloadTextBtn = document.getElementById('download-text-btn');
+    const textProgress = document.getElementById('text-progress');
     
     if (!content || !formatInstruction || !apiKey || !apiUrl || !modelName) {
         alert('请填写所有必填字段');
@@ -84,8 +85,11 @@ async function handleTextFormSubmit() {
     try {
         textLoader.style.display = 'block';
         textResultContainer.style.display = 'none';
+        textProgress.innerHTML = '';
+        textProgress.style.display = 'block';
         
-        const response = await fetch('/api/format-text', {
+        // 带进度的接口逐条推送生成、验证、执行各阶段的进度，最后推送转换结果
+        const data = await fetchWithProgress('/api/format-text/events', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -99,31 +103,11 @@ async function handleTextFormSubmit() {
                     model_name: modelName
                 }
             })
-        });
-        
-        const data = await response.json();
+        }, textProgress);
         
-        if (response.ok) {
-            // 限制展示的文本长度
-            const MAX_DISPLAY_LENGTH = 5000;
-            const originalContent = data.output_content;
-            let displayContent = originalContent;
-            
-            if (originalContent.length > MAX_DISPLAY_LENGTH) {
-                displayContent = originalContent.substring(0, MAX_DISPLAY_LENGTH) + 
-                    `\n\n... 内容过长，仅显示前${MAX_DISPLAY_LENGTH}个字符，完整内容请点击下载按钮 ...`;
-            }
-            
-            // 存储完整内容，但只显示部分
-            textResult.setAttribute('data-full-content', originalContent);
-            textResult.textContent = displayContent;
-            
-            scriptContent.textContent = data.script_content;
-            textResultContainer.style.display = 'block';
-            downloadTextBtn.style.display = 'block';
-        } else {
-            alert(`错误: ${data.message}`);
-        }
+        showFormatResult(data, textResult, scriptContent);
+        textResultContainer.style.display = 'block';
+        downloadTextBtn.style.display = 'block';
     } catch (error) {
         alert(`请求失败: ${error.message}`);
     } finally {
@@ -143,6 +127,7 @@ async function handleFileFormSubmit() {
     const fileResult = document.getElementById('file-result');
     const fileScriptContent = document.getElementById('file-script-content');
     const downloadFileBtn = document.getElementById('download-file-btn');
+    const fileProgress = document.getElementById('file-progress');
     
     if (!fileInput.files[0] || !formatInstruction || !apiKey || !apiUrl || !modelName) {
         alert('请选择文件并填写所有必填字段');
@@ -152,6 +137,8 @@ async function handleFileFormSubmit() {
     try {
         fileLoader.style.display = 'block';
         fileResultContainer.style.display = 'none';
+        fileProgress.innerHTML = '';
+        fileProgress.style.display = 'block';
         
         const formData = new FormData();
         formData.append('file', fileInput.files[0]);
@@ -160,34 +147,14 @@ async function handleFileFormSubmit() {
         formData.append('api_url', apiUrl);
         formData.append('model_name', modelName);
         
-        const response = await fetch('/api/format-file', {
+        const data = await fetchWithProgress('/api/format-file/events', {
             method: 'POST',
             body: formData
-        });
-        
-        const data = await response.json();
+        }, fileProgress);
         
-        if (response.ok) {
-            // 限制展示的文本长度
-            const MAX_DISPLAY_LENGTH = 5000;
-            const originalContent = data.output_content;
-            let displayContent = originalContent;
-            
-            if (originalContent.length > MAX_DISPLAY_LENGTH) {
-                displayContent = originalContent.substring(0, MAX_DISPLAY_LENGTH) + 
-                    `\n\n... 内容过长，仅显示前${MAX_DISPLAY_LENGTH}个字符，完整内容请点击下载按钮 ...`;
-            }
-            
-            // 存储完整内容，但只显示部分
-            fileResult.setAttribute('data-full-content', originalContent);
-            fileResult.textContent = displayContent;
-            
-            fileScriptContent.textContent = data.script_content;
-            fileResultContainer.style.display = 'block';
-            downloadFileBtn.style.display = 'block';
-        } else {
-            alert(`错误: ${data.message}`);
-        }
+        showFormatResult(data, fileResult, fileScriptContent);
+        fileResultContainer.style.display = 'block';
+        downloadFileBtn.style.display = 'block';
     } catch (error) {
         alert(`请求失败: ${error.message}`);
     } finally {
@@ -195,6 +162,135 @@ async function handleFileFormSubmit() {
     }
 }
 
+// 展示转换结果，限制展示的文本长度，完整内容保存在data-full-content中供下载
+function showFormatResult(data, resultElement, scriptElement) {
+    const MAX_DISPLAY_LENGTH = 5000;
+    const originalContent = data.output_content;
+    let displayContent = originalContent;
+    
+    if (originalContent.length > MAX_DISPLAY_LENGTH) {
+        displayContent = originalContent.substring(0, MAX_DISPLAY_LENGTH) + 
+            `\n\n... 内容过长，仅显示前${MAX_DISPLAY_LENGTH}个字符，完整内容请点击下载按钮 ...`;
+    }
+    
+    resultElement.setAttribute('data-full-content', originalContent);
+    resultElement.textContent = displayContent;
+    scriptElement.textContent = data.script_content;
+}
+
+// 发送请求并读取Server-Sent Events响应：进度事件显示在progressList中，返回转换结果，出错时抛出异常
+async function fetchWithProgress(url, options, progressList) {
+    const response = await fetch(url, options);
+    if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.detail || data.message || `HTTP ${response.status}`);
+    }
+    
+    let result = null;
+    let failure = null;
+    await readEvents(response, (name, data) => {
+        if (name === 'progress') {
+            renderProgress(progressList, data);
+        } else if (name === 'result') {
+            result = data;
+        } else if (name === 'error') {
+            failure = data.message;
+        }
+    });
+    if (failure || !result) {
+        throw new Error(failure || '连接中断，未收到转换结果');
+    }
+    return result;
+}
+
+// 逐条解析Server-Sent Events消息
+async function readEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let searchFrom = 0;
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        let index;
+        // 较大的结果分多次到达，只在新到达的部分中查找消息结尾
+        while ((index = buffer.indexOf('\n\n', searchFrom)) >= 0) {
+            const block = buffer.slice(0, index);
+            buffer = buffer.slice(index + 2);
+            searchFrom = 0;
+            let name = 'message';
+            const dataLines = [];
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    name = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    dataLines.push(line.slice(5).replace(/^ /, ''));
+                }
+            });
+            if (dataLines.length) {
+                onEvent(name, JSON.parse(dataLines.join('\n')));
+            }
+        }
+        searchFrom = Math.max(0, buffer.length - 1);
+    }
+}
+
+// 格式化字节数
+function formatBytes(bytes) {
+    if (bytes >= 1024 * 1024) {
+        return `${(bytes / 1024 / 1024).toFixed(1)} MB`;
+    }
+    if (bytes >= 1024) {
+        return `${(bytes / 1024).toFixed(1)} KB`;
+    }
+    return `${bytes} B`;
+}
+
+// 进度事件的显示文字
+function describeProgress(event) {
+    switch (event.stage) {
+        case 'uploaded':
+            return `文件已上传（${formatBytes(event.bytes)}）`;
+        case 'generating':
+            return event.attempt ? `正在请求大模型修复脚本（第${event.attempt}次）...` : '正在请求大模型生成脚本...';
+        case 'tokens':
+            return `已收到约 ${event.tokens} 个token（${event.chars} 个字符）`;
+        case 'code_ready':
+            return '代码块已完整，检查语法';
+        case 'cached':
+            return event.source === 'builtin' ? `使用内置转换器: ${event.name}` : '使用缓存的脚本';
+        case 'validating':
+            return '正在示例数据上试运行脚本...';
+        case 'repairing':
+            return `试运行未通过: ${event.message}`;
+        case 'executing':
+            return '正在执行转换...';
+        case 'writing':
+            return `已写入 ${formatBytes(event.bytes)}`;
+        case 'written':
+            return `转换完成，输出 ${formatBytes(event.bytes)}`;
+        default:
+            return event.stage;
+    }
+}
+
+// 显示进度事件：token数和写入字节数在同一行更新，其余阶段各占一行
+function renderProgress(progressList, event) {
+    const text = `[${event.elapsed.toFixed(1)}s] ${describeProgress(event)}`;
+    const last = progressList.lastElementChild;
+    if (last && last.dataset.stage === event.stage && (event.stage === 'tokens' || event.stage === 'writing')) {
+        last.textContent = text;
+        return;
+    }
+    const item = document.createElement('li');
+    item.dataset.stage = event.stage;
+    item.textContent = text;
+    progressList.appendChild(item);
+}
+
 // 下载转换后的文本
 function downloadFormattedText() {
     const textResult = document.getElementById('text-result');
@@ -0,0 +1,37 @@
+"""
+测试环境
+
+api中的各模块在导入时读取环境变量并创建全局实例（任务库、共享存储、脚本目录等），
+因此在收集测试之前把工作目录切换到临时目录，并关闭沙箱、内存I/O、后台磁盘清理和控制台日志。
+命中统计每次立即写回共享存储，LRU顺序不受批量写回间隔影响
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="formatter-tests-")
+
+os.environ.update({
+    "DATA_DIR": os.path.join(WORK_DIR, "data"),
+    "LOG_DIR": os.path.join(WORK_DIR, "logs"),
+    "SHARED_STORE_PATH": os.path.join(WORK_DIR, "data", "shared_store.db"),
+    "SCRIPT_CACHE_INDEX": os.path.join(WORK_DIR, "script_cache.json"),
+    "SANDBOX_ENABLED": "false",
+    "MEMORY_IO_ENABLED": "false",
+    "LIFECYCLE_ENABLED": "false",
+    "CONSOLE_OUTPUT": "false",
+    "LOG_QUEUE_ENABLED": "false",
+    "SHARED_STORE_FLUSH_INTERVAL": "0",
+})
+sys.path.insert(0, ROOT)
+# 脚本、上传和输出目录是相对路径，全部落在临时目录中
+os.chdir(WORK_DIR)
+
+
+@pytest.fixture
+def run():
+    """在新的事件循环中运行协程"""
+    return asyncio.run
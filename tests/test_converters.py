@@ -0,0 +1,67 @@
+import pytest
+from api.converters import match_converter, render_script, save_builtin_script, resolve_builtin, run_builtin
+
+
+@pytest.mark.parametrize("instruction, name, params", [
+    ("将CSV格式转换为JSON，第一行作为键名", "csv_to_json", {}),
+    ("请把 csv 转成 json。", "csv_to_json", {}),
+    ("将JSON转换为CSV", "json_to_csv", {}),
+    ("将空格分隔的文本转换为逗号分隔的CSV", "swap_delimiter", {"src": " ", "dst": ","}),
+    ("把制表符分隔的数据转为竖线分隔", "swap_delimiter", {"src": "\t", "dst": "|"}),
+    ("只保留前40行", "truncate_lines", {"n": 40}),
+    ("提取文本中的所有URL链接", "extract_urls", {}),
+    ("将文本中的日期格式从MM/DD/YYYY转换为YYYY-MM-DD", "reformat_dates", {"src": "mm/dd/yyyy", "dst": "yyyy-mm-dd"}),
+])
+def test_match(instruction, name, params):
+    converter, matched = match_converter(instruction)
+    assert converter.name == name
+    assert matched == params
+
+
+@pytest.mark.parametrize("instruction", [
+    "将CSV转换为JSON，并按年龄排序",
+    "只保留前40行中包含ERROR的行",
+    "将日期从MM/MM/YYYY转换为YYYY-MM-DD",
+    "把数据整理成表格",
+])
+def test_no_match_with_extra_requirements(instruction):
+    assert match_converter(instruction) is None
+
+
+def _convert(func, tmp_path, content: str, **params) -> str:
+    src, dst = tmp_path / "in.txt", tmp_path / "out.txt"
+    src.write_text(content, encoding="utf-8")
+    func(str(src), str(dst), **params)
+    return dst.read_text(encoding="utf-8")
+
+
+def test_converters_output(tmp_path):
+    converter, params = match_converter("将空格分隔的文本转换为逗号分隔的CSV")
+    assert _convert(converter.func, tmp_path, "a  b c\nd e,f g\n", **params) == 'a,b,c\nd,"e,f",g\n'
+    converter, params = match_converter("将日期从MM/DD/YYYY转换为YYYY-MM-DD")
+    assert _convert(converter.func, tmp_path, "on 1/2/2024, 13/40/2024\n", **params) == "on 2024-01-02, 13/40/2024\n"
+    converter, params = match_converter("提取所有URL")
+    assert _convert(converter.func, tmp_path, "见 https://a.com/x。和 http://b.org/y.\n", **params) == \
+        "https://a.com/x\nhttp://b.org/y\n"
+
+
+def test_rendered_script_matches_builtin(tmp_path):
+    converter, params = match_converter("只保留前2行")
+    namespace = {"__name__": "builtin_script"}
+    exec(compile(render_script(converter, params), "<builtin>", "exec"), namespace)
+    content = "1\n2\n3\n"
+    assert _convert(lambda i, o: namespace["convert_text"](i, o), tmp_path, content) == \
+        _convert(converter.func, tmp_path, content, **params) == "1\n2\n"
+
+
+def test_saved_script_resolves_to_builtin(tmp_path):
+    converter, params = match_converter("只保留前3行")
+    script_path, content = save_builtin_script(converter, params, str(tmp_path))
+    assert script_path.startswith(str(tmp_path)) and open(script_path, encoding="utf-8").read() == content
+    assert save_builtin_script(converter, params, str(tmp_path))[0] == script_path
+    assert resolve_builtin(script_path) == (converter, params)
+    src, dst = tmp_path / "in.txt", tmp_path / "out.txt"
+    src.write_text("a\nb\nc\nd\n", encoding="utf-8")
+    assert run_builtin(script_path, str(src), str(dst))
+    assert dst.read_text(encoding="utf-8") == "a\nb\nc\n"
+    assert not run_builtin(str(tmp_path / "other.py"), str(src), str(dst))
@@ -0,0 +1,89 @@
+import gzip
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from starlette.background import BackgroundTask
+from api.routes import download_response, _parse_range, _etag_matches
+
+CONTENT = b"0123456789abcdefghij"
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-4", (0, 4)),
+    ("bytes=5-", (5, 19)),
+    ("bytes=-3", (17, 19)),
+    ("bytes=10-100", (10, 19)),
+    ("bytes=-100", (0, 19)),
+    ("bytes=20-", None),
+    ("bytes=5-2", None),
+    ("bytes=-0", None),
+    ("bytes=0-1,3-4", (0, 19)),
+    ("items=0-4", (0, 19)),
+    ("bytes=a-b", (0, 19)),
+])
+def test_parse_range(header, expected):
+    assert _parse_range(header, len(CONTENT)) == expected
+
+
+def test_etag_matches():
+    assert _etag_matches('"abc"', '"abc"')
+    assert _etag_matches('W/"abc"', '"abc"')
+    assert _etag_matches('"x", W/"abc"', '"abc"')
+    assert _etag_matches("*", '"abc"')
+    assert not _etag_matches('"abcd"', '"abc"')
+
+
+@pytest.fixture
+def client(tmp_path):
+    plain = tmp_path / "out.txt"
+    plain.write_bytes(CONTENT)
+    stored = tmp_path / "stored.txt.gz"
+    stored.write_bytes(gzip.compress(CONTENT))
+    app = FastAPI()
+
+    @app.get("/plain")
+    async def get_plain(request: Request):
+        return download_response(request, str(plain), "out.txt", None, BackgroundTask(lambda: None))
+
+    @app.get("/stored")
+    async def get_stored(request: Request):
+        return download_response(request, str(stored), "out.txt", "k" * 64, BackgroundTask(lambda: None))
+
+    return TestClient(app)
+
+
+def test_conditional_requests(client):
+    response = client.get("/plain")
+    assert response.status_code == 200 and response.content == CONTENT
+    etag = response.headers["etag"]
+    assert client.get("/plain", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/plain", headers={"If-None-Match": '"other"'}).status_code == 200
+    last_modified = response.headers["last-modified"]
+    assert client.get("/plain", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+
+def test_range_request(client):
+    response = client.get("/plain", headers={"Range": "bytes=2-5"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[2:6]
+    assert response.headers["content-range"] == f"bytes 2-5/{len(CONTENT)}"
+
+
+def test_stored_result_uses_key_etag_and_gzip(client):
+    response = client.get("/stored", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == 'W/"' + "k" * 32 + '"'
+    assert response.content == CONTENT
+    assert client.get("/stored", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+
+def test_stored_result_range_is_decompressed(client):
+    response = client.get("/stored", headers={"Range": "bytes=-4", "Accept-Encoding": "gzip"})
+    assert response.status_code == 206
+    assert "content-encoding" not in response.headers
+    assert response.content == CONTENT[-4:]
+    assert response.headers["content-range"] == f"bytes 16-19/{len(CONTENT)}"
+    # If-Range与ETag不一致时发送完整内容
+    response = client.get("/stored", headers={"Range": "bytes=0-1", "If-Range": '"stale"', "Accept-Encoding": "identity"})
+    assert response.status_code == 200 and response.content == CONTENT
+    assert client.get("/stored", headers={"Range": "bytes=50-", "Accept-Encoding": "identity"}).status_code == 416
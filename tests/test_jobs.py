@@ -0,0 +1,107 @@
+import os
+import time
+import pytest
+from api.jobs import (
+    JobStore, JobScheduler, STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED, STATUS_CANCELLED, JOB_RETENTION
+)
+from api.lifecycle import lifecycle
+from api.models import APIConfig
+
+CONFIG = APIConfig(api_url="http://llm.invalid", api_key="k", model_name="m")
+# 不存在的进程号
+DEAD_PID = 2 ** 22 + 1
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    yield store
+    store.close()
+
+
+def _job(store, status=STATUS_QUEUED, **fields):
+    job = store.create("in.txt", "转换为JSON", CONFIG)
+    if status != STATUS_QUEUED or fields:
+        store.update(job["id"], status=status, **fields)
+    return job["id"]
+
+
+def test_claim_only_once(store, tmp_path):
+    job_id = _job(store)
+    other = JobStore(str(tmp_path / "jobs.db"))
+    assert store.claim(job_id)
+    assert not other.claim(job_id)
+    job = store.get(job_id)
+    assert job["status"] == STATUS_RUNNING and job["worker"] == os.getpid()
+    other.close()
+
+
+def test_cancel_only_queued(store):
+    queued, running = _job(store), _job(store)
+    store.claim(running)
+    assert store.cancel(queued) and not store.cancel(running)
+    job = store.get(queued)
+    assert job["status"] == STATUS_CANCELLED and job["api_config"] is None
+    assert not store.claim(queued)
+
+
+def test_recover_at_startup(store):
+    queued = _job(store)
+    interrupted = _job(store, STATUS_RUNNING, worker=os.getpid())
+    alive = _job(store, STATUS_RUNNING, worker=1)
+    # 任务库不共用时所有执行中的任务都已中断
+    assert [job["id"] for job in store.recover()] == [queued, interrupted, alive]
+    assert store.get(alive)["status"] == STATUS_QUEUED
+
+
+def test_recover_shared_keeps_live_workers(store):
+    dead = _job(store, STATUS_RUNNING, worker=DEAD_PID)
+    alive = _job(store, STATUS_RUNNING, worker=1)
+    recovered = [job["id"] for job in store.recover(shared=True)]
+    assert recovered == [dead]
+    assert store.get(alive)["status"] == STATUS_RUNNING
+
+
+def test_periodic_reclaim(store):
+    mine = _job(store, STATUS_RUNNING, worker=os.getpid())
+    dead = _job(store, STATUS_RUNNING, worker=DEAD_PID)
+    fresh = _job(store)
+    # 运行中只接管其他已退出进程的任务和排队过久的任务
+    assert [job["id"] for job in store.recover(True, time.time() - 60)] == [dead]
+    assert store.get(mine)["status"] == STATUS_RUNNING
+    assert {job["id"] for job in store.recover(True, time.time() + 1)} == {dead, fresh}
+
+
+def test_adopt_outputs_once(store, tmp_path):
+    job_id = _job(store, STATUS_SUCCEEDED, output_file="out.txt", worker=DEAD_PID, finished_at=time.time())
+    _job(store, STATUS_SUCCEEDED, output_file="live.txt", worker=1, finished_at=time.time())
+    assert store.adopt_outputs(True, False) == ["out.txt"]
+    assert store.adopt_outputs(True, False) == []
+    assert store.get(job_id)["worker"] == os.getpid()
+
+
+def test_cleanup_releases_held_output(store, tmp_path):
+    output = tmp_path / "out.txt"
+    output.write_text("done", encoding="utf-8")
+    job_id = _job(store, STATUS_SUCCEEDED, output_file=str(output), worker=os.getpid(),
+                  finished_at=time.time() - JOB_RETENTION - 1)
+    scheduler = JobScheduler(store, 1, 10)
+    lifecycle.acquire(str(output))
+    # 结果正在下载时保留任务，释放后再清理
+    with lifecycle.hold(str(output)):
+        assert scheduler.cleanup() == 0
+    assert output.exists() and store.get(job_id) is not None
+    assert scheduler.cleanup() == 1
+    assert not output.exists() and store.get(job_id) is None
+    assert lifecycle.stats()["held"] == 0
+
+
+def test_scheduler_fair_between_tenants(store):
+    scheduler = JobScheduler(store, 1, 10)
+    for i in range(3):
+        scheduler._push(f"a{i}", "tenant-a", 0)
+    scheduler._push("b0", "tenant-b", 0)
+    scheduler._push("urgent", "tenant-b", 5)
+    order = [scheduler._pop() for _ in range(5)]
+    assert order == ["urgent", "a0", "b0", "a1", "a2"]
+    assert scheduler._pop() is None and not scheduler._pending
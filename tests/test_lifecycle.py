@@ -0,0 +1,71 @@
+import os
+import time
+import pytest
+from api.lifecycle import LifecycleManager, DirQuota, LIFECYCLE_MIN_AGE
+
+
+def _file(directory, name: str, age: float = 0, size: int = 10) -> str:
+    path = os.path.join(str(directory), name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    if age:
+        used_at = time.time() - age
+        os.utime(path, (used_at, used_at))
+    return path
+
+
+@pytest.fixture
+def manager():
+    return LifecycleManager()
+
+
+def test_refcount(manager, tmp_path):
+    path = _file(tmp_path, "a.txt")
+    manager.acquire(path, None)
+    manager.acquire(path)
+    manager.release(path)
+    assert not manager.remove(path)
+    manager.release(path)
+    assert manager.remove(path)
+    assert not os.path.exists(path)
+    # 多余的释放不影响其他路径
+    manager.release(path)
+    assert manager.stats()["held"] == 0
+
+
+def test_held_directory_protects_files(manager, tmp_path):
+    path = _file(tmp_path, "batch/a.txt")
+    with manager.hold(str(tmp_path / "batch")):
+        assert not manager.remove(path)
+    assert manager.remove(path)
+
+
+def test_sweep_removes_expired_files(manager, tmp_path):
+    old = _file(tmp_path, "ab/old.txt", age=7200)
+    held = _file(tmp_path, "ab/held.txt", age=7200)
+    protected = _file(tmp_path, "ab/protected.txt", age=7200)
+    recent = _file(tmp_path, "ab/recent.txt", age=LIFECYCLE_MIN_AGE / 2)
+    manager.manage(str(tmp_path), DirQuota(max_age=60))
+    manager.add_protector(lambda: [protected])
+    manager.acquire(held)
+    assert manager.sweep() == 1
+    assert not os.path.exists(old)
+    assert all(os.path.exists(path) for path in (held, protected, recent))
+
+
+def test_sweep_evicts_least_recently_used_over_quota(manager, tmp_path):
+    paths = [_file(tmp_path, f"ab/{i}.txt", age=LIFECYCLE_MIN_AGE + 100 * (3 - i), size=100) for i in range(3)]
+    manager.manage(str(tmp_path), DirQuota(max_bytes=150))
+    assert manager.sweep() == 2
+    assert [os.path.exists(path) for path in paths] == [False, False, True]
+    assert manager.usage[str(tmp_path)] == {"files": 1, "bytes": 100}
+
+
+def test_shards_only_keeps_top_level_files(manager, tmp_path):
+    top = _file(tmp_path, "bench.py", age=7200)
+    shard = _file(tmp_path, "3f/gen.py", age=7200)
+    other = _file(tmp_path, "work/gen.py", age=7200)
+    manager.manage(str(tmp_path), DirQuota(max_age=60, suffix=".py", shards_only=True))
+    assert manager.sweep() == 1
+    assert os.path.exists(top) and os.path.exists(other) and not os.path.exists(shard)
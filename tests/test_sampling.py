@@ -0,0 +1,62 @@
+from api.sampling import (
+    sample_file, sample_text, read_file_windows, estimate_tokens, _window_offsets, _window_lines,
+    SAMPLE_GAP, SAMPLE_WINDOWS, SAMPLE_WINDOW_BYTES, SAMPLE_MAX_LINE_CHARS
+)
+
+
+def _log_lines(count: int):
+    lines = ["time,level,message"]
+    for i in range(count):
+        if i % 50 == 0:
+            lines.append(f"2024-01-01 00:00:{i % 60:02d} WARN disk usage {i}%")
+        else:
+            lines.append(f"2024-01-01,INFO,request {i} done")
+    return lines
+
+
+def test_window_offsets():
+    size = 10 ** 7
+    offsets = _window_offsets(size)
+    assert offsets[0] == 0 and offsets[-1] == size - SAMPLE_WINDOW_BYTES
+    assert offsets == sorted(set(offsets)) and len(offsets) == SAMPLE_WINDOWS + 2
+
+
+def test_window_lines_drop_partial_lines():
+    assert _window_lines("ial\nfull\nparti", False, False) == ["full"]
+    assert _window_lines("head\nfull\n", True, True) == ["head", "full"]
+    assert _window_lines("a\r\nb", True, True) == ["a", "b"]
+    long_line = "x" * (SAMPLE_MAX_LINE_CHARS + 10)
+    assert _window_lines(long_line, True, True) == ["x" * SAMPLE_MAX_LINE_CHARS + "…"]
+
+
+def test_small_file_returned_whole(tmp_path):
+    path = tmp_path / "small.csv"
+    path.write_bytes("\ufeffname,age\n张三,20\n".encode("utf-8"))
+    assert sample_file(str(path)) == "name,age\n张三,20"
+
+
+def test_large_file_sample(tmp_path):
+    lines = _log_lines(100000)
+    path = tmp_path / "big.log"
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    windows, complete = read_file_windows(str(path))
+    assert not complete and len(windows) == SAMPLE_WINDOWS + 2
+
+    sample = sample_file(str(path), budget=600)
+    parts = sample.split("\n")
+    assert parts[0] == "time,level,message"
+    assert parts[-1] == lines[-1]
+    assert SAMPLE_GAP in parts
+    # 示例中只有完整的行，且覆盖了较少出现的行结构
+    known = set(lines)
+    assert all(part in known for part in parts if part != SAMPLE_GAP)
+    assert any(" WARN " in part for part in parts)
+    assert estimate_tokens(sample) <= 600 * 1.2
+
+
+def test_text_sample_matches_file_sample(tmp_path):
+    text = "\n".join(_log_lines(5)) + "\n"
+    assert sample_text(text) == text
+    big = "\n".join(_log_lines(100000)) + "\n"
+    sample = sample_text(big, budget=400)
+    assert sample.startswith("time,level,message\n") and SAMPLE_GAP in sample
@@ -0,0 +1,104 @@
+import os
+import time
+import pytest
+from api.shared_store import SharedStore, SQLiteBackend
+from api.script_cache import ScriptCache, make_cache_key, data_fingerprint, normalize_instruction
+
+
+@pytest.fixture
+def cache(tmp_path):
+    store = SharedStore(SQLiteBackend(str(tmp_path / "store.db")))
+    yield ScriptCache(store, max_entries=2)
+    store.backend.close()
+
+
+def _script(tmp_path, name: str) -> str:
+    path = tmp_path / f"{name}.py"
+    path.write_text(f"# {name}\n", encoding="utf-8")
+    return str(path)
+
+
+def test_key_ignores_instruction_formatting_and_values():
+    assert normalize_instruction("  转换为  JSON。") == "转换为 json"
+    a = make_cache_key("转换为JSON", "name,age\nTom,20\nAmy,31", "gpt-4")
+    b = make_cache_key("  转换为json。", "name,age\nBob,45\nEve,7", "gpt-4")
+    assert a == b
+
+
+def test_key_depends_on_shape_model_and_mode():
+    key = make_cache_key("转换为JSON", "name,age\nTom,20", "gpt-4")
+    assert make_cache_key("转换为JSON", "name;age\nTom;20", "gpt-4") != key
+    assert make_cache_key("转换为JSON", "name,age\nTom,20", "other") != key
+    assert make_cache_key("转换为JSON", "name,age\nTom,20", "gpt-4", mode="lines") != key
+
+
+def test_fingerprint_ignores_row_order():
+    assert data_fingerprint("h\n1,a\nb,2") == data_fingerprint("h\nb,2\n1,a")
+    assert data_fingerprint("h\n1,a") != data_fingerprint("1,a\nh")
+
+
+def test_hit_and_miss_stats(cache, tmp_path):
+    assert cache.get("k1") is None
+    cache.put("k1", _script(tmp_path, "a"), instruction="x")
+    entry = cache.get("k1")
+    assert entry["script_path"] == str(tmp_path / "a.py")
+    assert "content" not in entry
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_lru_eviction_removes_script(cache, tmp_path):
+    paths = {}
+    for name in ("a", "b"):
+        paths[name] = _script(tmp_path, name)
+        cache.put(name, paths[name])
+        time.sleep(0.01)
+    # 访问a之后b成为最久未使用的条目
+    assert cache.get("a") is not None
+    time.sleep(0.01)
+    cache.put("c", _script(tmp_path, "c"))
+    assert cache.get("b") is None
+    assert not os.path.exists(paths["b"])
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_pinned_entries_are_not_evicted(cache, tmp_path):
+    cache.put("a", _script(tmp_path, "a"))
+    assert cache.pin("a")
+    for name in ("b", "c", "d"):
+        time.sleep(0.01)
+        cache.put(name, _script(tmp_path, name))
+    assert cache.get("a") is not None
+    assert cache.pinned_paths() == [str(tmp_path / "a.py")]
+    assert not cache.pin("missing")
+
+
+def test_ttl_expiry(tmp_path, monkeypatch):
+    store = SharedStore(SQLiteBackend(str(tmp_path / "store.db")))
+    cache = ScriptCache(store, max_entries=10, ttl=60)
+    path = _script(tmp_path, "a")
+    cache.put("a", path)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert cache.get("a") is None
+    assert not os.path.exists(path)
+
+
+def test_invalidate_and_rematerialize(cache, tmp_path):
+    path = _script(tmp_path, "a")
+    cache.put("a", path)
+    # 本地脚本文件丢失时按条目中的内容写出
+    os.remove(path)
+    assert cache.get("a") is not None
+    assert open(path, encoding="utf-8").read() == "# a\n"
+    assert cache.invalidate("a")
+    assert not os.path.exists(path)
+    assert cache.get("a") is None
+    assert not cache.invalidate("a")
+
+
+def test_first_publisher_wins(cache, tmp_path):
+    first = cache.put("k", _script(tmp_path, "first"))
+    second = cache.put("k", _script(tmp_path, "second"))
+    assert second["script_path"] == first["script_path"] == str(tmp_path / "first.py")
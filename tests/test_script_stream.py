@@ -0,0 +1,41 @@
+import pytest
+from api.progress import Progress
+from api.utils import ScriptStream
+
+
+def _feed(run, chunks):
+    """依次送入各段内容，返回(代码块结束时的段序号, 截止后的内容)"""
+    async def scenario():
+        stream = ScriptStream(Progress())
+        for index, chunk in enumerate(chunks):
+            if stream.feed(chunk):
+                return index, stream.text
+        return None, stream.text
+
+    return run(scenario())
+
+
+CODE = "```python\nimport sys\n\ndef convert_text(i, o):\n    pass\n```"
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, len(CODE)])
+def test_fence_split_across_chunks(run, size):
+    content = "下面是脚本：\n" + CODE + "\n\n说明：这个脚本……"
+    chunks = [content[i:i + size] for i in range(0, len(content), size)]
+    index, text = _feed(run, chunks)
+    assert text == "下面是脚本：\n" + CODE
+    # 收到结束标记的那一段就停止
+    assert index == (len("下面是脚本：\n" + CODE) - 1) // size
+
+
+def test_inline_backticks_do_not_close_block(run):
+    chunks = ["```py\n", 'x = "```"\n', "y = 1\n", "```", "\n后文"]
+    index, text = _feed(run, chunks)
+    assert index == 3
+    assert text == '```py\nx = "```"\ny = 1\n```'
+
+
+def test_empty_block_and_unterminated_block(run):
+    assert _feed(run, ["```python\n", "```\n"]) == (1, "```python\n```")
+    assert _feed(run, ["```python\n", "print(1)\n", "``"]) == (None, "```python\nprint(1)\n``")
+    assert _feed(run, ["没有代码块", "，只有文字"]) == (None, "没有代码块，只有文字")
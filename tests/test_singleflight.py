@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from api.singleflight import SingleFlight, flight_key
+
+
+class Flight:
+    """记录执行次数和清理次数的执行函数，set之前一直等待"""
+
+    def __init__(self, value="result", error=None):
+        self.value = value
+        self.error = error
+        self.calls = 0
+        self.cleanups = 0
+        self.gate = asyncio.Event()
+
+    def cleanup(self):
+        self.cleanups += 1
+
+    async def __call__(self):
+        self.calls += 1
+        await self.gate.wait()
+        if self.error:
+            raise self.error
+        return self.value, self.cleanup
+
+
+def test_flight_key_separates_fields():
+    assert flight_key("d", "a", "m") != flight_key("d", "a", "m", kind="stream")
+    assert flight_key("d", "ab", "m") != flight_key("d", "a", "bm")
+
+
+def test_concurrent_requests_share_one_execution(run):
+    async def scenario():
+        flights = SingleFlight(ttl=5, max_results=8)
+        fn = Flight()
+        first = asyncio.ensure_future(flights.do("k", fn))
+        second = asyncio.ensure_future(flights.do("k", fn))
+        await asyncio.sleep(0)
+        fn.gate.set()
+        (lease1, shared1), (lease2, shared2) = await asyncio.gather(first, second)
+        assert fn.calls == 1
+        assert lease1 is lease2 and lease1.value == "result"
+        assert (shared1, shared2) == (False, True)
+        # 紧接着到达的相同请求复用保留的结果
+        lease3, shared3 = await flights.do("k", fn)
+        assert shared3 and fn.calls == 1
+        for lease in (lease1, lease2, lease3):
+            flights.release(lease)
+        assert fn.cleanups == 0
+        # 保留的结果被清理后才释放
+        flights.clear()
+        assert fn.cleanups == 1
+
+    run(scenario())
+
+
+def test_cancelled_waiter_does_not_cancel_flight(run):
+    async def scenario():
+        flights = SingleFlight(ttl=5, max_results=8)
+        fn = Flight()
+        leader = asyncio.ensure_future(flights.do("k", fn))
+        follower = asyncio.ensure_future(flights.do("k", fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        fn.gate.set()
+        lease, shared = await follower
+        assert lease.value == "result" and shared
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert fn.calls == 1
+        flights.release(lease)
+        flights.clear()
+        assert fn.cleanups == 1
+
+    run(scenario())
+
+
+def test_failures_are_shared_but_not_kept(run):
+    async def scenario():
+        flights = SingleFlight(ttl=5, max_results=8)
+        failing = Flight(error=RuntimeError("boom"))
+        waiters = [asyncio.ensure_future(flights.do("k", failing)) for _ in range(2)]
+        await asyncio.sleep(0)
+        failing.gate.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert failing.calls == 1
+        # 失败的结果不保留，下一个请求重新执行
+        retry = Flight()
+        retry.gate.set()
+        lease, shared = await flights.do("k", retry)
+        assert not shared and retry.calls == 1
+        flights.release(lease)
+        flights.clear()
+
+    run(scenario())
+
+
+def test_oldest_result_released_beyond_limit(run):
+    async def scenario():
+        flights = SingleFlight(ttl=5, max_results=1)
+        first, second = Flight("a"), Flight("b")
+        first.gate.set()
+        second.gate.set()
+        lease, _ = await flights.do("a", first)
+        flights.release(lease)
+        lease, _ = await flights.do("b", second)
+        assert first.cleanups == 1 and second.cleanups == 0
+        flights.release(lease)
+        flights.clear()
+
+    run(scenario())
@@ -0,0 +1,139 @@
+import json
+import pytest
+from api import utils
+from api.models import APIConfig
+from api.sampling import sample_file, SAMPLE_MAX_LINE_CHARS
+from api.script_cache import script_cache
+from api.validation import (
+    validate_script, needs_repair, ValidationFailure, ScriptValidationError, _head_of_file,
+    VALIDATION_INPUT_BYTES, VALIDATION_MAX_REPAIRS
+)
+
+JSONL_SCRIPT = """import json
+
+def convert_text(input_file, output_file):
+    with open(input_file, encoding="utf-8") as f, open(output_file, "w", encoding="utf-8") as out:
+        for line in f:
+            if line.strip():
+                out.write(json.loads(line)["name"] + "\\n")
+"""
+
+JSON_SCRIPT = """import json
+
+def convert_text(input_file, output_file):
+    with open(input_file, encoding="utf-8") as f:
+        data = json.load(f)
+    with open(output_file, "w", encoding="utf-8") as out:
+        out.write("\\n".join(item["name"] for item in data))
+"""
+
+SWALLOWING_SCRIPT = """def convert_text(input_file, output_file):
+    try:
+        raise ValueError("bad row")
+    except Exception as e:
+        print(f"Error: {e}")
+    open(output_file, "w").close()
+"""
+
+EMPTY_SCRIPT = """def convert_text(input_file, output_file):
+    open(output_file, "w").close()
+"""
+
+
+def _write(tmp_path, name: str, content: str) -> str:
+    path = tmp_path / name
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture
+def jsonl_file(tmp_path):
+    # 每行超过示例数据的截断长度，提示词中的示例行是不完整的JSON
+    rows = [json.dumps({"name": f"user{i}", "bio": "x" * (SAMPLE_MAX_LINE_CHARS * 2)}) for i in range(50)]
+    return _write(tmp_path, "input.jsonl", "\n".join(rows) + "\n")
+
+
+def test_head_of_file(tmp_path, jsonl_file):
+    head, complete = _head_of_file(jsonl_file)
+    assert complete and head == open(jsonl_file, encoding="utf-8").read()
+    big = _write(tmp_path, "big.txt", "line\n" * VALIDATION_INPUT_BYTES)
+    head, complete = _head_of_file(big)
+    assert not complete and head.endswith("line\n") and len(head) <= VALIDATION_INPUT_BYTES
+
+
+def test_validates_on_real_input_not_clipped_sample(tmp_path, jsonl_file):
+    script = _write(tmp_path, "s.py", JSONL_SCRIPT)
+    sample = sample_file(jsonl_file)
+    # 截断过长行的示例上正确的脚本也会出错
+    assert validate_script(script, sample, "提取name字段").kind == "error"
+    assert validate_script(script, sample, "提取name字段", input_file=jsonl_file) is None
+
+
+def test_error_on_clipped_input_is_inconclusive(tmp_path):
+    items = [{"name": f"user{i}", "bio": "y" * 100} for i in range(VALIDATION_INPUT_BYTES // 50)]
+    document = _write(tmp_path, "doc.json", json.dumps(items, indent=1))
+    script = _write(tmp_path, "s.py", JSON_SCRIPT)
+    failure = validate_script(script, "", "输出每个name", input_file=document)
+    assert failure.kind == "inconclusive"
+    assert not needs_repair(failure, 0)
+    small = _write(tmp_path, "small.json", "[{\"nam\": 1}]")
+    assert validate_script(script, "", "输出每个name", input_file=small).kind == "error"
+
+
+def test_suspect_and_empty_output(tmp_path, jsonl_file):
+    swallowing = _write(tmp_path, "swallow.py", SWALLOWING_SCRIPT)
+    assert validate_script(swallowing, "", "转换为CSV", input_file=jsonl_file).kind == "suspect"
+    empty = _write(tmp_path, "empty.py", EMPTY_SCRIPT)
+    assert validate_script(empty, "", "转换为CSV", input_file=jsonl_file).kind == "suspect"
+    # 筛选类的格式要求在输入开头没有匹配的内容是正常的
+    assert validate_script(empty, "", "提取所有邮箱地址", input_file=jsonl_file) is None
+
+
+def test_needs_repair_limits():
+    error = ValidationFailure("error", "boom")
+    suspect = ValidationFailure("suspect", "empty")
+    assert not needs_repair(None, 0)
+    assert needs_repair(error, 0) and needs_repair(suspect, 0)
+    assert not needs_repair(suspect, VALIDATION_MAX_REPAIRS)
+    with pytest.raises(ScriptValidationError):
+        needs_repair(error, VALIDATION_MAX_REPAIRS)
+
+
+def _fake_llm(monkeypatch, scripts):
+    """按顺序返回给定的脚本，记录收到的请求"""
+    payloads = []
+
+    async def post_chat_completion(api_config, payload):
+        payloads.append(payload)
+        content = scripts[min(len(payloads), len(scripts)) - 1]
+        return {"choices": [{"message": {"content": f"```python\n{content}```"}}]}
+
+    monkeypatch.setattr(utils, "post_chat_completion", post_chat_completion)
+    return payloads
+
+
+def test_repair_loop(run, monkeypatch, tmp_path, jsonl_file):
+    payloads = _fake_llm(monkeypatch, [JSON_SCRIPT, JSONL_SCRIPT])
+    config = APIConfig(api_url="http://llm.invalid", api_key="k", model_name="repair-test")
+    sample = sample_file(jsonl_file)
+    script_path, content = run(utils.generate_python_script_async(
+        sample, "输出name字段", config, input_file=jsonl_file
+    ))
+    assert content == JSONL_SCRIPT.strip()
+    assert len(payloads) == 2
+    feedback = payloads[1]["messages"][-1]["content"]
+    assert "试运行没有通过" in feedback and "JSONDecodeError" in feedback
+    # 通过验证的脚本写入缓存，之后相同的请求不再调用大模型
+    assert run(utils.generate_python_script_async(sample, "输出name字段", config, input_file=jsonl_file))[0] == script_path
+    assert len(payloads) == 2
+    script_cache.clear(include_pinned=True)
+
+
+def test_repair_loop_gives_up(run, monkeypatch, jsonl_file):
+    payloads = _fake_llm(monkeypatch, [JSON_SCRIPT])
+    config = APIConfig(api_url="http://llm.invalid", api_key="k", model_name="give-up-test")
+    with pytest.raises(ScriptValidationError):
+        run(utils.generate_python_script_async(sample_file(jsonl_file), "输出name字段", config, input_file=jsonl_file))
+    assert len(payloads) == VALIDATION_MAX_REPAIRS + 1
+    # 未通过验证的脚本不写入缓存
+    assert script_cache.stats()["entries"] == 0
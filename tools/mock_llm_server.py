@@ -0,0 +1,164 @@
+"""
+本地模拟的大模型服务，用于在不调用真实API的情况下测试连接池、重试、对冲请求和故障切换
+
+兼容OpenAI的 /v1/chat/completions 接口，返回一个把文本转为大写的转换脚本。
+响应延迟服从对数正态分布，可以模拟长尾延迟；也可以按比例返回错误。
+请求带有 "stream": true 时以Server-Sent Events逐段返回，首段之前等待上述延迟，之后每段间隔
+--token-interval 秒，代码块之后还有一段说明文字（服务端应在代码块结束时停止读取）。
+指定 --scripts-dir 后，格式要求中带有 [workload:<名称>] 标记的请求返回该目录下文件名包含该名称的脚本，
+基准测试用它把 scripts/ 中保存的脚本作为固定负载。
+
+用法:
+    python -m tools.mock_llm_server --port 9911 --delay 0.5 --sigma 0.8 --error-rate 0.05
+"""
+import os
+import re
+import glob
+import math
+import json
+import random
+import asyncio
+import argparse
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_SCRIPT = '''def convert_text(input_file, output_file):
+    with open(input_file, "r", encoding="utf-8") as f:
+        content = f.read()
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write(content.upper())
+
+
+def convert_lines(lines):
+    for line in lines:
+        yield line.upper()
+'''
+
+# 模拟参数，可通过命令行或环境变量设置
+config = {
+    "delay": float(os.getenv("MOCK_LLM_DELAY", 0.5)),  # 延迟中位数（秒）
+    "sigma": float(os.getenv("MOCK_LLM_SIGMA", 0)),  # 对数正态分布的sigma，0表示固定延迟
+    "error_rate": float(os.getenv("MOCK_LLM_ERROR_RATE", 0)),  # 返回错误的比例
+    "error_status": int(os.getenv("MOCK_LLM_ERROR_STATUS", 503)),
+    "token_interval": float(os.getenv("MOCK_LLM_TOKEN_INTERVAL", 0.01)),  # 流式响应每段之间的间隔（秒）
+    "script": DEFAULT_SCRIPT,
+    "scripts_dir": os.getenv("MOCK_LLM_SCRIPTS_DIR")
+}
+stats = {"requests": 0, "errors": 0, "streams": 0, "stream_chunks": 0}
+
+# 流式响应每段的字符数，以及代码块之后的说明文字
+STREAM_CHUNK_CHARS = 16
+TRAILING_TEXT = "\n\n以上脚本读取输入文件，按要求转换后写入输出文件。" * 4
+
+WORKLOAD_PATTERN = re.compile(r"\[workload:([\w-]+)\]")
+_workload_scripts = {}
+
+app = FastAPI(title="模拟大模型服务")
+
+
+def _delay() -> float:
+    if config["sigma"] <= 0:
+        return config["delay"]
+    return config["delay"] * math.exp(random.gauss(0, config["sigma"]))
+
+
+def _script_for(messages: list) -> str:
+    """按请求中的负载标记选择返回的脚本，没有标记或找不到脚本时返回默认脚本"""
+    if not config["scripts_dir"]:
+        return config["script"]
+    for message in messages:
+        match = WORKLOAD_PATTERN.search(message.get("content", ""))
+        if match:
+            name = match.group(1)
+            if name not in _workload_scripts:
+                paths = sorted(glob.glob(os.path.join(config["scripts_dir"], f"*{name}*.py")))
+                _workload_scripts[name] = open(paths[0], "r", encoding="utf-8").read() if paths else None
+            if _workload_scripts[name]:
+                return _workload_scripts[name]
+    return config["script"]
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    await asyncio.sleep(_delay())
+    if random.random() < config["error_rate"]:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"message": "模拟的服务错误"}}, status_code=config["error_status"])
+    messages = body.get("messages", [])
+    script = _script_for(messages)
+    prompt_chars = sum(len(message.get("content", "")) for message in messages)
+    usage = {
+        "prompt_tokens": prompt_chars // 4,
+        "completion_tokens": len(script) // 4,
+        "total_tokens": (prompt_chars + len(script)) // 4
+    }
+    if body.get("stream"):
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        return StreamingResponse(_stream(body, f"```python\n{script}```{TRAILING_TEXT}", usage, include_usage),
+                                 media_type="text/event-stream")
+    return {
+        "id": f"mock-{stats['requests']}",
+        "object": "chat.completion",
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": f"```python\n{script}```"},
+            "finish_reason": "stop"
+        }],
+        "usage": usage
+    }
+
+
+async def _stream(body: dict, content: str, usage: dict, include_usage: bool):
+    stats["streams"] += 1
+    chunk_id = f"mock-{stats['requests']}"
+
+    def event(choices: list, **extra) -> bytes:
+        data = {"id": chunk_id, "object": "chat.completion.chunk", "model": body.get("model", "mock"),
+                "choices": choices, **extra}
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+    for start in range(0, len(content), STREAM_CHUNK_CHARS):
+        if start:
+            await asyncio.sleep(config["token_interval"])
+        stats["stream_chunks"] += 1
+        yield event([{"index": 0, "delta": {"content": content[start:start + STREAM_CHUNK_CHARS]},
+                      "finish_reason": None}])
+    yield event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    if include_usage:
+        yield event([], usage=usage)
+    yield b"data: [DONE]\n\n"
+
+
+@app.get("/stats")
+async def get_stats():
+    return {**stats, **{key: value for key, value in config.items() if key not in ("script", "scripts_dir")}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的大模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9911)
+    parser.add_argument("--delay", type=float, default=config["delay"], help="延迟中位数（秒）")
+    parser.add_argument("--sigma", type=float, default=config["sigma"], help="延迟对数正态分布的sigma")
+    parser.add_argument("--error-rate", type=float, default=config["error_rate"], help="返回错误的比例")
+    parser.add_argument("--error-status", type=int, default=config["error_status"], help="错误响应的状态码")
+    parser.add_argument("--token-interval", type=float, default=config["token_interval"],
+                        help="流式响应每段之间的间隔（秒）")
+    parser.add_argument("--script", help="返回的脚本文件，默认返回转为大写的脚本")
+    parser.add_argument("--scripts-dir", default=config["scripts_dir"], help="按 [workload:<名称>] 标记选择脚本的目录")
+    args = parser.parse_args()
+
+    config.update(delay=args.delay, sigma=args.sigma, error_rate=args.error_rate, error_status=args.error_status,
+                  token_interval=args.token_interval, scripts_dir=args.scripts_dir)
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            config["script"] = f.read()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
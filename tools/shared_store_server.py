@@ -0,0 +1,128 @@
+"""
+共享存储服务的本地替身，用于测试网络共享存储后端（SHARED_STORE_BACKEND=http）
+
+提供 api/shared_store.py 中 HTTPBackend 使用的接口：条目的读取、原子发布、批量写回命中统计、
+固定、删除、一致淘汰，以及转换结果文件（blob）的上传和下载。条目保存在SQLite（WAL）数据库中，
+发布和淘汰的原子性由数据库事务保证；被淘汰或删除的条目对应的blob一并删除。
+
+用法:
+    python -m tools.shared_store_server --port 9920 --data shared_store_data
+    SHARED_STORE_BACKEND=http SHARED_STORE_URL=http://127.0.0.1:9920 python main.py
+"""
+import os
+import argparse
+import uvicorn
+from typing import Dict, List, Tuple
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+
+
+def create_app(data_dir: str) -> FastAPI:
+    os.makedirs(data_dir, exist_ok=True)
+    # 本服务进程内的全局共享存储也指向替身自己的数据库
+    os.environ["SHARED_STORE_BACKEND"] = "sqlite"
+    os.environ["SHARED_STORE_PATH"] = os.path.join(data_dir, "store.db")
+    from api.shared_store import create_backend
+
+    backend = create_backend("sqlite", os.environ["SHARED_STORE_PATH"])
+    blob_dir = os.path.join(data_dir, "blobs")
+    app = FastAPI(title="共享存储服务（本地替身）")
+
+    def blob_path(namespace: str, key: str) -> str:
+        return os.path.join(blob_dir, namespace, key[:2], key)
+
+    def remove_blobs(namespace: str, records: List[Dict]):
+        for record in records:
+            try:
+                os.remove(blob_path(namespace, record["key"]))
+            except OSError:
+                pass
+
+    @app.get("/v1/{namespace}")
+    async def list_entries(namespace: str, pinned_only: bool = False):
+        return await run_in_threadpool(backend.list, namespace, pinned_only)
+
+    @app.get("/v1/{namespace}/_count")
+    async def count_entries(namespace: str):
+        entries, pinned = await run_in_threadpool(backend.count, namespace)
+        return {"entries": entries, "pinned": pinned}
+
+    @app.post("/v1/{namespace}/_touch")
+    async def touch_entries(namespace: str, body: Dict):
+        usage: Dict[str, Tuple[int, float]] = {key: tuple(value) for key, value in body["usage"].items()}
+        await run_in_threadpool(backend.touch, namespace, usage)
+        return {"updated": len(usage)}
+
+    @app.post("/v1/{namespace}/_evict")
+    async def evict_entries(namespace: str, body: Dict):
+        victims = await run_in_threadpool(backend.evict, namespace, body["max_entries"], body["ttl"], body["now"])
+        await run_in_threadpool(remove_blobs, namespace, victims)
+        return victims
+
+    @app.post("/v1/{namespace}/_clear")
+    async def clear_entries(namespace: str, body: Dict):
+        removed = await run_in_threadpool(backend.clear, namespace, body["include_pinned"])
+        await run_in_threadpool(remove_blobs, namespace, removed)
+        return removed
+
+    @app.get("/v1/{namespace}/{key}")
+    async def get_entry(namespace: str, key: str):
+        record = await run_in_threadpool(backend.get, namespace, key)
+        if record is None:
+            raise HTTPException(status_code=404, detail="条目不存在")
+        return record
+
+    @app.post("/v1/{namespace}/{key}")
+    async def publish_entry(namespace: str, key: str, body: Dict):
+        record, published = await run_in_threadpool(backend.publish, namespace, key, body["value"], body["now"])
+        return {"record": record, "published": published}
+
+    @app.patch("/v1/{namespace}/{key}")
+    async def pin_entry(namespace: str, key: str, body: Dict):
+        if not await run_in_threadpool(backend.set_pinned, namespace, key, bool(body["pinned"])):
+            raise HTTPException(status_code=404, detail="条目不存在")
+        return {"pinned": bool(body["pinned"])}
+
+    @app.delete("/v1/{namespace}/{key}")
+    async def delete_entry(namespace: str, key: str):
+        record = await run_in_threadpool(backend.delete, namespace, key)
+        if record is None:
+            raise HTTPException(status_code=404, detail="条目不存在")
+        await run_in_threadpool(remove_blobs, namespace, [record])
+        return record
+
+    @app.put("/blobs/{namespace}/{key}")
+    async def put_blob(namespace: str, key: str, request: Request):
+        path = blob_path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{id(request)}.tmp"
+        size = 0
+        with open(temp_path, "wb") as f:
+            async for chunk in request.stream():
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(temp_path, path)
+        return {"size": size}
+
+    @app.get("/blobs/{namespace}/{key}")
+    async def get_blob(namespace: str, key: str):
+        path = blob_path(namespace, key)
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="文件不存在")
+        return FileResponse(path, media_type="application/octet-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共享存储服务的本地替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9920)
+    parser.add_argument("--data", default="shared_store_data", help="数据目录")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.data), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()